@@ -0,0 +1,14 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Performance measurements for the serverside application.
+
+    Every module in this package can be run as a script, for example
+
+        python -m benchmarks.session_rotation
+
+    from the repository root. The benchmarks use the same self-contained
+    fixtures as the test suite, but with an on-disk SQLite database so
+    that commits cost what they cost in production.
+"""
@@ -0,0 +1,106 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Private memory per worker process and challenge generation speed
+    of in-memory captcha sets versus the memory-mapped captcha index.
+
+    Memory is read from /proc, so this only works on Linux.
+"""
+
+import json
+from multiprocessing import Process, Queue
+from os.path import join
+from random import SystemRandom
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from daycare_ethics.server.captcha_index import load_index
+from daycare_ethics.server.security import NORMALS, ODDBALLS
+
+from .common import rate, report
+
+
+CATEGORIES = 40
+WORDS = 300  # per category
+ROUNDS = 20000
+
+
+def sample_data():
+    """ Categories of made-up words with a slight overlap. """
+    return dict(
+        ('category{}'.format(c), [
+            u'word{}'.format(c * WORDS + w - c % 3) for w in range(WORDS)
+        ])
+        for c in range(CATEGORIES)
+    )
+
+
+def private_memory():
+    """ Kilobytes of memory that this process does not share. """
+    total = 0
+    with open('/proc/self/smaps') as smaps:
+        for line in smaps:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                total += int(line.split()[1])
+    return total
+
+
+def load_sets(source):
+    """ The approach before the index: sets and difference tables. """
+    categories = map(set, json.load(open(source)).values())
+    tables = [
+        (tuple(normalset), tuple(oddballset - normalset))
+        for normalset in categories
+        for oddballset in categories
+        if oddballset is not normalset
+    ]
+    def challenge(dice):
+        normalwords, oddballwords = dice.choice(tables)
+        oddones = dice.sample(oddballwords, ODDBALLS)
+        united = dice.sample(normalwords, NORMALS) + oddones
+        dice.shuffle(united)
+        return ' '.join(united), [word.lower() for word in oddones]
+    return challenge
+
+
+def load_mapped(source, path):
+    return load_index(source, path, NORMALS, ODDBALLS).challenge
+
+
+def worker(results, load, *args):
+    before = private_memory()
+    challenge = load(*args)
+    dice = SystemRandom()
+    speed = rate(lambda: challenge(dice), ROUNDS)
+    results.put((private_memory() - before, speed))
+
+
+def measure(load, *args):
+    results = Queue()
+    process = Process(target=worker, args=(results, load) + args)
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+if __name__ == '__main__':
+    directory = mkdtemp('daycare_ethics_benchmark')
+    try:
+        source = join(directory, 'captcha.json')
+        path = join(directory, 'captcha.index')
+        with open(source, 'wb') as data:
+            json.dump(sample_data(), data)
+        load_mapped(source, path)  # compile once, like the first worker
+        sets_memory, sets_speed = measure(load_sets, source)
+        index_memory, index_speed = measure(load_mapped, source, path)
+    finally:
+        rmtree(directory)
+    report('{} categories x {} words, {} challenges'.format(
+            CATEGORIES, WORDS, ROUNDS ), [
+        ('sets, private memory (KiB)', sets_memory),
+        ('index, private memory (KiB)', index_memory),
+        ('sets (challenges/s)', '{:.0f}'.format(sets_speed)),
+        ('index (challenges/s)', '{:.0f}'.format(index_speed)),
+    ])
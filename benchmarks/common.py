@@ -0,0 +1,54 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Fixtures and timing helpers shared by the benchmarks.
+"""
+
+from os.path import join
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+
+from daycare_ethics import create_app, db
+from daycare_ethics.tests.common_fixtures import FixtureConfiguration
+
+
+HEADERS = {
+    'User-Agent': 'Benchmark client',
+    'Referer': 'benchmark',
+}
+
+
+def make_app(**settings):
+    """ Create an application with an on-disk database in a temp dir.
+
+    Call `destroy_app` when you are done with it.
+    """
+    tmpdir = mkdtemp('daycare_ethics_benchmark')
+    config = type('BenchmarkConfiguration', (FixtureConfiguration,), dict(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + join(tmpdir, 'bench.sqlite'),
+        TESTING=False,
+        **settings ))
+    return create_app(config_obj=config, instance=tmpdir)
+
+
+def destroy_app(app):
+    db.drop_all(app=app)
+    rmtree(app.instance_path)
+
+
+def rate(function, count):
+    """ Call `function` `count` times; return calls per second. """
+    start = time()
+    for i in xrange(count):
+        function()
+    return count / (time() - start)
+
+
+def report(title, rows):
+    """ Print (label, value) pairs as an aligned table. """
+    print title
+    width = max(len(label) for label, value in rows)
+    for label, value in rows:
+        print '    {}  {}'.format(label.ljust(width), value)
@@ -0,0 +1,71 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Bytes per picture variant before and after tuning the encoders.
+
+    Pass image files as arguments in order to measure your own sample
+    set; by default the test image is used.
+"""
+
+import sys
+from io import BytesIO
+from os.path import dirname, join
+
+from PIL import Image
+
+from daycare_ethics.util import TARGET_WIDTHS, VARIANT_QUALITY
+
+from .common import report
+
+
+SAMPLES = join(
+    dirname(dirname(__file__)),
+    'daycare_ethics', 'tests', 'data', 'openclipart_hector_gomez_landscape.png' ),
+
+
+def encoded_size(image, format, **options):
+    data = BytesIO()
+    image.save(data, format, **options)
+    return len(data.getvalue())
+
+
+def measure(paths):
+    """ Return {width: [old jpeg, new jpeg, webp]} in bytes, summed. """
+    totals = dict((width, [0, 0, 0]) for width in TARGET_WIDTHS)
+    for path in paths:
+        original = Image.open(path).convert('RGB')
+        for index, width in enumerate(TARGET_WIDTHS):
+            image = original.copy()
+            image.thumbnail((width, width), Image.LANCZOS)
+            sizes = (
+                encoded_size(image, 'JPEG', quality=95),
+                encoded_size(
+                    image,
+                    'JPEG',
+                    quality=VARIANT_QUALITY['jpeg'][index],
+                    optimize=True,
+                    progressive=True ),
+                encoded_size(image, 'WEBP', quality=VARIANT_QUALITY['webp'][index]),
+            )
+            for column, size in enumerate(sizes):
+                totals[width][column] += size
+    return totals
+
+
+def saved(before, after):
+    return '{:.0f}%'.format(100.0 * (before - after) / before)
+
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or SAMPLES
+    totals = measure(paths)
+    rows = []
+    for width in TARGET_WIDTHS:
+        old, jpeg, webp = totals[width]
+        rows.append((
+            '{}px (bytes: old, jpeg, webp)'.format(width),
+            '{} {} {}  saved {} / {}'.format(
+                old, jpeg, webp, saved(old, jpeg), saved(old, webp) ),
+        ))
+    report('{} sample image(s)'.format(len(paths)), rows)
@@ -0,0 +1,79 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Moderation votes per second from concurrent server processes that
+    all vote on the same reply, with and without sharded counters.
+
+    Pass a database URL as the first argument in order to measure
+    against a server with row locks, such as MySQL; the default is an
+    SQLite file, which locks the whole database on every write.
+"""
+
+import sys
+from datetime import datetime
+from multiprocessing import Process
+from time import time
+
+from daycare_ethics.database.db import db
+from daycare_ethics.database.models import BrainTeaser, Response
+from daycare_ethics.server.moderation import count_moderation, fold_moderation
+
+from .common import make_app, destroy_app, report
+
+
+WORKERS = 8
+VOTES = 200  # per worker
+SHARD_COUNTS = 0, 4, 8, 16
+
+
+def worker(app):
+    with app.app_context():
+        db.engine.dispose()  # own connections in each process
+        for count in xrange(VOTES):
+            count_moderation(1, count % 3 != 0)
+        db.session.remove()
+
+
+def measure(shards, settings):
+    app = make_app(MODERATION_SHARDS=shards, **settings)
+    with app.app_context():
+        db.session.add(Response(
+            brain_teaser=BrainTeaser(title='viral'),
+            submission=datetime.today(),
+            pseudonym='someone',
+            message='hot take' ))
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+    workers = [Process(target=worker, args=(app,)) for i in range(WORKERS)]
+    try:
+        start = time()
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        duration = time() - start
+        if any(process.exitcode for process in workers):
+            raise RuntimeError('a worker failed')
+        with app.app_context():
+            fold_moderation()
+            reply = Response.query.get(1)
+            if reply.upvotes + reply.downvotes != WORKERS * VOTES:
+                raise RuntimeError('votes were lost')
+        return WORKERS * VOTES / duration
+    finally:
+        destroy_app(app)
+
+
+if __name__ == '__main__':
+    settings = {}
+    if len(sys.argv) > 1:
+        settings['SQLALCHEMY_DATABASE_URI'] = sys.argv[1]
+    rates = [(shards, measure(shards, settings)) for shards in SHARD_COUNTS]
+    baseline = rates[0][1]
+    report('{} processes x {} votes on one reply'.format(WORKERS, VOTES), [
+        ('{} shard(s) (votes/s)'.format(shards), '{:.0f} ({:.2f}x)'.format(
+            value, value / baseline ))
+        for shards, value in rates
+    ])
@@ -0,0 +1,101 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Soak test of the reply streams: thousands of idle subscribers in
+    one process, each in its own thread like in a threaded server.
+
+    Reports the private memory per open stream, the number of database
+    polls while idle and the time to deliver one new reply to all
+    subscribers. Memory is read from /proc, so this only works on Linux.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from threading import Thread
+from time import sleep, time
+
+from daycare_ethics.database.db import db
+from daycare_ethics.database.models import BrainTeaser, Response
+
+from .captcha_index import private_memory
+from .common import make_app, destroy_app, report
+
+
+SUBSCRIBERS = 2000
+SOAK = 10  # seconds
+INTERVAL = 0.5
+HEARTBEAT = 2
+STACK_SIZE = 256 * 1024  # typical for a threaded WSGI server
+
+
+def subscriber(app, received):
+    response = app.test_client().get('/reflection/1/stream')
+    try:
+        for event in response.response:
+            if event.startswith('id: '):
+                received.append(time())
+                break
+    finally:
+        response.close()
+
+
+def wait_for(condition, timeout=60):
+    deadline = time() + timeout
+    while not condition():
+        if time() > deadline:
+            raise RuntimeError('timed out')
+        sleep(0.05)
+
+
+def soak(app):
+    hub = app.reply_hub
+    with app.app_context():
+        db.session.add(BrainTeaser(
+            title='viral',
+            publication=datetime.today() - timedelta(days=1) ))
+        db.session.commit()
+    received = []
+    threading.stack_size(STACK_SIZE)
+    threads = [
+        Thread(target=subscriber, args=(app, received))
+        for i in range(SUBSCRIBERS)
+    ]
+    before = private_memory()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    wait_for(lambda: hub.stats()['subscribers'] == SUBSCRIBERS)
+    polls = hub.stats()['polls']
+    sleep(SOAK)
+    polls = hub.stats()['polls'] - polls
+    memory = private_memory() - before
+    with app.app_context():
+        db.session.add(Response(
+            brain_teaser_id=1,
+            submission=datetime.today(),
+            pseudonym='someone',
+            message='hot take' ))
+        db.session.commit()
+    start = time()
+    hub.nudge()
+    wait_for(lambda: len(received) == SUBSCRIBERS)
+    delivery = max(received) - start
+    for thread in threads:
+        thread.join()
+    return memory, polls, delivery
+
+
+if __name__ == '__main__':
+    app = make_app(REPLY_STREAM_INTERVAL=INTERVAL, REPLY_STREAM_HEARTBEAT=HEARTBEAT)
+    try:
+        memory, polls, delivery = soak(app)
+    finally:
+        app.reply_hub.stop()
+        destroy_app(app)
+    report('{} idle subscribers for {} seconds'.format(SUBSCRIBERS, SOAK), [
+        ('private memory per stream (KiB)', '{:.1f}'.format(
+            float(memory) / SUBSCRIBERS )),
+        ('database polls while idle', polls),
+        ('delivery to all subscribers (ms)', '{:.0f}'.format(delivery * 1000)),
+    ])
@@ -0,0 +1,62 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Size and CPU cost of the session codec versus the pickle format
+    that PickleType used to store.
+"""
+
+import cPickle as pickle
+from datetime import datetime, timedelta
+
+from daycare_ethics.database.codec import (
+    encode_payload, decode_payload, pack_token, unpack_token )
+from daycare_ethics.server.session import generate_key
+
+from .common import rate, report
+
+
+ROUNDS = 20000
+
+
+def sample_payload():
+    """ A session in the middle of a captcha challenge. """
+    now = datetime.today()
+    return {
+        'token': generate_key(),
+        'last-request': now,
+        'last-reply': now - timedelta(minutes=3),
+        'captcha-answer': [u'paris', u'london', u'dublin'],
+        'captcha-expires': now + timedelta(minutes=2),
+        '_permanent': True,
+    }
+
+
+def pickle_payload(payload):
+    return pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+
+
+if __name__ == '__main__':
+    payload = sample_payload()
+    pickled = pickle_payload(payload)
+    encoded = encode_payload(payload)
+    token = payload['token']
+    packed = pack_token(token)
+    report('Session payload, {} rounds'.format(ROUNDS), [
+        ('pickle size (bytes)', len(pickled)),
+        ('codec size (bytes)', len(encoded)),
+        ('pickle encode (ops/s)', '{:.0f}'.format(
+            rate(lambda: pickle_payload(payload), ROUNDS) )),
+        ('codec encode (ops/s)', '{:.0f}'.format(
+            rate(lambda: encode_payload(payload), ROUNDS) )),
+        ('pickle decode (ops/s)', '{:.0f}'.format(
+            rate(lambda: pickle.loads(pickled), ROUNDS) )),
+        ('codec decode (ops/s)', '{:.0f}'.format(
+            rate(lambda: decode_payload(encoded), ROUNDS) )),
+    ])
+    report('Session token, {} rounds'.format(ROUNDS), [
+        ('text size (bytes)', len(token)),
+        ('packed size (bytes)', len(packed)),
+        ('pack (ops/s)', '{:.0f}'.format(rate(lambda: pack_token(token), ROUNDS))),
+        ('unpack (ops/s)', '{:.0f}'.format(rate(lambda: unpack_token(packed), ROUNDS))),
+    ])
@@ -0,0 +1,65 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Requests per second for /reflection/ with the old delete-plus-insert
+    session storage versus single-statement rotation.
+"""
+
+from datetime import datetime, timedelta
+
+from daycare_ethics import db
+from daycare_ethics.database import models as m
+from daycare_ethics.server.session import SessionInterface
+from daycare_ethics.server.session_store import SQLStore
+
+from .common import make_app, destroy_app, rate, report, HEADERS
+
+
+REQUESTS = 500
+
+
+class DeleteInsertStore (SQLStore):
+    """ Storage strategy before single-statement rotation. """
+    def rotate(self, former, token, expires, payload):
+        if former is not None:
+            m.Session.query.filter_by(token=former).delete()
+        db.session.add(m.Session(token=token, expires=expires, payload=payload))
+        db.session.commit()
+
+
+def seed(app):
+    now = datetime.today()
+    with app.test_request_context():
+        topic = m.BrainTeaser(
+            title='benchmark',
+            text='text ' * 100,
+            publication=now - timedelta(days=1) )
+        for count in range(20):
+            db.session.add(m.Response(
+                brain_teaser=topic,
+                submission=now,
+                pseudonym='user' + str(count),
+                message='message ' * 20 ))
+        db.session.commit()
+
+
+def measure(store):
+    app = make_app()
+    app.session_interface = SessionInterface(store)
+    seed(app)
+    client = app.test_client()
+    try:
+        return rate(lambda: client.get('/reflection/', headers=HEADERS), REQUESTS)
+    finally:
+        destroy_app(app)
+
+
+if __name__ == '__main__':
+    before = measure(DeleteInsertStore())
+    after = measure(SQLStore())
+    report('GET /reflection/, {} requests'.format(REQUESTS), [
+        ('delete + insert (req/s)', '{:.1f}'.format(before)),
+        ('single UPDATE (req/s)', '{:.1f}'.format(after)),
+        ('speedup', '{:.2f}x'.format(after / before)),
+    ])
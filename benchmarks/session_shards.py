@@ -0,0 +1,62 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Session writes per second from concurrent server processes, with
+    the sessions spread over a growing number of SQLite database files.
+"""
+
+from datetime import datetime, timedelta
+from multiprocessing import Process
+from os.path import join
+from time import time
+
+from daycare_ethics.server.session import generate_key
+from daycare_ethics.server.session_store import make_sharded_store
+
+from .common import make_app, destroy_app, report
+
+
+WORKERS = 8
+WRITES = 200  # per worker
+SHARD_COUNTS = 1, 2, 4, 8
+
+
+def worker(app):
+    """ Store one session repeatedly, like a client that keeps posting. """
+    store = make_sharded_store(app)  # own connections in each process
+    expires = datetime.utcnow() + timedelta(hours=1)
+    token = generate_key()
+    for count in xrange(WRITES):
+        store.put(token, expires, {'token': token, 'count': count})
+
+
+def measure(shards):
+    app = make_app()
+    app.config['SESSION_SHARDS'] = shards
+    app.config['SESSION_SHARD_URI'] = 'sqlite:///' + join(
+        app.instance_path, 'session_{}.sqlite' )
+    make_sharded_store(app)  # create the tables before the race starts
+    workers = [Process(target=worker, args=(app,)) for i in range(WORKERS)]
+    try:
+        start = time()
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        duration = time() - start
+        if any(process.exitcode for process in workers):
+            raise RuntimeError('a worker failed')
+        return WORKERS * WRITES / duration
+    finally:
+        destroy_app(app)
+
+
+if __name__ == '__main__':
+    rates = [(shards, measure(shards)) for shards in SHARD_COUNTS]
+    baseline = rates[0][1]
+    report('{} processes x {} session writes'.format(WORKERS, WRITES), [
+        ('{} shard(s) (writes/s)'.format(shards), '{:.0f} ({:.2f}x)'.format(
+            value, value / baseline ))
+        for shards, value in rates
+    ])
@@ -8,9 +8,12 @@
 """
 
 from flask import Flask
+from werkzeug.contrib.fixers import ProxyFix
 
 from .database import db
-from .server import public, security, session
+from .server import (
+    public, security, session, session_reaper, rate_limit, admission,
+    response_cache, vote_buffer, moderation, reply_stream, media )
 from .admin import create_admin
 
 
@@ -26,12 +29,24 @@ def create_app(config_file=None, config_obj=None, instance=None):
         app.config.from_object(config_obj)
     else:
         raise TypeError('no configuration argument provided')
+    hops = app.config.setdefault('PROXY_HOPS', 0)
+    if hops:
+        # take the client address from X-Forwarded-For
+        app.wsgi_app = ProxyFix(app.wsgi_app, hops)
 
-    app.session_interface = session.SessionInterface()
+    session.init_app(app)
     db.init_app(app)
     db.create_all(app=app)  # pass app because of Flask-SQLAlchemy contexts
     app.register_blueprint(public)
     create_admin(app)
     security.init_app(app)
+    session_reaper.init_app(app)
+    rate_limit.init_app(app)
+    admission.init_app(app)
+    response_cache.init_app(app)
+    vote_buffer.init_app(app)
+    moderation.init_app(app)
+    reply_stream.init_app(app)
+    media.init_app(app)
 
     return app
@@ -9,6 +9,7 @@ from flask.ext.admin import Admin
 
 from ..database import models, db
 from .views import *
+from . import thumbnails
 
 
 def create_admin(app):
@@ -23,4 +24,5 @@ def create_admin(app):
     admin.add_view(ResponsesView(ses))
     admin.add_view(TipsView(ses))
     admin.init_app(app)
+    thumbnails.init_app(app)
     return admin
@@ -0,0 +1,139 @@
+# (c) 2014, 2015 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Generation of the downscaled variants of uploaded pictures.
+
+    Variants are made in a pool of worker processes, so that the admin
+    upload returns right away. The Picture row has status 'pending'
+    until its variants are ready; the media view serves the original
+    upload in the meanwhile.
+"""
+
+import os.path as op
+from multiprocessing import Pool
+from threading import Lock
+
+from PIL import Image
+
+from ..util import TARGET_WIDTHS, VARIANT_FORMATS, VARIANT_QUALITY, image_variants
+from ..database.db import db
+from ..database.models import Picture
+
+
+def make_variants(id, source, variants):
+    """ Save variants of image `source` for every width in TARGET_WIDTHS.
+
+    `variants` maps each of VARIANT_FORMATS to a list of file names, as
+    returned by image_variants. The largest variants are made first
+    and every next size is scaled down from the previous one. JPEG
+    files are decoded at a reduced size right away (draft mode), which
+    caps the memory use for large camera photos. Returns (`id`, error
+    message or None).
+    """
+    try:
+        image = Image.open(source)
+        largest = TARGET_WIDTHS[-1]
+        image.draft('RGB', (largest, largest))
+        image.load()  # thumbnail must not change the draft again
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for index in reversed(range(len(TARGET_WIDTHS))):
+            width = TARGET_WIDTHS[index]
+            image.thumbnail((width, width), Image.LANCZOS)
+            image.save(
+                variants['jpeg'][index],
+                'JPEG',
+                quality=VARIANT_QUALITY['jpeg'][index],
+                optimize=True,
+                progressive=True )
+            # the WebP encoder of Pillow 3.4 cannot write grayscale
+            webp = image if image.mode == 'RGB' else image.convert('RGB')
+            webp.save(
+                variants['webp'][index],
+                'WEBP',
+                quality=VARIANT_QUALITY['webp'][index] )
+    except Exception as error:
+        return id, '{}: {}'.format(type(error).__name__, error)
+    return id, None
+
+
+class ThumbnailQueue(object):
+    """ Background jobs that call make_variants in `processes` workers.
+
+    With zero processes, the variants are made immediately instead, in
+    the app context and database session of the caller.
+    The pool is created by the first job, so that it is not forked
+    before the server process is.
+    """
+
+    def __init__(self, app, processes):
+        self.app = app
+        self.processes = processes
+        self.pool = None
+        self.lock = Lock()
+
+    def submit(self, id, path):
+        directory = self.app.instance_path
+        args = (
+            id,
+            op.join(directory, path),
+            dict(
+                (format, [
+                    op.join(directory, name)
+                    for name in image_variants(path, format)
+                ])
+                for format in VARIANT_FORMATS
+            ),
+        )
+        if not self.processes:
+            return self.record(*make_variants(*args))
+        with self.lock:
+            if self.pool is None:
+                self.pool = Pool(self.processes)
+        self.pool.apply_async(make_variants, args, callback=self.finish)
+
+    def finish(self, result):
+        """ Record the outcome of a pool job.
+
+        This runs in the result thread of the pool, which needs its own
+        app context and database session.
+        """
+        with self.app.app_context():
+            try:
+                self.record(*result)
+            finally:
+                db.session.remove()
+
+    def record(self, id, error):
+        """ Store the outcome of a job in the Picture row.
+
+        Database errors are logged rather than raised, because they
+        would stop the result thread of the pool.
+        """
+        if error is not None:
+            self.app.logger.error('Variants of picture %d failed: %s', id, error)
+        table = Picture.__table__
+        try:
+            db.session.execute(
+                table.update()
+                .where(table.c.id == id)
+                .values(status='failed' if error else 'ready') )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.app.logger.exception('Status of picture %d not stored', id)
+        self.app.media_paths.forget(id)
+
+    def join(self):
+        """ Wait until all submitted jobs are done. """
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def init_app(app):
+    processes = app.config.setdefault('THUMBNAIL_PROCESSES', 2)
+    app.thumbnails = ThumbnailQueue(app, processes)
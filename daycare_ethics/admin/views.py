@@ -1,7 +1,6 @@
 # (c) 2014, 2015 Digital Humanities Lab, Utrecht University
 # Author: Julian Gonggrijp, j.gonggrijp@uu.nl
 
-import os.path as op
 from datetime import datetime
 
 from wtforms import validators, widgets
@@ -10,14 +9,28 @@ from flask.ext.admin import form
 from flask.ext.admin.actions import action, ActionsMixin
 from flask.ext.admin.contrib.sqla import ModelView
 
-from PIL import Image
-
-from ..util import TARGET_WIDTHS, image_variants
 from ..database.models import *
+from ..server.response_cache import invalidate
 from .util import download_csv
 
 
+class InvalidatesResponses(object):
+    """ Mixin for views of models that appear in cached public responses. """
+    response_topic = None
+
+    def after_model_change(self, form, model, is_created):
+        invalidate(self.response_topic)
+
+    def after_model_delete(self, model):
+        invalidate(self.response_topic)
+
+
 class MediaView(ModelView):
+    """ Upload pictures and videos.
+    
+    Media are served as immutable, so the file of an existing item
+    cannot be replaced; upload a new item instead.
+    """
     column_list = ('name',)
     column_default_sort = ('id', True)
     form_columns = ('name', 'path')
@@ -32,21 +45,30 @@ class MediaView(ModelView):
         }
     }
 
+    def edit_form(self, obj=None):
+        form = super(MediaView, self).edit_form(obj)
+        del form.path
+        return form
+
     def on_model_change(self, form, model, is_created=True):
+        if not is_created:
+            return
         model.mime_type = form.path.data.headers['Content-Type']
         if model.mime_type.startswith('image'):
-            model_path = op.join(current_app.instance_path, model.path)
-            original = Image.open(model_path)
-            for width, name in zip(TARGET_WIDTHS, image_variants(model_path)):
-                im = original.copy()
-                im.thumbnail((width, width), Image.LANCZOS)
-                im.save(op.join(current_app.instance_path, name), quality=95)
+            model.status = 'pending'
+        else:
+            model.status = 'ready'
+
+    def after_model_change(self, form, model, is_created):
+        if is_created and model.status == 'pending':
+            current_app.thumbnails.submit(model.id, model.path)
 
     def __init__(self, session, name='Media', **kwargs):
         super(MediaView, self).__init__(Picture, session, name, **kwargs)
 
 
-class CasesView(ModelView):
+class CasesView(InvalidatesResponses, ModelView):
+    response_topic = 'case'
     column_list = ('title', 'publication', 'closure', 'yes_votes', 'no_votes')
     column_labels = {
         'yes_votes': 'Yes',
@@ -102,7 +124,8 @@ class VotesView(ModelView, ActionsMixin):
         self.init_actions()
 
 
-class BrainTeasersView(ModelView):
+class BrainTeasersView(InvalidatesResponses, ModelView):
+    response_topic = 'reflection'
     column_list = ('title', 'publication', 'closure')
     column_descriptions = {
         'publication': 'Date when the reflection item goes live.',
@@ -115,7 +138,8 @@ class BrainTeasersView(ModelView):
         super(BrainTeasersView, self).__init__(BrainTeaser, session, name, **kwargs)
 
 
-class ResponsesView(ModelView, ActionsMixin):
+class ResponsesView(InvalidatesResponses, ModelView, ActionsMixin):
+    response_topic = 'reflection'
     can_create = False
     can_edit = False
     column_sortable_list = (
@@ -139,7 +163,8 @@ class ResponsesView(ModelView, ActionsMixin):
         self.init_actions()
 
 
-class TipsView(ModelView):
+class TipsView(InvalidatesResponses, ModelView):
+    response_topic = 'tips'
     column_list = ('what', 'author', 'title', 'update')
     column_labels = {'update': 'Last update'}
     column_default_sort = ('update', True)
@@ -166,6 +191,7 @@ class TipsView(ModelView):
         now = datetime.now()
         count = Tip.query.filter(Tip.id.in_(ids)).update({Tip.update: now}, False)
         db.session.commit()
+        invalidate(self.response_topic)
         flash('{} tips have been bumped.'.format(count))
 
     def __init__(self, session, name='Tips', **kwargs):
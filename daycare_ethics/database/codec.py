@@ -0,0 +1,137 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Compact storage formats for session tokens and session payloads.
+
+    Payloads are stored as a version byte followed by a compact JSON
+    array of two objects: the plain values and the datetimes, the latter
+    as microseconds since 1970.
+    Tokens are stored as a single big-endian integer. Rows that were
+    written by older versions (pickled payloads, plain text tokens) can
+    still be read and are rewritten in the new format when they are
+    saved again.
+"""
+
+import json
+import struct
+import cPickle as pickle
+from binascii import hexlify, unhexlify
+from datetime import datetime, timedelta
+
+import sqlalchemy.types as types
+
+
+KEY_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+KEY_INDEX = dict((char, index) for index, char in enumerate(KEY_CHARS))
+PACKED_TOKEN = '\x00'
+RAW_TOKEN = '\x01'
+PAYLOAD_V1 = '\x01'
+EPOCH = datetime(1970, 1, 1)
+JSON_ENCODER = json.JSONEncoder(separators=(',', ':'))
+JSON_DECODER = json.JSONDecoder()
+
+
+def pack_token(token):
+    """ Encode `token` as a marker byte plus a base 62 integer.
+
+    A 30 character token takes 24 bytes this way. Tokens that contain
+    other characters than KEY_CHARS are stored verbatim after a
+    different marker byte.
+    """
+    number = 1  # leading sentinel digit, preserves leading zeros
+    try:
+        for char in token:
+            number = number * 62 + KEY_INDEX[char]
+    except KeyError:
+        return RAW_TOKEN + token.encode('utf-8')
+    digits = '%x' % number
+    return PACKED_TOKEN + unhexlify('0' * (len(digits) % 2) + digits)
+
+
+def unpack_token(data):
+    """ Inverse of pack_token; plain text tokens are passed through. """
+    if data[0] == RAW_TOKEN:
+        return data[1:].decode('utf-8')
+    if data[0] != PACKED_TOKEN:
+        return data  # legacy row, token stored as text
+    number = int(hexlify(data[1:]), 16)
+    chars = []
+    while number > 1:
+        number, index = divmod(number, 62)
+        chars.append(KEY_CHARS[index])
+    return ''.join(reversed(chars))
+
+
+def encode_payload(payload):
+    """ Encode a session payload; datetimes are only allowed at the top. """
+    plain, times = {}, {}
+    for key, value in payload.iteritems():
+        if isinstance(value, datetime):
+            times[key] = _microseconds(value)
+        else:
+            plain[key] = value
+    return PAYLOAD_V1 + JSON_ENCODER.encode([plain, times])
+
+
+def decode_payload(data):
+    """ Decode a payload in any format that has ever been stored.
+
+    Pickled payloads from older versions are returned as LegacyPayload,
+    so that the caller can schedule them for rewriting.
+    """
+    if data[0] == PAYLOAD_V1:
+        # raw_decode from offset 1 spares a copy of the data
+        payload, times = JSON_DECODER.raw_decode(data, 1)[0]
+        for key, value in times.iteritems():
+            payload[key] = EPOCH + timedelta(0, 0, value)
+        return payload
+    return LegacyPayload(pickle.loads(data))
+
+
+def encode_record(expires, payload):
+    """ Encode an expiry time and a payload for key-value storage. """
+    micros = -1 if expires is None else _microseconds(expires)
+    return struct.pack('>q', micros) + encode_payload(payload)
+
+
+def decode_record(data):
+    """ Inverse of encode_record; returns an (expires, payload) pair. """
+    micros, = struct.unpack('>q', data[:8])
+    expires = None if micros < 0 else EPOCH + timedelta(microseconds=micros)
+    return expires, decode_payload(data[8:])
+
+
+def _microseconds(moment):
+    delta = moment - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+class LegacyPayload(dict):
+    """ Payload that was decoded from an older storage format. """
+
+
+class PackedToken(types.TypeDecorator):
+    """ Column type that stores tokens with pack_token. """
+    impl = types.VARBINARY(121)  # marker byte + 30 characters of UTF-8
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            return pack_token(value)
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            return unpack_token(value)
+
+
+class SessionPayload(types.TypeDecorator):
+    """ Column type that stores session payloads with encode_payload. """
+    impl = types.LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            return encode_payload(value)
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            return decode_payload(value)
@@ -3,7 +3,7 @@
 
 """
     Object relational model and database schema.
-    
+
     An organogram will be provided as external documentation of the
     database structure.
 """
@@ -13,17 +13,16 @@ import os
 from flask import current_app
 from sqlalchemy.event import listens_for
 
-from ..util import image_variants
+from ..util import image_variants, VARIANT_FORMATS
 from db import db
+from codec import PackedToken, SessionPayload
 
 
 class Session(db.Model):
     """ Server-side storage medium for the sessions. """
-    token   = db.Column(db.String(30), primary_key=True)
-                                # 30 = ..server.security.KEY_LENGTH
-                                # (not imported here because of circularity)
-    expires = db.Column(db.DateTime)
-    payload = db.Column(db.PickleType)
+    token   = db.Column(PackedToken, primary_key=True)
+    expires = db.Column(db.DateTime, index=True)
+    payload = db.Column(SessionPayload)
 
 
 class Picture (db.Model):
@@ -33,16 +32,27 @@ class Picture (db.Model):
     mime_type   = db.Column(db.String(30), nullable=False)
     name        = db.Column(db.String(40), nullable=False)
     path        = db.Column(db.String(50), unique=True, nullable=False)
-    
+    status      = db.Column(
+        db.Enum('pending', 'ready', 'failed', name='picture_status'),
+        nullable=False,
+        default='ready',
+        server_default='ready' )
+
     def __str__(self):
         return self.name
 
 
 @listens_for(Picture, 'after_delete')
 def del_file(mapper, connection, target):
+    paths = getattr(current_app, 'media_paths', None)
+    if paths is not None:
+        paths.forget(target.id)
     if target.path:
         directory = current_app.instance_path
-        for path in [target.path] + image_variants(target.path):
+        files = [target.path]
+        for format in VARIANT_FORMATS:
+            files.extend(image_variants(target.path, format))
+        for path in files:
             try:
                 os.remove(os.path.join(directory, path))
             except OSError:
@@ -58,7 +68,7 @@ class PublicationItem (object):
     closure     = db.Column(db.Date)
     title       = db.Column(db.Text)
     text        = db.Column(db.Text)
-    
+
     def __str__(self):
         return self.title
 
@@ -85,6 +95,17 @@ class Vote (db.Model):
     case        = db.relationship('Case', backref='votes')
 
 
+class VoteBatch (db.Model):
+    """ Journal segment whose votes were written to the vote table.
+
+    A row is added in the same transaction as the votes, so that
+    recovery can tell whether a segment was committed, see
+    ..server.vote_buffer.
+    """
+    __tablename__   = 'vote_batch'
+    id              = db.Column(db.String(40), primary_key=True)
+
+
 class BrainTeaser (PublicationItem, db.Model):
     """ Periodic reflection item that users may discuss publicly.
     """
@@ -94,6 +115,9 @@ class BrainTeaser (PublicationItem, db.Model):
 class Response (db.Model):
     """ Response to the discussion associated with a brain teaser.
     """
+    __table_args__  = (
+        db.Index('ix_response_thread', 'brain_teaser_id', 'submission', 'id'),
+    )
     id              = db.Column(db.Integer, primary_key=True)
     brain_teaser_id = db.Column(db.ForeignKey('brain_teaser.id'), nullable=False)
     submission      = db.Column(db.DateTime, nullable=False)
@@ -104,6 +128,22 @@ class Response (db.Model):
     brain_teaser    = db.relationship('BrainTeaser', backref='responses')
 
 
+class ResponseCounter (db.Model):
+    """ Moderation votes on a response that were not yet added to it.
+
+    Votes are spread over several rows per response, so that concurrent
+    votes on a popular response do not wait for each other.
+    """
+    __tablename__   = 'response_counter'
+    response_id     = db.Column(db.ForeignKey('response.id'), primary_key=True)
+    shard           = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    upvotes         = db.Column(db.Integer, nullable=False, default=0)
+    downvotes       = db.Column(db.Integer, nullable=False, default=0)
+    response        = db.relationship('Response', backref=db.backref(
+        'counters',
+        cascade='all, delete-orphan' ))
+
+
 class Tip (db.Model):
     """ Any reference that the content provider opts to share with users.
     """
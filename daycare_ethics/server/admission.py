@@ -0,0 +1,81 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Cheap checks that reject bad requests to the protected views
+    before any session or database work is done.
+"""
+
+from threading import Lock
+
+from flask import current_app, request, abort
+
+from ..database.codec import KEY_CHARS
+from .session import KEY_LENGTH, verify_key
+from .security import blocked
+
+
+REASONS = 'user-agent', 'blocklist', 'fields', 'token'
+TOKEN_CHARS = frozenset(KEY_CHARS)
+
+
+def admits(*fields):
+    """ Subject a view to admission control, requiring `fields` in the
+    form. Apply this directly to the view function; wrappers that use
+    functools.wraps pass the requirement on.
+    """
+    def decorate(view):
+        view.required_fields = fields
+        return view
+    return decorate
+
+
+class Admission(object):
+    """ Counters of admitted requests and of rejections by reason. """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.admitted = 0
+        self.rejected = dict.fromkeys(REASONS, 0)
+
+    def reject(self, reason):
+        with self.lock:
+            self.rejected[reason] += 1
+        abort(400)
+
+    def admit(self):
+        with self.lock:
+            self.admitted += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.rejected, admitted=self.admitted)
+
+
+def valid_token(token):
+    if not 0 < len(token) <= KEY_LENGTH or not TOKEN_CHARS.issuperset(token):
+        return False
+    secret = current_app.session_interface.secret
+    return secret is None or verify_key(token, secret)
+
+
+def check_admission():
+    view = current_app.view_functions.get(request.endpoint)
+    fields = getattr(view, 'required_fields', None)
+    if fields is None:
+        return
+    admission = current_app.admission
+    if not request.headers.get('User-Agent'):
+        admission.reject('user-agent')
+    if blocked():
+        admission.reject('blocklist')
+    if not all(request.form.get(field) for field in fields):
+        admission.reject('fields')
+    if 't' in fields and not valid_token(request.form['t']):
+        admission.reject('token')
+    admission.admit()
+
+
+def init_app(app):
+    app.admission = Admission()
+    app.before_request(check_admission)
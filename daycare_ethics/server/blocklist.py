@@ -0,0 +1,61 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Bounded in-memory record of misbehaving tokens and origins.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class Blocklist(object):
+    """ LRU map from keys to the number of recorded offences.
+
+    At most `size` keys are remembered. The count of a key is forgotten
+    `ttl` seconds after its latest offence.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.blocked = 0
+
+    def add(self, key):
+        """ Record an offence by `key` and return its new count. """
+        now = time()
+        with self.lock:
+            count = self._count(key, now) + 1
+            self.entries.pop(key, None)
+            self.entries[key] = now + self.ttl, count
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+            return count
+
+    def count(self, key):
+        with self.lock:
+            return self._count(key, time())
+
+    def blocks(self, key, threshold=1):
+        """ Whether `key` has at least `threshold` recent offences. """
+        with self.lock:
+            if self._count(key, time()) >= threshold:
+                self.blocked += 1
+                return True
+            return False
+
+    def _count(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return 0
+        if entry[0] < now:
+            del self.entries[key]
+            return 0
+        return entry[1]
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'blocked': self.blocked}
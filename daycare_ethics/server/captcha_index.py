@@ -0,0 +1,182 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Compiled, memory-mapped form of the captcha data.
+
+    The JSON file with captcha categories is compiled once into a
+    binary index file. All server processes map that file into memory,
+    so that the operating system shares its pages between them instead
+    of every process holding its own sets of words. The index is
+    rebuilt automatically when the JSON file changes.
+
+    Layout of the index, all integers unsigned 32 bit little-endian:
+
+        magic, SHA-1 of the JSON source (20 bytes)
+        normals, oddballs, words, categories, pairs, members
+        word offsets (words + 1), relative to the start of the text
+        category offsets (categories + 1), into the member array
+        pair records (pairs times: normal category, offset, count),
+            offsets into the member array
+        member array: word numbers of category members and of oddballs
+        text: all words in UTF-8, sorted
+"""
+
+import json
+import mmap
+import os
+import os.path as op
+import struct
+from array import array
+from hashlib import sha1
+from tempfile import mkstemp
+
+
+
+MAGIC = 'DCX1'
+HEADER = struct.Struct('<4s20s6I')
+INTEGER = struct.Struct('<I')
+PAIR = struct.Struct('<3I')
+
+
+def difference_tables(categories, normals, oddballs):
+    """ List every usable (normal category, oddball words) pair.
+
+    The oddball words of a pair are the words of one category that do
+    not occur in the normal category, which is given by its position.
+    Pairs that do not have enough words of either kind are skipped.
+    """
+    return [
+        (position, oddballset - normalset)
+        for position, normalset in enumerate(categories)
+        for oddballset in categories
+        if oddballset is not normalset
+        and len(normalset) >= normals
+        and len(oddballset - normalset) >= oddballs
+    ]
+
+
+def compile_index(categories, normals, oddballs, signature):
+    """ Return the index of `categories` (a list of sets) as a string. """
+    words = sorted(set().union(*categories))
+    number = dict((word, index) for index, word in enumerate(words))
+    encoded = [word.encode('utf-8') for word in words]
+    word_offsets = array('I', [0])
+    for word in encoded:
+        word_offsets.append(word_offsets[-1] + len(word))
+    members = array('I')
+    category_offsets = array('I', [0])
+    for category in categories:
+        members.extend(sorted(number[word] for word in category))
+        category_offsets.append(len(members))
+    pairs = []
+    for position, oddballset in difference_tables(categories, normals, oddballs):
+        pairs.append(PAIR.pack(position, len(members), len(oddballset)))
+        members.extend(sorted(number[word] for word in oddballset))
+    parts = [
+        HEADER.pack(
+            MAGIC, signature, normals, oddballs,
+            len(words), len(categories), len(pairs), len(members) ),
+        _little_endian(word_offsets),
+        _little_endian(category_offsets),
+        ''.join(pairs),
+        _little_endian(members),
+        ''.join(encoded),
+    ]
+    return ''.join(parts)
+
+
+def _little_endian(integers):
+    if struct.pack('=I', 1) != INTEGER.pack(1):
+        integers = array('I', integers)
+        integers.byteswap()
+    return integers.tostring()
+
+
+class CaptchaIndex(object):
+    """ Read-only view of a compiled index file.
+
+    Iterating yields the categories as sets of words. `challenge`
+    composes a challenge directly from the mapped pages.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as source:
+            self.map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.signature, self.normals, self.oddballs,
+         self.word_count, self.category_count, self.pair_count,
+         member_count) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('not a captcha index: {}'.format(path))
+        self.word_offsets = HEADER.size
+        self.category_offsets = self.word_offsets + 4 * (self.word_count + 1)
+        self.pairs = self.category_offsets + 4 * (self.category_count + 1)
+        self.members = self.pairs + PAIR.size * self.pair_count
+        self.text = self.members + 4 * member_count
+
+    def integer(self, offset):
+        return INTEGER.unpack_from(self.map, offset)[0]
+
+    def word(self, number):
+        start, end = struct.unpack_from('<2I', self.map, self.word_offsets + 4 * number)
+        return self.map[self.text + start:self.text + end].decode('utf-8')
+
+    def pair(self, index):
+        return PAIR.unpack_from(self.map, self.pairs + PAIR.size * index)
+
+    def category(self, index):
+        """ Return the (offset, count) of a category in the member array. """
+        start, end = struct.unpack_from(
+            '<2I', self.map, self.category_offsets + 4 * index )
+        return start, end - start
+
+    def sample(self, offset, count, size, dice):
+        return [
+            self.word(self.integer(self.members + 4 * (offset + position)))
+            for position in dice.sample(xrange(count), size)
+        ]
+
+    def challenge(self, dice):
+        """ Return a random (challenge, answer) pair. """
+        normal, offset, count = self.pair(dice.randrange(self.pair_count))
+        oddones = self.sample(offset, count, self.oddballs, dice)
+        offset, count = self.category(normal)
+        united = self.sample(offset, count, self.normals, dice) + oddones
+        dice.shuffle(united)
+        return ' '.join(united), [word.lower() for word in oddones]
+
+    def __len__(self):
+        return self.category_count
+
+    def __iter__(self):
+        for index in xrange(self.category_count):
+            offset, count = self.category(index)
+            yield set(
+                self.word(self.integer(self.members + 4 * position))
+                for position in xrange(offset, offset + count) )
+
+
+def load_index(source, path, normals, oddballs):
+    """ Map the index at `path`, (re)building it from the JSON `source`
+    if it is missing or out of date.
+    """
+    with open(source, 'rb') as data:
+        content = data.read()
+    signature = sha1(content).digest()
+    try:
+        index = CaptchaIndex(path)
+        if (index.signature, index.normals, index.oddballs) == (
+                signature, normals, oddballs ):
+            return index
+    except (IOError, ValueError, struct.error):
+        pass
+    categories = map(set, json.loads(content).values())
+    compiled = compile_index(categories, normals, oddballs, signature)
+    directory = op.dirname(op.abspath(path))
+    if not op.isdir(directory):
+        os.makedirs(directory)
+    handle, temporary = mkstemp(dir=directory, prefix='.')
+    with os.fdopen(handle, 'wb') as target:
+        target.write(compiled)
+    os.rename(temporary, path)  # atomic, other processes may be reading
+    return CaptchaIndex(path)
@@ -0,0 +1,91 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Ready-made captcha challenges, generated ahead of demand.
+"""
+
+from collections import deque
+from random import SystemRandom
+from threading import Thread, Event, Lock
+from time import time
+
+
+class CaptchaPool(object):
+    """ Queue of up to `size` challenges, topped up in the background.
+
+    Challenges are (challenge, answer) pairs made by `generate(dice)`.
+
+    `draw` takes a challenge from the queue. When the queue drops below
+    half of its size, a daemon thread refills it. If the queue runs dry
+    anyway, `draw` generates a challenge inline. The thread is started
+    on first demand, so that it is created in the process that serves
+    the requests rather than in a parent that forks.
+    """
+
+    def __init__(self, generate, size):
+        self.generate = generate
+        self.size = size
+        self.dice = SystemRandom()
+        self.challenges = deque()
+        self.wanted = Event()
+        self.lock = Lock()
+        self.thread = None
+        self.draws = 0
+        self.misses = 0
+        self.refills = 0
+        self.refilled = 0
+        self.refill_time = 0
+
+    def draw(self):
+        with self.lock:
+            self.draws += 1
+        try:
+            challenge = self.challenges.popleft()
+        except IndexError:
+            with self.lock:
+                self.misses += 1
+            challenge = self.generate(self.dice)
+        if len(self.challenges) < self.size // 2:
+            self.request_refill()
+        return challenge
+
+    def request_refill(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        self.wanted.set()
+
+    def run(self):
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            self.refill()
+
+    def refill(self):
+        """ Top up the queue to its full size; return the number added. """
+        start = time()
+        added = 0
+        while len(self.challenges) < self.size:
+            self.challenges.append(self.generate(self.dice))
+            added += 1
+        with self.lock:
+            self.refills += 1
+            self.refilled += added
+            self.refill_time += time() - start
+        return added
+
+    def stats(self):
+        """ Pool depth and refill counters. """
+        with self.lock:
+            return {
+                'depth': len(self.challenges),
+                'size': self.size,
+                'draws': self.draws,
+                'misses': self.misses,
+                'refills': self.refills,
+                'refilled': self.refilled,
+                'refill_rate': self.refilled / self.refill_time if self.refill_time else 0,
+            }
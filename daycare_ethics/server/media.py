@@ -0,0 +1,214 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Lookup and delivery of uploaded pictures and videos.
+
+    The paths of the media are kept in memory, so that serving a file
+    does not need a query. The bytes are either sent by Flask or, if
+    MEDIA_SENDFILE is set, by the front web server. Videos are sent in
+    byte ranges on request, so that players can seek.
+"""
+
+import os
+import os.path as op
+from datetime import datetime
+from threading import Lock
+from time import time
+from zlib import adler32
+
+from flask import current_app, request, abort, send_from_directory, safe_join
+from werkzeug.wsgi import wrap_file
+
+from ..util import VARIANT_FORMATS, image_variants
+from ..database.models import Picture
+
+
+SENDFILE_MODES = None, 'x-sendfile', 'x-accel-redirect'
+
+
+class MediaPaths(object):
+    """ Map from Picture id to (path, mime type, status, formats).
+
+    `formats` lists the VARIANT_FORMATS in which variants exist;
+    pictures from older versions only have JPEG variants.
+
+    Entries are dropped by `forget` when a picture is changed in this
+    process and in any case after `timeout` seconds, so that other
+    processes catch up as well. Pictures whose variants are not ready
+    are not remembered, so that they are served as soon as possible.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.entries = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, id):
+        """ Return the entry for `id` or None if there is no such picture. """
+        now = time()
+        with self.lock:
+            entry = self.entries.get(id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        picture = Picture.query.get(id)
+        if picture is None:
+            return None
+        formats = tuple(
+            format for format in VARIANT_FORMATS
+            if op.exists(op.join(
+                current_app.instance_path,
+                image_variants(picture.path, format)[0] ))
+        )
+        value = picture.path, picture.mime_type, picture.status, formats
+        if picture.status == 'ready':
+            with self.lock:
+                self.entries[id] = now + self.timeout, value
+        return value
+
+    def forget(self, id):
+        with self.lock:
+            self.entries.pop(id, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class FileRange(object):
+    """ File-like object for the next `length` bytes of `file`.
+
+    WSGI servers with a file wrapper, such as gunicorn, use `fileno`
+    to send the bytes with sendfile(2) without copying them through
+    Python; the Content-Length header limits how much is sent.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else ''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def send_range(path, mimetype=None):
+    """ Serve `path` from the instance directory, honouring Range.
+
+    A single byte range is answered with 206 Partial Content, unless
+    an If-Range header shows that the client has an outdated copy.
+    Other ranges are ignored and the whole file is sent.
+    """
+    filename = safe_join(current_app.instance_path, path)
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        abort(404)
+    length = stat.st_size
+    modified = datetime.utcfromtimestamp(int(stat.st_mtime))
+    etag = '{}-{}-{}'.format(
+        int(stat.st_mtime),
+        length,
+        adler32(filename.encode('utf-8')) & 0xffffffff )
+    start, stop = 0, length
+    requested = request.range
+    if ( requested is not None and requested.units == 'bytes' and
+         len(requested.ranges) == 1 and range_applies(etag, modified) ):
+        span = requested.range_for_length(length)
+        if span is None:
+            response = current_app.response_class(status=416)
+            response.headers['Content-Range'] = 'bytes */{}'.format(length)
+            return response
+        start, stop = span
+    file = open(filename, 'rb')
+    file.seek(start)
+    response = current_app.response_class(
+        wrap_file(request.environ, FileRange(file, stop - start)),
+        mimetype=mimetype,
+        direct_passthrough=True )
+    response.content_length = stop - start
+    response.headers['Accept-Ranges'] = 'bytes'
+    if stop - start < length:
+        response.status_code = 206
+        response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, stop - 1, length )
+    response.set_etag(etag)
+    response.last_modified = modified
+    return response.make_conditional(request)
+
+
+def range_applies(etag, modified):
+    """ Whether the If-Range header, if any, matches the file. """
+    condition = request.if_range
+    if condition.etag is not None:
+        return condition.etag == etag
+    if condition.date is not None:
+        return modified <= condition.date
+    return True
+
+
+def accepts_webp():
+    """ Whether the client lists WebP explicitly; */* is not enough. """
+    return any(
+        value == 'image/webp' and quality > 0
+        for value, quality in request.accept_mimetypes
+    )
+
+
+def send_media(path, mimetype=None, ranges=False, final=True):
+    """ Serve `path` from the instance directory with far-future caching.
+
+    Files under the same media URL never change, so clients may keep
+    them for MEDIA_MAX_AGE seconds. Pass `final=False` for a stand-in
+    that must not be cached, and `ranges` for media that are played
+    rather than shown, so that clients can seek.
+    """
+    config = current_app.config
+    mode = config['MEDIA_SENDFILE']
+    if mode == 'x-accel-redirect':
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = config['MEDIA_ACCEL_PREFIX'] + path
+    elif mode == 'x-sendfile':
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Sendfile'] = safe_join(current_app.instance_path, path)
+    elif ranges:
+        response = send_range(path, mimetype)
+    else:
+        response = send_from_directory(
+            current_app.instance_path,
+            path,
+            mimetype=mimetype,
+            cache_timeout=config['MEDIA_MAX_AGE'] )
+    if final:
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(
+            config['MEDIA_MAX_AGE'] )
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def init_app(app):
+    mode = app.config.setdefault('MEDIA_SENDFILE', None)
+    if mode not in SENDFILE_MODES:
+        raise ValueError('MEDIA_SENDFILE must be one of {}'.format(SENDFILE_MODES))
+    app.config.setdefault('MEDIA_ACCEL_PREFIX', '/media-files/')
+    app.config.setdefault('MEDIA_MAX_AGE', 365 * 24 * 3600)
+    timeout = app.config.setdefault('MEDIA_CACHE_TIMEOUT', 300)
+    app.media_paths = MediaPaths(timeout)
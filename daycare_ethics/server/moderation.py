@@ -0,0 +1,190 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Sharded counters for the moderation of replies.
+
+    Each moderation vote increments one of MODERATION_SHARDS rows of
+    the response_counter table, chosen at random, instead of the single
+    row of the reply. Public responses add the counter rows to the
+    totals of the reply; a background fold moves them into the reply
+    from time to time, so that the administration interface can sort
+    and filter on them.
+"""
+
+from random import randrange
+from threading import Thread, Lock
+from time import time
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from ..database.db import db
+from ..database.models import Response, ResponseCounter
+
+
+def count_moderation(id, up):
+    """ Increment a counter of reply `id`; one UPDATE in the common case.
+
+    Returns False if the reply does not exist.
+    """
+    shards = current_app.config['MODERATION_SHARDS']
+    if not shards:
+        return _count_directly(id, up)
+    table = ResponseCounter.__table__
+    counter = table.c.upvotes if up else table.c.downvotes
+    shard = randrange(shards)
+    increment = (
+        table.update()
+        .where(table.c.response_id == id)
+        .where(table.c.shard == shard)
+        .values({counter: counter + 1}) )
+    try:
+        if not db.session.execute(increment).rowcount:
+            if not db.session.query(Response.id).filter_by(id=id).count():
+                db.session.rollback()
+                return False
+            db.session.execute(table.insert().values({
+                table.c.response_id: id,
+                table.c.shard: shard,
+                table.c.upvotes: int(up),
+                table.c.downvotes: int(not up),
+            }))
+        db.session.commit()
+    except IntegrityError:  # another request created the row first
+        db.session.rollback()
+        try:
+            db.session.execute(increment)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+    except:
+        db.session.rollback()
+        raise
+    return True
+
+
+def _count_directly(id, up):
+    table = Response.__table__
+    counter = table.c.upvotes if up else table.c.downvotes
+    try:
+        result = db.session.execute(
+            table.update()
+            .where(table.c.id == id)
+            .values({counter: db.func.coalesce(counter, 0) + 1}) )
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    return bool(result.rowcount)
+
+
+def pending_moderation(ids):
+    """ Map reply ids to (up, down) that were not folded yet. """
+    if not ids:
+        return {}
+    table = ResponseCounter.__table__
+    rows = db.session.execute(
+        db.select([
+            table.c.response_id,
+            db.func.sum(table.c.upvotes),
+            db.func.sum(table.c.downvotes),
+        ])
+        .where(table.c.response_id.in_(ids))
+        .group_by(table.c.response_id) )
+    # MySQL sums to Decimal, which jsonify cannot serialize
+    return dict((id, (int(up), int(down))) for id, up, down in rows)
+
+
+def fold_moderation():
+    """ Add the counter rows to their replies; return how many changed.
+
+    The counter rows are decremented rather than deleted, so that votes
+    which arrive while folding are not lost.
+    """
+    counters, replies = ResponseCounter.__table__, Response.__table__
+    try:
+        rows = db.session.execute(
+            db.select([counters])
+            .where((counters.c.upvotes != 0) | (counters.c.downvotes != 0))
+            .with_for_update() ).fetchall()
+        totals = {}
+        for row in rows:
+            db.session.execute(
+                counters.update()
+                .where(counters.c.response_id == row.response_id)
+                .where(counters.c.shard == row.shard)
+                .values({
+                    counters.c.upvotes: counters.c.upvotes - row.upvotes,
+                    counters.c.downvotes: counters.c.downvotes - row.downvotes,
+                }) )
+            up, down = totals.get(row.response_id, (0, 0))
+            totals[row.response_id] = up + row.upvotes, down + row.downvotes
+        for id, (up, down) in totals.iteritems():
+            db.session.execute(
+                replies.update()
+                .where(replies.c.id == id)
+                .values({
+                    replies.c.upvotes: db.func.coalesce(replies.c.upvotes, 0) + up,
+                    replies.c.downvotes: db.func.coalesce(replies.c.downvotes, 0) + down,
+                }) )
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    return len(totals)
+
+
+class CounterFolder(object):
+    """ Opportunistic background fold of the moderation counters.
+
+    Works like the SessionReaper: `maybe_fold` is called after every
+    request and starts a daemon thread once `interval` seconds passed.
+    """
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self.lock = Lock()
+        self.running = False
+        self.last_fold = time()
+        self.folded = 0
+
+    def maybe_fold(self):
+        if time() - self.last_fold < self.interval:
+            return False
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.last_fold = time()
+        thread = Thread(target=self.fold)
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def fold(self):
+        try:
+            with self.app.app_context():
+                try:
+                    self.folded = fold_moderation()
+                finally:
+                    db.session.remove()
+        except Exception:
+            self.app.logger.exception('Moderation fold failed')
+        finally:
+            self.running = False
+
+
+def init_app(app):
+    """ Configure the shards and schedule the background fold. """
+    app.config.setdefault('MODERATION_SHARDS', 8)
+    interval = app.config.setdefault('MODERATION_FOLD_INTERVAL', 300)
+    if not interval:
+        return
+    folder = app.counter_folder = CounterFolder(app, interval)
+    @app.after_request
+    def fold_after_request(response):
+        folder.maybe_fold()
+        return response
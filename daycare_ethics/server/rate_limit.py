@@ -0,0 +1,154 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Token bucket rate limiting of the write endpoints.
+
+    Unlike the throttling inside the session, this also catches clients
+    that drop their session cookie, and it rejects them before their
+    session is loaded.
+"""
+
+from functools import wraps
+from math import ceil
+from time import time
+
+from flask import current_app, request, jsonify
+
+from .session import token_family
+
+
+class MemoryBuckets(object):
+    """ Bucket states in a dict, for a single server process.
+
+    There are no locks: every update replaces the state of a bucket in
+    a single assignment. Concurrent requests of the same client may
+    therefore occasionally both pass, which is acceptable for a rate
+    limit. Once there are more than `size` buckets, idle ones are
+    dropped.
+    """
+
+    def __init__(self, size=100000):
+        self.size = size
+        self.states = {}
+
+    def get(self, key):
+        return self.states.get(key)
+
+    def set(self, key, state, ttl):
+        self.states[key] = state
+        if len(self.states) > self.size:
+            self.prune(ttl)
+
+    def prune(self, ttl):
+        idle = time() - ttl
+        for key, state in self.states.items():
+            if state[1] < idle:
+                self.states.pop(key, None)
+
+
+class KeyValueBuckets(object):
+    """ Bucket states on a key-value server such as Redis, so that all
+    server processes share them. `client` should offer the same
+    methods as for session_store.KeyValueStore.
+    """
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis  # optional dependency, only needed for this backend
+        return cls(redis.StrictRedis.from_url(url))
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        if data is not None:
+            tokens, stamp = data.split()
+            return float(tokens), float(stamp)
+
+    def set(self, key, state, ttl):
+        self.client.set(
+            self.prefix + key,
+            '{!r} {!r}'.format(*state),
+            ex=int(ceil(ttl)) )
+
+
+class RateLimiter(object):
+    """ A token bucket per client address and per session token family.
+
+    `limits` maps each kind of key to the number of requests that are
+    allowed per `period` seconds; 0 means unlimited. A full bucket
+    admits a burst of that many requests.
+    """
+
+    def __init__(self, buckets, period, limits):
+        self.buckets = buckets
+        self.period = period
+        self.limits = limits
+        self.admitted = 0
+        self.limited = 0
+
+    def take(self, kind, value, now):
+        """ Take a token from a bucket; return the seconds to wait if empty. """
+        capacity = self.limits[kind]
+        rate = float(capacity) / self.period
+        key = '{}:{}'.format(kind, value)
+        tokens, stamp = self.buckets.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - stamp) * rate)
+        if tokens < 1:
+            return (1 - tokens) / rate
+        self.buckets.set(key, (tokens - 1, now), self.period)
+        return 0
+
+    def check(self, **keys):
+        """ Return 0 if the request may pass, or the seconds to wait. """
+        now = time()
+        wait = 0
+        for kind, value in keys.iteritems():
+            if value and self.limits.get(kind):
+                wait = max(wait, self.take(kind, value, now))
+        if wait:
+            self.limited += 1
+        else:
+            self.admitted += 1
+        return wait
+
+
+def rate_limited(view):
+    """ Answer 429 Too Many Requests to clients over their rate limit. """
+    @wraps(view)
+    def wrap(**kwargs):
+        limiter = current_app.rate_limiter
+        if limiter is not None:
+            wait = limiter.check(
+                address=request.remote_addr,
+                token=token_family(request.values.get('t')) )
+            if wait:
+                response = jsonify(status='throttled')
+                response.status_code = 429
+                response.headers['Retry-After'] = str(int(ceil(wait)))
+                return response
+        return view(**kwargs)
+    return wrap
+
+
+def init_app(app):
+    """ Create the rate limiter from the RATE_LIMIT_* settings.
+
+    The address limit is only enabled by default if PROXY_HOPS is set,
+    because without it, the clients behind a proxy share an address.
+    """
+    period = app.config.setdefault('RATE_LIMIT_PERIOD', 60)
+    address = 60 if app.config.get('PROXY_HOPS') else 0
+    limits = {
+        'address': app.config.setdefault('RATE_LIMIT_ADDRESS_REQUESTS', address),
+        'token': app.config.setdefault('RATE_LIMIT_TOKEN_REQUESTS', 10),
+    }
+    url = app.config.setdefault('RATE_LIMIT_STORE_URL', None)
+    if not any(limits.values()):
+        app.rate_limiter = None
+        return
+    buckets = KeyValueBuckets.from_url(url) if url else MemoryBuckets()
+    app.rate_limiter = RateLimiter(buckets, period, limits)
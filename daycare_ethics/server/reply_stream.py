@@ -0,0 +1,193 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Push new replies to brain teasers as server-sent events.
+
+    Every server process has one ReplyHub. A single watcher thread
+    polls the database for replies with a higher id than the last one
+    it saw and wakes up all subscribers at once, so the number of
+    queries does not depend on the number of open streams. Idle
+    subscribers cost a blocked thread (or greenlet) and a generator,
+    which is why their number is capped.
+"""
+
+import atexit
+from collections import deque
+from threading import Thread, Condition, Event, Lock
+from time import time
+
+from flask import json
+
+from ..database.db import db
+from ..database.models import Response
+from .views import response2dict
+
+
+class ReplyHub(object):
+    """ Fan-out of new replies to the streams of their brain teaser.
+
+    The most recent `backlog` replies are kept as (id, brain teaser id,
+    event) triples, so that a client which reconnects with the id of
+    the last event it received does not miss anything in between.
+    At most `limit` streams are open at the same time (0 for no limit).
+    """
+
+    def __init__(self, app, interval, heartbeat, limit=0, backlog=100):
+        self.app = app
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.limit = limit
+        self.recent = deque(maxlen=backlog)
+        self.condition = Condition()
+        self.wakeup = Event()
+        self.lock = Lock()
+        self.polling = Lock()
+        self.polled = 0
+        self.thread = None
+        self.stopped = False
+        self.last_id = None
+        self.beat = 0
+        self.subscribers = 0
+        self.polls = 0
+        self.published = 0
+
+    def subscribe(self, topic, last_id=None):
+        """ Return a generator of events for brain teaser `topic`, or
+        None if the maximum number of subscribers is reached.
+
+        Must be called within an application context. The watcher does
+        not poll while nobody listens, so if it has not polled during
+        the last interval, the hub catches up first. Otherwise, new
+        clients would receive replies that they already have.
+        """
+        if self.limit and self.subscribers >= self.limit:
+            return None
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        if time() - self.polled >= self.interval:
+            self.poll()
+        if last_id is None:
+            last_id = self.last_id
+        return self.stream(topic, last_id)
+
+    def prime(self):
+        if self.last_id is None:
+            self.last_id = db.session.query(db.func.max(Response.id)).scalar() or 0
+
+    def stream(self, topic, last_id):
+        with self.condition:
+            self.subscribers += 1
+        beat = self.beat
+        try:
+            yield 'retry: {}\n\n'.format(int(self.interval * 1000))
+            while True:
+                # Also send a heartbeat if the watcher is stuck, so that
+                # the streams of clients that went away are closed.
+                deadline = time() + self.heartbeat
+                with self.condition:
+                    while True:
+                        events = [
+                            (id, event) for id, teaser, event in self.recent
+                            if id > last_id and teaser == topic
+                        ]
+                        remaining = deadline - time()
+                        if events or self.beat != beat or remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    beat = self.beat
+                if not events:
+                    yield ':\n\n'  # keeps proxies from closing the stream
+                for last_id, event in events:
+                    yield event
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def nudge(self):
+        """ Poll right away, for example after storing a reply. """
+        self.wakeup.set()
+
+    def stop(self):
+        """ End the watcher thread, at the latest after one more poll. """
+        self.stopped = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(self.interval)
+
+    def run(self):
+        last_beat = time()
+        while not self.stopped:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            beat = time() - last_beat >= self.heartbeat
+            if beat:
+                last_beat = time()
+            try:
+                if self.subscribers:
+                    with self.app.app_context():
+                        try:
+                            self.poll(beat)
+                        finally:
+                            db.session.remove()
+            except Exception:
+                self.app.logger.exception('Reply poll failed')
+
+    def poll(self, beat=False):
+        """ Publish the replies that were stored since the last poll.
+
+        Only the most recent ones that fit in the backlog are fetched.
+        """
+        with self.polling:
+            return self._poll(beat)
+
+    def _poll(self, beat):
+        self.prime()
+        replies = (
+            Response.query
+            .filter(Response.id > self.last_id)
+            .order_by(Response.id.desc())
+            .limit(self.recent.maxlen)
+            .all() )
+        replies.reverse()
+        self.polled = time()
+        self.polls += 1
+        if not replies and not beat:
+            return 0
+        with self.condition:
+            for reply in replies:
+                self.recent.append((
+                    reply.id,
+                    reply.brain_teaser_id,
+                    'id: {}\ndata: {}\n\n'.format(
+                        reply.id,
+                        json.dumps(response2dict(reply)) ),
+                ))
+            if replies:
+                self.last_id = replies[-1].id
+            self.published += len(replies)
+            self.beat += 1
+            self.condition.notify_all()
+        return len(replies)
+
+    def stats(self):
+        return {
+            'subscribers': self.subscribers,
+            'polls': self.polls,
+            'published': self.published,
+        }
+
+
+def init_app(app):
+    """ Enable the reply streams if REPLY_STREAM_INTERVAL is set. """
+    interval = app.config.setdefault('REPLY_STREAM_INTERVAL', 0)
+    heartbeat = app.config.setdefault('REPLY_STREAM_HEARTBEAT', 20)
+    limit = app.config.setdefault('REPLY_STREAM_SUBSCRIBERS', 100)
+    app.reply_hub = None
+    if not interval:
+        return
+    hub = app.reply_hub = ReplyHub(app, interval, heartbeat, limit)
+    atexit.register(hub.stop)
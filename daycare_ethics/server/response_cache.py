@@ -0,0 +1,182 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    In-process cache of the public read-only JSON responses.
+
+    The cases and brain teasers change weekly, so the same responses
+    can be served many times. Entries belong to a topic ('case' or
+    'reflection') and are dropped when their topic changes, when the
+    date changes (so that new publications appear) and in any case
+    after RESPONSE_CACHE_TIMEOUT seconds. The timeout bounds how long
+    other server processes keep serving a response after a change.
+
+    Cached responses carry an ETag and Last-Modified header, so that
+    clients which already have the same copy get a 304 straight from
+    the cache.
+"""
+
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import wraps
+from threading import Lock
+from time import time
+
+from flask import current_app, request
+from werkzeug.http import generate_etag
+
+
+class ResponseCache(object):
+    """ Map from (topic, key) to a value with its creation time.
+
+    Changes are either hard, which drops all entries of the topic, or
+    soft, for vote counts. After a soft change, entries remain valid
+    until they are `staleness` seconds old. At most `size` entries are
+    kept; the least recently used ones are dropped first.
+    """
+
+    def __init__(self, timeout, staleness=0, size=1000):
+        self.timeout = timeout
+        self.staleness = staleness
+        self.size = size
+        self.entries = OrderedDict()
+        self.changed = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, topic, key):
+        now = time()
+        with self.lock:
+            entry = self.entries.pop((topic, key), None)
+            if entry is not None:
+                if self._valid(topic, entry, now, date.today()):
+                    self.entries[topic, key] = entry
+                    self.hits += 1
+                    return entry[2]
+            self.misses += 1
+
+    def put(self, topic, key, value):
+        now, today = time(), date.today()
+        with self.lock:
+            for name, entry in self.entries.items():
+                if not self._valid(name[0], entry, now, today):
+                    del self.entries[name]
+            self.entries.pop((topic, key), None)
+            self.entries[topic, key] = today, now, value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def _valid(self, topic, entry, now, today):
+        day, created, value = entry
+        age = now - created
+        return day == today and age < self.timeout and (
+            created >= self.changed.get(topic, 0) or age < self.staleness )
+
+    def invalidate(self, topic, soft=False):
+        with self.lock:
+            if soft and self.staleness:
+                self.changed[topic] = time()
+                return
+            for entry in self.entries.keys():
+                if entry[0] == topic:
+                    del self.entries[entry]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class CachedResponse(object):
+    """ The parts of a response that are needed to serve it again.
+
+    The ETag is a hash of the body, so it is the same in every server
+    process that produces the same response. `modified` should be the
+    time at which the contents were read from the database, if known.
+    """
+
+    def __init__(self, response, modified=None):
+        self.data = response.get_data()
+        self.mimetype = response.mimetype
+        self.etag = generate_etag(self.data)
+        self.modified = modified
+
+    def make_response(self):
+        """ Return a new response, with status 304 if the client has it. """
+        response = current_app.response_class(self.data, mimetype=self.mimetype)
+        response.set_etag(self.etag)
+        if self.modified is not None:
+            response.last_modified = self.modified
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['RESPONSE_MAX_AGE']
+        return response.make_conditional(request)
+
+
+def cached(topic, args=None):
+    """ Cache the successful results of a view by endpoint and arguments.
+
+    If query parameters affect the result, `args` should be a function
+    that returns them in normalized form, so that equivalent requests
+    share an entry; all other query parameters are ignored. The view
+    may return a response or a dict; the latter is shared between
+    requests and should therefore not be modified afterwards.
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrap(**kwargs):
+            cache = current_app.response_cache
+            if cache is None:
+                return conditional(view)(**kwargs)
+            key = (
+                request.endpoint,
+                tuple(sorted(kwargs.iteritems())),
+                args and args() )
+            value = cache.get(topic, key)
+            if value is None:
+                value = view(**kwargs)
+                if isinstance(value, current_app.response_class):
+                    if value.status_code != 200:
+                        return value
+                    value = CachedResponse(value, datetime.utcnow())
+                cache.put(topic, key, value)
+            if isinstance(value, CachedResponse):
+                return value.make_response()
+            return value
+        return wrap
+    return decorate
+
+
+def conditional(view):
+    """ Add validators to the successful responses of an uncached view.
+
+    Conditional requests then get a 304 without a body, although the
+    view still runs.
+    """
+    @wraps(view)
+    def wrap(**kwargs):
+        value = view(**kwargs)
+        if isinstance(value, current_app.response_class):
+            if value.status_code == 200:
+                return CachedResponse(value).make_response()
+        return value
+    return wrap
+
+
+def invalidate(topic, soft=False):
+    """ Drop the cached responses of `topic`; see ResponseCache. """
+    cache = current_app.response_cache
+    if cache is not None:
+        cache.invalidate(topic, soft)
+
+
+def init_app(app):
+    timeout = app.config.setdefault('RESPONSE_CACHE_TIMEOUT', 60)
+    staleness = app.config.setdefault('RESPONSE_CACHE_VOTE_STALENESS', 0)
+    size = app.config.setdefault('RESPONSE_CACHE_SIZE', 1000)
+    app.config.setdefault('RESPONSE_MAX_AGE', 0)
+    app.response_cache = (
+        ResponseCache(timeout, staleness, size) if timeout else None )
@@ -5,11 +5,15 @@
     Captcha functionality common to some of the public views.
 """
 
+import os.path as op
 from datetime import datetime, timedelta
-from random import SystemRandom
 from functools import wraps
 
-from flask import current_app, session, request, jsonify, abort, json
+from flask import current_app, session, request, jsonify, abort
+
+from .blocklist import Blocklist
+from .captcha_pool import CaptchaPool
+from .captcha_index import load_index
 
 
 QUARANTINE_TIME = timedelta(minutes=30)
@@ -17,23 +21,31 @@ AUTHENTICATION_TIME = timedelta(minutes=2)
 HUMAN_LAG = timedelta(milliseconds=200)
 NORMALS = 7
 ODDBALLS = 3
+ROTATION_POLICIES = 'always', 'post', 'periodic'
 
 
 def init_app(app):
-    data = json.load(open(app.config['CAPTCHA_DATA']))
-    app.captcha_data = map(set, data.values())
+    index = app.config.setdefault('CAPTCHA_INDEX', None) or op.join(
+        app.instance_path, 'captcha.index' )
+    app.captcha_data = load_index(
+        app.config['CAPTCHA_DATA'], index, NORMALS, ODDBALLS )
+    size = app.config.setdefault('CAPTCHA_POOL_SIZE', 100)
+    app.captcha_pool = CaptchaPool(app.captcha_data.challenge, size)
+    policy = app.config.setdefault('SESSION_ROTATION', 'always')
+    if policy not in ROTATION_POLICIES:
+        raise ValueError('unknown SESSION_ROTATION: {}'.format(policy))
+    app.config.setdefault('SESSION_ROTATION_REQUESTS', 10)
+    app.config.setdefault('SESSION_ROTATION_INTERVAL', 600)
+    size = app.config.setdefault('SESSION_BLOCKLIST_SIZE', 10000)
+    ttl = app.config.setdefault('SESSION_BLOCKLIST_TIME', 1800)
+    app.config.setdefault('SESSION_BLOCKLIST_ORIGIN_THRESHOLD', 0)
+    app.blocklist = Blocklist(size, ttl) if size else None
 
 
 def init_captcha():
-    dice = SystemRandom()
-    normalset, oddballset = dice.sample(current_app.captcha_data, 2)
-    normals = dice.sample(normalset, NORMALS)
-    oddballs = dice.sample(oddballset - normalset, ODDBALLS)
-    united = normals + oddballs
-    dice.shuffle(united)
-    challenge = ' '.join(united)
+    challenge, answer = current_app.captcha_pool.draw()
     expiry = datetime.today() + AUTHENTICATION_TIME
-    session['captcha-answer'] = map(lambda s: s.lower(), oddballs)
+    session['captcha-answer'] = answer
     session['captcha-expires'] = expiry
     if 'captcha-quarantine' in session:
         del session['captcha-quarantine']
@@ -72,18 +84,84 @@ def captcha_safe():
     return True
 
 
+def blocked():
+    """ Whether the token or the origin of the request is blocklisted.
+    
+    Tokens are blocklisted when they are reused after being tainted.
+    Origins are blocklisted after SESSION_BLOCKLIST_ORIGIN_THRESHOLD
+    taints, if set. This check never touches the session itself, so it
+    costs no session lookup.
+    """
+    blocklist = current_app.blocklist
+    if blocklist is None:
+        return False
+    threshold = current_app.config['SESSION_BLOCKLIST_ORIGIN_THRESHOLD']
+    token = session.alleged_token
+    if token is not None and blocklist.blocks(('token', token)):
+        return True
+    return bool(threshold) and blocklist.blocks(
+        ('origin', request.remote_addr), threshold )
+
+
+def taint():
+    """ Mark the session as tainted and reject the request. """
+    session['tainted'] = True
+    if current_app.blocklist is not None:
+        current_app.blocklist.add(('origin', request.remote_addr))
+    abort(400)
+
+
 def verify_natural():
+    if blocked():
+        abort(400)
     if ( 'User-Agent' not in request.headers
          or request.headers['User-Agent'] == '' ):
-        session['tainted'] = True
-        abort(400)
+        taint()
     if 'tainted' in session:
+        if current_app.blocklist is not None and session.alleged_token:
+            current_app.blocklist.add(('token', session.alleged_token))
         abort(400)
 
 
+def rotation_due(request_start):
+    """ Decide whether the token should be renewed in this response.
+    
+    'always' renews on every response, 'post' only on POST requests and
+    'periodic' on every SESSION_ROTATION_REQUESTS-th POST or on the
+    first POST after the token became older than
+    SESSION_ROTATION_INTERVAL seconds. Under the latter two policies,
+    GET requests on an existing session never have to store it.
+    """
+    config = current_app.config
+    policy = config['SESSION_ROTATION']
+    if policy == 'always' or 'token-issued' not in session:
+        return True
+    if request.method != 'POST':
+        return False
+    if policy == 'post':
+        return True
+    age = request_start - session['token-issued']
+    if age >= timedelta(seconds=config['SESSION_ROTATION_INTERVAL']):
+        return True
+    uses = session.get('token-uses', 0) + 1
+    if uses >= config['SESSION_ROTATION_REQUESTS']:
+        return True
+    session['token-uses'] = uses
+    return False
+
+
 def tokenize_response(response, request_start):
-    key = session.renew_token()
-    session['last-request'] = request_start
+    if rotation_due(request_start):
+        key = session.renew_token()
+        session['token-issued'] = request_start
+        session['last-request'] = request_start
+        if 'token-uses' in session:
+            del session['token-uses']
+    else:
+        key = session['token']
+        if request.method == 'POST':
+            # session_protect measures HUMAN_LAG from here
+            session['last-request'] = request_start
     if isinstance(response, tuple):
         if len(response) == 3:
             return jsonify(token=key, **response[0]), response[1], response[2]
@@ -109,7 +187,6 @@ def session_protect(view):
         if ('token' not in session or 't' not in request.form
              or request.form['t'] != session['token']
              or datetime.today() - session['last-request'] < HUMAN_LAG ):
-            session['tainted'] = True
-            abort(400)
+            taint()
         return tokenize_response(view(**kwargs), now)
     return wrap
@@ -6,77 +6,263 @@
 """
 
 import random
+import atexit
+import hmac
+from hashlib import sha256
+from datetime import datetime
+from threading import Lock
 
 import flask.sessions as fs
+from werkzeug.datastructures import CallbackDict
 
-from ..database import models as m
+from ..database.codec import KEY_CHARS, KEY_INDEX, LegacyPayload
+from .session_store import make_store
+from .session_cache import SessionCache
+from .blocklist import Blocklist
 
 
-KEY_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
-KEY_LENGTH = 30  # WARNING: this is also hardcoded in ..database.models.Session
-                 # so you have to update the key length in two places!
+KEY_LENGTH = 30
+TAG_LENGTH = 8
+FAMILY_LENGTH = 8
 
 
-def generate_key():
+def generate_key(secret=None, family=None):
+    """ Random token; signed with `secret` if given, see sign_key.
+    
+    If `family` is given, the token starts with those characters
+    instead of random ones, see token_family.
+    """
     rng = random.SystemRandom()
-    return ''.join((rng.choice(KEY_CHARS) for i in range(KEY_LENGTH)))
+    length = KEY_LENGTH if secret is None else KEY_LENGTH - TAG_LENGTH
+    key = family or ''
+    key += ''.join((rng.choice(KEY_CHARS) for i in range(length - len(key))))
+    if secret is None:
+        return key
+    return key + sign_key(key, secret)
+
+
+def token_family(token):
+    """ The first FAMILY_LENGTH characters of `token`.
+    
+    Rotated tokens keep the family of the token that they replace, so
+    that the family identifies a session across rotations without a
+    lookup. Tokens that do not look like ours have no family.
+    """
+    if token is None or len(token) != KEY_LENGTH:
+        return None
+    family = token[:FAMILY_LENGTH]
+    if all(char in KEY_INDEX for char in family):
+        return family
+
 
+def sign_key(key, secret):
+    """ TAG_LENGTH characters of HMAC-SHA256 of `key` under `secret`. """
+    digest = hmac.new(secret, key.encode('utf-8'), sha256).hexdigest()
+    number = int(digest[:16], 16)
+    chars = []
+    for i in range(TAG_LENGTH):
+        number, index = divmod(number, len(KEY_CHARS))
+        chars.append(KEY_CHARS[index])
+    return ''.join(chars)
 
-class Session(dict, fs.SessionMixin):
-    """ Vehicle for our server-side session objects. """
+
+def verify_key(token, secret):
+    """ Whether `token` was generated by generate_key with `secret`. """
+    if len(token) != KEY_LENGTH:
+        return False
+    key, tag = token[:-TAG_LENGTH], token[-TAG_LENGTH:]
+    return hmac.compare_digest(sign_key(key, secret), tag.encode('utf-8'))
+
+
+class Session(CallbackDict, fs.SessionMixin):
+    """ Vehicle for our server-side session objects.
+    
+    Tracks modification like Flask's own cookie sessions, so that
+    unchanged sessions need not be stored again. In-place changes to
+    mutable values are not detected; reassign the key instead.
+    
+    If a `loader` is passed, the contents are only filled in by calling
+    `loader(self)` when the session is first accessed. Requests that
+    never touch the session thus never cost a lookup.
+    """
     former = None
     new = True
+    alleged_token = None
+    rejected = False
     
     def renew_token(self):
-        key = generate_key()
+        self.load()
+        family = token_family(dict.get(self, 'token'))
+        key = generate_key(self.secret, family)
         self['token'] = key
         return key
     
-    def __init__(self):
-        super(Session, self).__init__()
-        self.renew_token()
+    def load(self):
+        if self.loader is not None:
+            loader, self.loader = self.loader, None
+            loader(self)
+    
+    @property
+    def loaded(self):
+        return self.loader is None
+    
+    def __init__(self, loader=None, secret=None):
+        def on_update(self):
+            self.modified = True
+        super(Session, self).__init__(on_update=on_update)
+        self.loader = loader
+        self.secret = secret
+        self.modified = False
+        if loader is None:
+            self.renew_token()
+
+
+def _loading(name):
+    """ Wrap dict method `name` so that it loads the session first. """
+    method = getattr(CallbackDict, name)
+    def wrap(self, *args, **kwargs):
+        self.load()
+        return method(self, *args, **kwargs)
+    wrap.__name__ = name
+    return wrap
+
+for name in (
+        '__getitem__', '__setitem__', '__delitem__', '__contains__',
+        '__iter__', '__len__', '__eq__', '__ne__', '__repr__',
+        'get', 'has_key', 'keys', 'values', 'items', 'iterkeys',
+        'itervalues', 'iteritems', 'copy', 'clear', 'pop', 'popitem',
+        'setdefault', 'update' ):
+    setattr(Session, name, _loading(name))
+del name
+
+
+def init_app(app):
+    """ Install the session interface, with a cache if configured. """
+    store = make_store(app)
+    secret = None
+    if app.config.setdefault('SESSION_SIGNED_TOKENS', False):
+        if not app.secret_key:
+            raise ValueError('SESSION_SIGNED_TOKENS requires a SECRET_KEY')
+        secret = app.secret_key
+        if isinstance(secret, unicode):
+            secret = secret.encode('utf-8')
+    size = app.config.setdefault('SESSION_CACHE_SIZE', 0)
+    flush_size = app.config.setdefault('SESSION_CACHE_FLUSH_SIZE', 100)
+    flush_interval = app.config.setdefault('SESSION_CACHE_FLUSH_INTERVAL', 5)
+    if size:
+        store = SessionCache(store, size, flush_size, flush_interval)
+        def flush_on_exit():
+            with app.app_context():
+                store.flush()
+        atexit.register(flush_on_exit)
+    retired = None
+    if app.config.setdefault('SESSION_RETIRED_SIZE', 10000):
+        lifetime = app.permanent_session_lifetime
+        retired = Blocklist(
+            app.config['SESSION_RETIRED_SIZE'],
+            lifetime.days * 86400 + lifetime.seconds )
+    app.session_interface = SessionInterface(store, secret, retired)
 
 
 class SessionInterface(fs.SessionInterface):
-    """ The server-side replacement implementation for session handling. """
+    """ The server-side replacement implementation for session handling.
+    
+    Sessions are kept in `store`, which implements the interface of
+    .session_store.SessionStore. If a `secret` is given, tokens are
+    signed with it and tokens with an invalid signature are rejected
+    without looking them up.
+    
+    A well-formed token without a stored session usually belonged to a
+    session that expired and was purged, so it is replaced by a fresh
+    session. Only tokens that this process recently rotated away, as
+    recorded in `retired` (a Blocklist), are taken as replays and
+    tainted.
+    """
     
     session_class = Session
     pickle_based = True
     
+    def __init__(self, store, secret=None, retired=None):
+        self.store = store
+        self.secret = secret
+        self.retired = retired
+        self.lock = Lock()
+        self.lookups = 0
+        self.avoided_lookups = 0
+        self.rejected = 0
+    
+    def fetch(self, token):
+        """ Return the payload stored under `token`, or None. """
+        with self.lock:
+            self.lookups += 1
+        entry = self.store.get(token)
+        if entry is not None:
+            return entry[1]
+    
     def open_session(self, app, request):
-        s = Session()
         cookie_name = app.config['SESSION_COOKIE_NAME']
         alleged_token = None
         if 't' in request.values:
             alleged_token = request.values['t']
         elif cookie_name in request.cookies:
             alleged_token = request.cookies[cookie_name]
-        if alleged_token is not None and len(alleged_token) <= KEY_LENGTH:
-            data = m.Session.query.get(alleged_token)
-            if data:
-                s.update(data.payload)
-                s.former = data
+        if alleged_token is None or len(alleged_token) > KEY_LENGTH:
+            return Session(Session.renew_token, self.secret)
+        def taint(s):
+            s['tainted'] = True
+            s['token'] = alleged_token
+            s.permanent = True
+        def load(s):
+            payload = self.fetch(alleged_token)
+            if payload is not None:
+                dict.update(s, payload)
+                s.former = alleged_token
                 s.new = False
+                # rewrite rows from older versions in the current format
+                s.modified = isinstance(payload, LegacyPayload)
+            elif self.retired is not None and self.retired.count(alleged_token):
+                taint(s)
             else:
-                s['tainted'] = True
-                s['token'] = alleged_token
-                s.permanent = True
+                s.renew_token()
+        if self.secret is None or verify_key(alleged_token, self.secret):
+            s = Session(load, self.secret)
+        else:
+            with self.lock:
+                self.rejected += 1
+            s = Session(taint, self.secret)
+            s.rejected = True  # forged, not worth storing
+        s.alleged_token = alleged_token
         return s
     
+    def stats(self):
+        """ Counters of performed, avoided and rejected session lookups. """
+        with self.lock:
+            return {
+                'lookups': self.lookups,
+                'avoided_lookups': self.avoided_lookups,
+                'rejected': self.rejected,
+            }
+    
     def save_session(self, app, session, response):
-        cookie_name = app.config['SESSION_COOKIE_NAME']
-        max_lifetime = app.config['PERMANENT_SESSION_LIFETIME']
-        expires = self.get_expiration_time(app, session)
-        if session.modified and 'token' in session:
-            db_session = app.extensions['sqlalchemy'].db.session
-            if session.former != None:
-                db_session.delete(session.former)
-            db_session.add(m.Session(
-                token=session['token'],
-                expires=expires,
-                payload=dict(session)
-            ))
-            db_session.commit()
+        if not session.loaded:
+            # never accessed during this request, so nothing changed
+            if session.alleged_token is not None and not session.rejected:
+                with self.lock:
+                    self.avoided_lookups += 1
+        elif session.modified and 'token' in session and not session.rejected:
+            cookie_name = app.config['SESSION_COOKIE_NAME']
+            max_lifetime = app.config['PERMANENT_SESSION_LIFETIME']
+            expires = (
+                self.get_expiration_time(app, session) or
+                datetime.utcnow() + app.permanent_session_lifetime )
+            self.store.rotate(
+                session.former,
+                session['token'],
+                expires,
+                dict(session) )
+            if self.retired is not None and session.former not in (
+                    None, session['token'] ):
+                self.retired.add(session.former)
             response.set_cookie(
                 cookie_name,
                 value=session['token'],
@@ -84,3 +270,5 @@ class SessionInterface(fs.SessionInterface):
                 httponly=app.config['SESSION_COOKIE_HTTPONLY'],
                 path=app.config['APPLICATION_ROOT']
             )
+        if isinstance(self.store, SessionCache) and self.store.needs_flush():
+            self.store.flush()
@@ -0,0 +1,149 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    In-process cache with write-behind in front of a session store.
+
+    Reads are served from a bounded LRU cache and only go to the
+    backing store on a miss. Writes are collected in a buffer that is
+    flushed to the store in batches. This is only safe if a single
+    process serves all requests, because other processes will not see
+    the buffered writes.
+"""
+
+from collections import OrderedDict
+from copy import deepcopy
+from datetime import datetime
+from threading import Lock
+from time import time
+
+from .session_store import SessionStore, PURGE_BATCH_SIZE
+
+
+class SessionCache(SessionStore):
+    """ Bounded LRU cache of sessions with a write-behind buffer.
+
+    Entries are evicted when they are least recently used or when the
+    `expires` time of the session has passed. Pending writes map a
+    token to an (expires, payload) pair; a pending value of None means
+    that the session must be deleted.
+    """
+
+    def __init__(self, store, size, flush_size=100, flush_interval=5):
+        self.store = store
+        self.size = size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = Lock()
+        self.last_flush = time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def lookup(self, token):
+        """ Return (expires, payload) for `token` or None on a miss.
+
+        If the session is pending deletion, (None, None) is returned so
+        that the caller does not look it up in the backing store.
+        """
+        now = datetime.utcnow()
+        with self.lock:
+            entry = self.entries.pop(token, None)
+            if entry is not None and entry[0] is not None and entry[0] < now:
+                self.evictions += 1
+                entry = None
+            if entry is None and token in self.pending:
+                entry = self.pending[token]
+                if entry is None:
+                    self.hits += 1
+                    return None, None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._store(token, entry)
+            self.hits += 1
+            return entry[0], deepcopy(entry[1])
+
+    def fill(self, token, expires, payload):
+        """ Store a session that was just read from the backing store. """
+        with self.lock:
+            self._store(token, (expires, deepcopy(payload)))
+
+    def get(self, token):
+        entry = self.lookup(token)
+        if entry is None:
+            entry = self.store.get(token)
+            if entry is not None:
+                self.fill(token, *entry)
+        elif entry[1] is None:
+            return None
+        return entry
+
+    def put(self, token, expires, payload):
+        """ Store a modified session and schedule it for writing. """
+        entry = expires, deepcopy(payload)
+        with self.lock:
+            self._store(token, entry)
+            self.pending[token] = entry
+
+    def delete(self, token):
+        """ Drop a session and schedule it for deletion. """
+        with self.lock:
+            self.entries.pop(token, None)
+            self.pending[token] = None
+
+    def purge(self, batch_size=PURGE_BATCH_SIZE, legacy=False):
+        self.flush()
+        return self.store.purge(batch_size, legacy)
+
+    def _store(self, token, entry):
+        self.entries.pop(token, None)
+        self.entries[token] = entry
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def needs_flush(self):
+        return bool(self.pending) and (
+            len(self.pending) >= self.flush_size or
+            time() - self.last_flush >= self.flush_interval )
+
+    def flush(self):
+        """ Write all pending changes to the backing store at once.
+
+        If writing fails, the batch is put back into the buffer unless
+        a newer version was buffered in the meanwhile.
+        """
+        with self.lock:
+            batch, self.pending = self.pending, {}
+            self.last_flush = time()
+        if not batch:
+            return 0
+        try:
+            self.store.write_batch(batch)
+        except:
+            with self.lock:
+                for token, entry in batch.iteritems():
+                    self.pending.setdefault(token, entry)
+            raise
+        with self.lock:
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+        return len(batch)
+
+    def stats(self):
+        """ Counters for sizing the cache. """
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'pending': len(self.pending),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'flushes': self.flushes,
+                'flushed_rows': self.flushed_rows,
+            }
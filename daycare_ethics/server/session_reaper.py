@@ -0,0 +1,74 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Periodic removal of expired sessions from the session store.
+"""
+
+from threading import Thread, Lock
+from time import time
+
+from .session_store import PURGE_BATCH_SIZE
+
+
+class SessionReaper(object):
+    """ Opportunistic background sweep of expired sessions.
+
+    `maybe_sweep` is cheap enough to call after every request. Once
+    `interval` seconds have passed since the previous sweep, it starts
+    a daemon thread that purges the expired sessions.
+    """
+
+    def __init__(self, app, interval, batch_size=PURGE_BATCH_SIZE):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock = Lock()
+        self.running = False
+        self.last_sweep = time()
+        self.purged = 0
+        self.duration = 0
+
+    def maybe_sweep(self):
+        if time() - self.last_sweep < self.interval:
+            return False
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.last_sweep = time()
+        thread = Thread(target=self.sweep)
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def sweep(self):
+        try:
+            with self.app.app_context():
+                db = self.app.extensions['sqlalchemy'].db
+                try:
+                    store = self.app.session_interface.store
+                    self.purged, self.duration = store.purge(self.batch_size)
+                finally:
+                    db.session.remove()
+            self.app.logger.info(
+                'Purged %d expired sessions in %.3f seconds',
+                self.purged,
+                self.duration )
+        except Exception:
+            self.app.logger.exception('Session sweep failed')
+        finally:
+            self.running = False
+
+
+def init_app(app):
+    """ Schedule background sweeps if SESSION_PURGE_INTERVAL is set. """
+    interval = app.config.setdefault('SESSION_PURGE_INTERVAL', 3600)
+    batch_size = app.config.setdefault('SESSION_PURGE_BATCH_SIZE', PURGE_BATCH_SIZE)
+    if not interval:
+        return
+    reaper = app.session_reaper = SessionReaper(app, interval, batch_size)
+    @app.after_request
+    def sweep_after_request(response):
+        reaper.maybe_sweep()
+        return response
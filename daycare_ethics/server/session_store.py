@@ -0,0 +1,515 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Storage backends for the server-side sessions.
+
+    All backends implement the SessionStore interface. The backend is
+    selected with the SESSION_STORE setting, see make_store.
+"""
+
+import os
+import os.path as op
+from binascii import hexlify, unhexlify
+from contextlib import contextmanager
+from datetime import datetime
+from tempfile import mkstemp
+from time import time
+from zlib import crc32
+
+from sqlalchemy import create_engine
+
+from ..database import db
+from ..database import models as m
+from ..database.codec import (
+    pack_token, unpack_token, encode_record, decode_record,
+    PackedToken, SessionPayload )
+
+
+PURGE_BATCH_SIZE = 1000
+SHARD_PREFIX_LENGTH = 8  # the token family, so rotation stays within a shard
+
+
+class SessionStore(object):
+    """ Interface of session storage backends.
+
+    Payloads are dictionaries and expiry times are naive UTC datetimes.
+    Lookups return an (expires, payload) pair or None. Expired sessions
+    may still be returned until they are purged.
+    """
+
+    def get(self, token):
+        raise NotImplementedError
+
+    def put(self, token, expires, payload):
+        raise NotImplementedError
+
+    def rotate(self, former, token, expires, payload):
+        """ Store the session under `token` and drop `former`, if any. """
+        self.put(token, expires, payload)
+        if former is not None and former != token:
+            self.delete(former)
+
+    def delete(self, token):
+        raise NotImplementedError
+
+    def tokens(self):
+        """ List all stored tokens. Only needed for resharding. """
+        raise NotImplementedError
+
+    def purge(self, batch_size=PURGE_BATCH_SIZE, legacy=False):
+        """ Delete expired sessions; return (count, seconds spent).
+
+        `legacy` only matters for stores that once held sessions
+        without an expiry time.
+        """
+        raise NotImplementedError
+
+    def write_batch(self, batch):
+        """ Apply a dict from token to (expires, payload), or to None
+        for deletion. Backends may override this with something faster.
+        """
+        for token, entry in batch.iteritems():
+            if entry is None:
+                self.delete(token)
+            else:
+                self.put(token, *entry)
+
+
+class SQLStore(SessionStore):
+    """ Sessions in a table of a relational database.
+
+    By default, this is the Session table of the application database.
+    Pass a `table` with the same columns in order to use another one,
+    and an `engine` if that table lives in a different database.
+    """
+
+    def __init__(self, table=None, engine=None):
+        self.table = m.Session.__table__ if table is None else table
+        self.engine = engine
+
+    @contextmanager
+    def transaction(self):
+        """ Yield something to execute statements on, then commit. """
+        if self.engine is not None:
+            with self.engine.begin() as connection:
+                yield connection
+            return
+        try:
+            yield db.session
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+    def matches(self, token):
+        """ Filter on `token` in both its packed and its legacy text form. """
+        return self.matches_any([token])
+
+    def matches_any(self, tokens):
+        """ Like matches, for all of `tokens` at once. """
+        return self.table.c.token.in_(
+            list(tokens) + [db.literal(token, db.String) for token in tokens] )
+
+    def get(self, token):
+        table = self.table
+        with self.transaction() as connection:
+            return connection.execute(
+                db.select([table.c.expires, table.c.payload])
+                .where(self.matches(token))
+            ).first()
+
+    def put(self, token, expires, payload):
+        self.rotate(token, token, expires, payload)
+
+    def rotate(self, former, token, expires, payload):
+        """ Move the row of token `former` to `token` in a single UPDATE.
+
+        The row is inserted instead if `former` is None or if its row
+        has disappeared in the meanwhile.
+        """
+        table = self.table
+        values = {'token': token, 'expires': expires, 'payload': payload}
+        with self.transaction() as connection:
+            if former is not None:
+                result = connection.execute(
+                    table.update().where(self.matches(former)).values(values) )
+                if result.rowcount:
+                    return
+            connection.execute(table.insert().values(values))
+
+    def delete(self, token):
+        with self.transaction() as connection:
+            connection.execute(self.table.delete().where(self.matches(token)))
+
+    def tokens(self):
+        with self.transaction() as connection:
+            return [row.token for row in connection.execute(
+                db.select([self.table.c.token]) )]
+
+    def purge(self, batch_size=PURGE_BATCH_SIZE, legacy=False):
+        """ Delete expired rows in batches, with a commit per batch.
+
+        This keeps every transaction short, so that no single DELETE
+        holds locks on a large part of the table. If `legacy` is true,
+        rows without an expiry time are deleted as well. Such rows were
+        written by versions that did not store the expiry of
+        non-permanent sessions.
+        """
+        start = time()
+        table = self.table
+        condition = table.c.expires < datetime.utcnow()
+        if legacy:
+            condition = condition | (table.c.expires == None)
+        purged = 0
+        while True:
+            with self.transaction() as connection:
+                tokens = [row.token for row in connection.execute(
+                    db.select([table.c.token]).where(condition).limit(batch_size)
+                )]
+                deleted = 0
+                if tokens:
+                    deleted = connection.execute(
+                        table.delete().where(self.matches_any(tokens))
+                    ).rowcount
+            purged += deleted
+            if len(tokens) < batch_size or not deleted:
+                break
+        return purged, time() - start
+
+    def write_batch(self, batch):
+        """ Upsert by deleting all tokens in `batch` and inserting the
+        ones that still have a payload, in a single transaction.
+        """
+        table = self.table
+        rows = [
+            {'token': token, 'expires': entry[0], 'payload': entry[1]}
+            for token, entry in batch.iteritems() if entry is not None
+        ]
+        with self.transaction() as connection:
+            connection.execute(
+                table.delete().where(self.matches_any(batch.keys())) )
+            if rows:
+                connection.execute(table.insert(), rows)
+
+
+class MemoryStore(SessionStore):
+    """ Sessions in a dictionary, for deployments with a single process. """
+
+    def __init__(self):
+        self.sessions = {}
+
+    def get(self, token):
+        entry = self.sessions.get(token)
+        if entry is not None:
+            return entry[0], decode_record(entry[1])[1]
+
+    def put(self, token, expires, payload):
+        # store encoded, so that callers cannot share mutable values
+        self.sessions[token] = expires, encode_record(None, payload)
+
+    def delete(self, token):
+        self.sessions.pop(token, None)
+
+    def tokens(self):
+        return self.sessions.keys()
+
+    def purge(self, batch_size=PURGE_BATCH_SIZE, legacy=False):
+        start = time()
+        now = datetime.utcnow()
+        expired = [
+            token for token, entry in self.sessions.items()
+            if entry[0] is not None and entry[0] < now
+        ]
+        for token in expired:
+            self.sessions.pop(token, None)
+        return len(expired), time() - start
+
+
+class FileStore(SessionStore):
+    """ Sessions as files in a local directory, one file per session.
+
+    Files are replaced by atomic renames, so multiple processes on the
+    same machine can share a directory. Files are spread over 256
+    subdirectories to keep the directories small.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, token):
+        name = hexlify(pack_token(token))
+        return op.join(self.directory, name[-2:], name)
+
+    def get(self, token):
+        try:
+            with open(self.path(token), 'rb') as record:
+                return decode_record(record.read())
+        except IOError:
+            return None
+
+    def put(self, token, expires, payload):
+        path = self.path(token)
+        directory = op.dirname(path)
+        if not op.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass  # created by another process in the meanwhile
+        handle, temporary = mkstemp(dir=directory, prefix='.')
+        with os.fdopen(handle, 'wb') as record:
+            record.write(encode_record(expires, payload))
+        os.rename(temporary, path)
+
+    def delete(self, token):
+        try:
+            os.remove(self.path(token))
+        except OSError:
+            pass
+
+    def tokens(self):
+        return [
+            unpack_token(unhexlify(name))
+            for directory, subdirectories, names in os.walk(self.directory)
+            for name in names if not name.startswith('.')
+        ]
+
+    def purge(self, batch_size=PURGE_BATCH_SIZE, legacy=False):
+        start = time()
+        now = datetime.utcnow()
+        purged = 0
+        for directory, subdirectories, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith('.'):
+                    continue  # being written by put
+                path = op.join(directory, name)
+                try:
+                    with open(path, 'rb') as record:
+                        expires = decode_record(record.read())[0]
+                    if expires is not None and expires < now:
+                        os.remove(path)
+                        purged += 1
+                except (IOError, OSError):
+                    pass  # removed by another process in the meanwhile
+        return purged, time() - start
+
+
+class KeyValueStore(SessionStore):
+    """ Sessions on a key-value server such as Redis.
+
+    `client` should offer get(key), set(key, value, ex=seconds) and
+    delete(key), like redis.StrictRedis. The server expires sessions by
+    itself, so purge has nothing to do.
+    """
+
+    def __init__(self, client, prefix='session:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis  # optional dependency, only needed for this backend
+        return cls(redis.StrictRedis.from_url(url))
+
+    def get(self, token):
+        data = self.client.get(self.prefix + token)
+        if data is not None:
+            return decode_record(data)
+
+    def put(self, token, expires, payload):
+        ttl = None
+        if expires is not None:
+            delta = expires - datetime.utcnow()
+            ttl = max(1, delta.days * 86400 + delta.seconds)
+        self.client.set(self.prefix + token, encode_record(expires, payload), ex=ttl)
+
+    def delete(self, token):
+        self.client.delete(self.prefix + token)
+
+    def purge(self, batch_size=PURGE_BATCH_SIZE, legacy=False):
+        return 0, 0.0
+
+
+class ShardedStore(SessionStore):
+    """ Sessions spread over several child stores by a hash of the token.
+
+    Each shard is usually a separate table or database, so that writers
+    of different sessions do not wait for each other.
+
+    During resharding, `previous` lists the shards of the old layout.
+    Sessions that are only found there are moved to their new shard
+    when they are read; `reshard` moves all remaining ones at once.
+    The same store may appear in both layouts.
+    """
+
+    def __init__(self, shards, previous=None):
+        self.shards = shards
+        self.previous = previous
+
+    @staticmethod
+    def locate(token, shards):
+        prefix = token[:SHARD_PREFIX_LENGTH].encode('utf-8')
+        return shards[(crc32(prefix) & 0xffffffff) % len(shards)]
+
+    def shard(self, token):
+        return self.locate(token, self.shards)
+
+    def former_shard(self, token):
+        """ The shard of `token` in the old layout, if different. """
+        if self.previous:
+            shard = self.locate(token, self.previous)
+            if shard is not self.shard(token):
+                return shard
+
+    def all_shards(self):
+        shards = list(self.shards)
+        for shard in self.previous or ():
+            if shard not in shards:
+                shards.append(shard)
+        return shards
+
+    def get(self, token):
+        shard = self.shard(token)
+        entry = shard.get(token)
+        if entry is None:
+            former = self.former_shard(token)
+            if former is not None:
+                entry = former.get(token)
+                if entry is not None:
+                    shard.put(token, *entry)
+                    former.delete(token)
+        return entry
+
+    def put(self, token, expires, payload):
+        self.shard(token).put(token, expires, payload)
+
+    def rotate(self, former, token, expires, payload):
+        shard = self.shard(token)
+        if former is not None and self.shard(former) is shard:
+            shard.rotate(former, token, expires, payload)
+        else:
+            super(ShardedStore, self).rotate(former, token, expires, payload)
+
+    def delete(self, token):
+        self.shard(token).delete(token)
+        former = self.former_shard(token)
+        if former is not None:
+            former.delete(token)
+
+    def tokens(self):
+        return [token for shard in self.all_shards() for token in shard.tokens()]
+
+    def purge(self, batch_size=PURGE_BATCH_SIZE, legacy=False):
+        start = time()
+        purged = 0
+        for shard in self.all_shards():
+            purged += shard.purge(batch_size, legacy)[0]
+        return purged, time() - start
+
+    def write_batch(self, batch):
+        for shard, part in self.split(batch).iteritems():
+            shard.write_batch(part)
+        if self.previous:
+            deletions = self.split(dict.fromkeys(batch), self.former_shard)
+            for shard, part in deletions.iteritems():
+                shard.write_batch(part)
+
+    def split(self, batch, locate=None):
+        """ Divide `batch` into one dict per shard. """
+        locate = locate or self.shard
+        parts = {}
+        for token, entry in batch.iteritems():
+            shard = locate(token)
+            if shard is not None:
+                parts.setdefault(shard, {})[token] = entry
+        return parts
+
+    def reshard(self, batch_size=PURGE_BATCH_SIZE):
+        """ Move all sessions from the old layout to their new shards.
+
+        Sessions are copied before they are deleted from their old
+        shard, so that none are lost if this is interrupted. Returns
+        (count, seconds spent).
+        """
+        start = time()
+        moved = 0
+        for old in self.previous or ():
+            tokens = [
+                token for token in old.tokens()
+                if self.shard(token) is not old
+            ]
+            for offset in xrange(0, len(tokens), batch_size):
+                chunk = tokens[offset:offset + batch_size]
+                entries = {}
+                for token in chunk:
+                    entry = old.get(token)
+                    if entry is not None:
+                        entries[token] = tuple(entry)
+                for shard, part in self.split(entries).iteritems():
+                    shard.write_batch(part)
+                old.write_batch(dict.fromkeys(chunk))
+                moved += len(entries)
+        return moved, time() - start
+
+
+def shard_table(number, metadata):
+    """ Table for shard `number`, with the columns of models.Session. """
+    name = 'session_{}'.format(number)
+    if name in metadata.tables:
+        return metadata.tables[name]
+    return db.Table(
+        name, metadata,
+        db.Column('token', PackedToken, primary_key=True),
+        db.Column('expires', db.DateTime, index=True),
+        db.Column('payload', SessionPayload) )
+
+
+def make_sharded_store(app):
+    """ Create a ShardedStore of SESSION_SHARDS SQL stores.
+
+    If SESSION_SHARD_URI is set, shard n is stored in the database at
+    SESSION_SHARD_URI.format(n). Otherwise, the shards are tables in
+    the application database. During resharding, set
+    SESSION_SHARDS_PREVIOUS to the former number of shards.
+    """
+    count = app.config.setdefault('SESSION_SHARDS', 4)
+    previous = app.config.setdefault('SESSION_SHARDS_PREVIOUS', None)
+    uri = app.config.setdefault('SESSION_SHARD_URI', None)
+    stores = []
+    for number in xrange(max(count, previous or 0)):
+        if uri is None:
+            stores.append(SQLStore(shard_table(number, db.metadata)))
+        else:
+            engine = create_engine(uri.format(number))
+            metadata = db.MetaData()
+            table = shard_table(number, metadata)
+            metadata.create_all(engine)
+            stores.append(SQLStore(table, engine))
+    return ShardedStore(stores[:count], previous and stores[:previous])
+
+
+def make_store(app):
+    """ Create the store that is selected by SESSION_STORE.
+
+    SESSION_STORE is one of 'sql' (default), 'memory', 'file', 'redis'
+    or 'sharded' (see make_sharded_store), or a callable that takes the app and returns a
+    SessionStore. The file store keeps its files in SESSION_STORE_PATH,
+    by default the sessions directory in the instance folder. The redis
+    store connects to SESSION_STORE_URL.
+    """
+    kind = app.config.setdefault('SESSION_STORE', 'sql')
+    if kind == 'sql':
+        return SQLStore()
+    if kind == 'memory':
+        return MemoryStore()
+    if kind == 'file':
+        return FileStore(
+            app.config.get('SESSION_STORE_PATH') or
+            op.join(app.instance_path, 'sessions') )
+    if kind == 'redis':
+        return KeyValueStore.from_url(app.config['SESSION_STORE_URL'])
+    if kind == 'sharded':
+        return make_sharded_store(app)
+    if callable(kind):
+        return kind(app)
+    raise ValueError('unknown SESSION_STORE: {}'.format(kind))
@@ -6,6 +6,7 @@
     Directly visitable routes on the domain.
 """
 
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 from datetime import date, datetime, timedelta
 from functools import wraps
 
@@ -16,9 +17,16 @@ from ..database.models import *
 from ..database.db import db
 from .blueprint import public
 from .security import session_enable, session_protect, init_captcha, captcha_safe
+from .rate_limit import rate_limited
+from .admission import admits
+from .response_cache import cached, invalidate
+from .moderation import count_moderation, pending_moderation
+from .media import send_media, accepts_webp
 
 
 ISOFORMAT = '%Y-%m-%d %H:%M:%S.%f'
+REPLY_PAGE_LIMIT = 100  # most replies per page of a brain teaser
+TIP_GROUPS = (('labour code', 'labour'), ('book', 'book'), ('site', 'site'))
 POST_INTERVAL = timedelta(minutes=10)
 
 
@@ -45,20 +53,28 @@ def index():
 @public.route('/media/<int:id>/<int:width>')
 @allow_crossdomain
 def media(id, width):
-    try:
-        image = Picture.query.filter_by(id=id).one().path
-    except:
+    entry = current_app.media_paths.lookup(id)
+    if entry is None:
         abort(404)
-    variants = image_variants(image)
+    path, mime_type, status, formats = entry
+    if not mime_type.startswith('image'):
+        return send_media(path, mime_type, ranges=True)
+    if status != 'ready':  # variants are pending or failed
+        return send_media(path, mime_type, final=False)
+    format = 'webp' if 'webp' in formats and accepts_webp() else 'jpeg'
+    variants = image_variants(path, format)
     cutoffs = TARGET_WIDTHS[1:] + (100000,)
     for cutoff, variant in zip(cutoffs, variants):
         if cutoff > width:
-            return send_from_directory(current_app.instance_path, variant)
+            response = send_media(variant, 'image/' + format)
+            response.vary.add('Accept')
+            return response
     abort(404)
 
 
 @public.route('/case/')
 @allow_crossdomain
+@cached('case')
 def current_casus():
     latest_casus = available_casus().first()
     if not latest_casus or not latest_casus.publication:
@@ -68,6 +84,7 @@ def current_casus():
 
 @public.route('/case/<int:id>')
 @allow_crossdomain
+@cached('case')
 def retrieve_casus(id):
     casus = Case.query.get_or_404(id)
     if not casus.publication or casus.publication > date.today():
@@ -106,42 +123,66 @@ def available_casus():
 
 @public.route('/case/archive')
 @allow_crossdomain
+@cached('case')
 def casus_archive():
     return jsonify(all=map(casus2dict, available_casus().all()))
 
 
 @public.route('/case/vote', methods=['POST'])
 @allow_crossdomain
+@rate_limited
 @session_protect
+@admits('t', 'id', 'choice')
 def vote_casus():
     now = datetime.today()
-    if 'id' not in request.form or 'choice' not in request.form:
-        return {'status': 'invalid'}, 400
     id, choice = int(request.form['id']), request.form['choice']
+    if choice not in ('yes', 'no'):
+        return {'status': 'invalid'}, 400
+    buffer = current_app.vote_buffer
+    if buffer is not None:
+        if not buffer.open_case(id, now.date()):
+            return {'status': 'unavailable'}, 400
+        buffer.add(id, choice == 'yes', now)
+        return {'status': 'success'}
+    if not count_vote(id, choice == 'yes', now):
+        return {'status': 'unavailable'}, 400
+    invalidate('case', soft=True)
+    return {'status': 'success'}
+
+
+def count_vote(id, agree, now):
+    """ Record a vote on case `id` in a single transaction.
+    
+    The counter is incremented by the database itself, so concurrent
+    votes cannot overwrite each other. Returns False if the case does
+    not exist or is closed.
+    """
+    table = Case.__table__
+    counter = table.c.yes_votes if agree else table.c.no_votes
     try:
-        casus = Case.query.filter_by(id=id).one()
+        result = db.session.execute(
+            table.update()
+            .where(table.c.id == id)
+            .where((table.c.closure == None) | (table.c.closure > date.today()))
+            .values({counter: db.func.coalesce(counter, 0) + 1}) )
+        if not result.rowcount:
+            db.session.rollback()
+            return False
+        db.session.execute(Vote.__table__.insert().values(
+            case_id=id,
+            submission=now,
+            agree=agree ))
+        db.session.commit()
     except:
-        return {'status': 'unavailable'}, 400
-    if casus.closure and casus.closure <= date.today():
-        return {'status': 'unavailable'}, 400
-    ses = db.session
-    if choice == 'yes':
-        casus.yes_votes += 1
-        ses.add(Vote(agree=True, submission=now, case=casus))
-        ses.commit()
-        return {'status': 'success'}
-    elif choice == 'no':
-        casus.no_votes += 1
-        ses.add(Vote(agree=False, submission=now, case=casus))
-        ses.commit()
-        return {'status': 'success'}
-    else:
-        return {'status': 'invalid'}, 400
+        db.session.rollback()
+        raise
+    return True
 
 
 @public.route('/reflection/')
 @allow_crossdomain
 @session_enable
+@cached('reflection')
 def current_reflection():
     latest_reflection = available_reflection().first()
     if not latest_reflection or not latest_reflection.publication:
@@ -149,24 +190,51 @@ def current_reflection():
     return reflection2dict(latest_reflection, True)
 
 
+def page_args():
+    """ The `after` cursor and the clamped `limit` of a reply page request. """
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        abort(400)
+    after = request.args.get('after')
+    if after is not None:
+        try:
+            decode_cursor(after)
+        except ValueError:
+            abort(400)
+    return after, limit and min(limit, REPLY_PAGE_LIMIT)
+
+
+def page_key():
+    """ Cache key of a reply page: the decoded cursor and the limit. """
+    after, limit = page_args()
+    return after and decode_cursor(after), limit
+
+
 @public.route('/reflection/<int:id>/')
 @allow_crossdomain
+@cached('reflection', args=page_key)
 def retrieve_reflection(id):
+    """ Brain teaser with its replies, optionally paginated.
+    
+    With `limit`, at most that many replies are included, plus a `next`
+    cursor that can be passed as `after` to obtain the next page.
+    """
+    after, limit = page_args()
     reflection = BrainTeaser.query.get_or_404(id)
     if not reflection.publication or reflection.publication > date.today():
         abort(404)
-    return jsonify(**reflection2dict(reflection, True))
+    return jsonify(**reflection2dict(reflection, True, after, limit))
 
 
-def reflection2dict(reflection, with_responses=False):
+def reflection2dict(reflection, with_responses=False, after=None, limit=None):
     if reflection.closure:
         closure = str(reflection.closure)
     else:
         closure = None
     if with_responses:
-        replies = reflection_replies(reflection.id)
+        replies, cursor = reflection_page(reflection.id, after, limit)
     else:
-        replies = None
+        replies = cursor = None
     now = datetime.today()
     return {
         'id': reflection.id,
@@ -176,6 +244,7 @@ def reflection2dict(reflection, with_responses=False):
         'closure': closure,
         'text': reflection.text,
         'responses': replies,
+        'next': cursor,
         'since': str(now),
     }
 
@@ -190,46 +259,132 @@ def available_reflection():
     )
 
 
-def response2dict(response):
+def response2dict(response, pending=(0, 0)):
+    up, down = pending
     return {
         'submission': str(response.submission.date()),
         'pseudonym': response.pseudonym,
         'message': response.message,
         'id': response.id,
-        'up': response.upvotes,
-        'down': response.downvotes,
+        'up': (response.upvotes or 0) + up,
+        'down': (response.downvotes or 0) + down,
     }
 
 
-def reflection_replies(id, since=None):
+def encode_cursor(reply):
+    """ Opaque position of `reply` in its thread, see reply_query. """
+    position = '{}|{}'.format(reply.submission.strftime(ISOFORMAT), reply.id)
+    return urlsafe_b64encode(position).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Inverse of encode_cursor; raises ValueError if malformed. """
+    try:
+        position = urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        submission, id = position.split('|')
+        return datetime.strptime(submission, ISOFORMAT), int(id)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor: {}'.format(cursor))
+
+
+def reply_query(id, since=None, after=None):
+    """ Replies to brain teaser `id` in the order of ix_response_thread.
+    
+    `since` is a datetime or ISOFORMAT string; `after` is a cursor.
+    """
     query = Response.query.filter_by(brain_teaser_id=id)
     if since is not None:
         if isinstance(since, str) or isinstance(since, unicode):
             since = datetime.strptime(since, ISOFORMAT)
         query = query.filter(Response.submission >= since)
-    return map(response2dict, query.order_by(Response.submission).all())
+    if after is not None:
+        submission, last = decode_cursor(after)
+        query = query.filter(
+            (Response.submission > submission) |
+            ((Response.submission == submission) & (Response.id > last)) )
+    return query.order_by(Response.submission, Response.id)
+
+
+def replies2dicts(replies):
+    pending = pending_moderation([reply.id for reply in replies])
+    return [
+        response2dict(reply, pending.get(reply.id, (0, 0)))
+        for reply in replies
+    ]
+
+
+def reflection_replies(id, since=None):
+    return replies2dicts(reply_query(id, since).all())
+
+
+def reflection_page(id, after=None, limit=None):
+    """ Return a list of at most `limit` replies and the next cursor.
+    
+    The cursor is None if there are no more replies.
+    """
+    try:
+        query = reply_query(id, after=after)
+    except ValueError:
+        abort(400)
+    if limit is None:
+        return replies2dicts(query.all()), None
+    replies = query.limit(limit + 1).all()
+    if len(replies) <= limit:
+        return replies2dicts(replies), None
+    replies = replies[:limit]
+    return replies2dicts(replies), encode_cursor(replies[-1])
+
+
+@public.route('/reflection/<int:id>/stream')
+@allow_crossdomain
+def stream_reflection(id):
+    """ Server-sent events with the replies that are added from now on.
+    
+    Clients that reconnect with a Last-Event-ID header receive the
+    replies that they missed, as far as the hub still remembers them.
+    When the server process has too many open streams, the client
+    should fall back to polling.
+    """
+    hub = current_app.reply_hub
+    if hub is None:
+        abort(404)
+    reflection = BrainTeaser.query.get_or_404(id)
+    if not reflection.publication or reflection.publication > date.today():
+        abort(404)
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    events = hub.subscribe(id, last_id)
+    if events is None:
+        abort(503)
+    db.session.remove()  # do not hold a connection while streaming
+    response = current_app.response_class(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @public.route('/reflection/archive')
 @allow_crossdomain
+@cached('reflection')
 def reflection_archive():
     return jsonify(all=map(reflection2dict, available_reflection()))
 
 
 @public.route('/reflection/<int:id>/reply', methods=['POST'])
 @allow_crossdomain
+@rate_limited
 @session_protect
+@admits('t')
 def reply_to_reflection(id):
     now = datetime.today()
     topic = BrainTeaser.query.get_or_404(id)
     if topic.closure and topic.closure <= now.date():
         return {'status': 'closed'}, 400
     if 'last-retrieve' in request.form:
-        ninjas = reflection_replies(id, request.form['last-retrieve'])
-        if ninjas:
+        ninjas = reply_query(id, request.form['last-retrieve'])
+        if db.session.query(ninjas.exists()).scalar():
             return {
                 'status': 'ninja',
-                'new': ninjas,
+                'new': replies2dicts(ninjas.all()),
                 'since': str(now),
             }
     if ( 'p' not in request.form or not request.form['p']
@@ -251,6 +406,9 @@ def reply_to_reflection(id):
         message=escape(request.form['r'].strip())[:400]
     ))
     db.session.commit()
+    invalidate('reflection')
+    if current_app.reply_hub is not None:
+        current_app.reply_hub.nudge()
     session['last-reply'] = now
     return {
         'status': 'success',
@@ -261,26 +419,17 @@ def reply_to_reflection(id):
 
 @public.route('/reply/<int:id>/moderate/', methods=['POST'])
 @allow_crossdomain
+@rate_limited
 @session_protect
+@admits('t', 'choice')
 def moderate_reply(id):
-    if 'choice' not in request.form:
-        return {'status': 'invalid'}, 400
     choice = request.form['choice']
-    try:
-        target = Response.query.filter_by(id=id).one()
-    except:
-        return {'status': 'unavailable'}, 400
-    ses = db.session
-    if choice == 'up':
-        target.upvotes += 1
-        ses.commit()
-        return {'status': 'success'}
-    elif choice == 'down':
-        target.downvotes += 1
-        ses.commit()
-        return {'status': 'success'}
-    else:
+    if choice not in ('up', 'down'):
         return {'status': 'invalid'}, 400
+    if not count_moderation(id, choice == 'up'):
+        return {'status': 'unavailable'}, 400
+    invalidate('reflection', soft=True)
+    return {'status': 'success'}
 
 
 def tip2dict(tip):
@@ -297,9 +446,10 @@ def tip2dict(tip):
 
 @public.route('/tips/')
 @allow_crossdomain
+@cached('tips')
 def retrieve_tips():
-    sorted_tips = Tip.query.order_by(Tip.update.desc())
-    labour_code = map(tip2dict, sorted_tips.filter_by(what='labour code').all())
-    book = map(tip2dict, sorted_tips.filter_by(what='book').all())
-    site = map(tip2dict, sorted_tips.filter_by(what='site').all())
-    return jsonify(labour=labour_code, book=book, site=site)
+    groups = dict((what, []) for what, key in TIP_GROUPS)
+    for tip in Tip.query.order_by(Tip.update.desc()):
+        if tip.what in groups:
+            groups[tip.what].append(tip2dict(tip))
+    return jsonify(**dict((key, groups[what]) for what, key in TIP_GROUPS))
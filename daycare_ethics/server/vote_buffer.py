@@ -0,0 +1,400 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Buffered ingestion of votes on cases.
+
+    Accepted votes are queued in memory and written in bulk: a single
+    multi-row INSERT into the vote table plus one counter UPDATE per
+    case, in one transaction. This trades a little freshness of the
+    vote counts for far fewer commits on busy days.
+
+    Queued votes are also appended to a journal on disk before they are
+    acknowledged, so that the votes of a crashed process can be written
+    by the next process that starts.
+"""
+
+import atexit
+import fcntl
+import os
+import os.path as op
+from datetime import datetime
+from glob import glob
+from tempfile import mkstemp
+from threading import Thread, Event, Lock
+from time import time
+from uuid import uuid4
+
+from ..database import db
+from ..database.models import Case, Vote, VoteBatch
+
+
+CLOSURE_TTL = 60  # seconds
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class VoteJournal(object):
+    """ Segment files with the votes that a process has not written yet.
+
+    Each process writes its votes to numbered segments next to a lock
+    file that it holds for as long as it lives. A segment is closed
+    when its votes are flushed and removed once they are committed.
+    Only the process that owns the journal should call its methods.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = None
+        self.lock = None
+        self.segment = None
+        self.number = 0
+        self.closed = []
+
+    def open(self):
+        """ Create the lock file, already locked. """
+        if not op.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                pass  # created by another process in the meanwhile
+        self.name = op.join(self.directory, uuid4().hex)
+        handle, temporary = mkstemp(dir=self.directory, prefix='.')
+        self.lock = os.fdopen(handle, 'w')
+        fcntl.flock(self.lock, fcntl.LOCK_EX)
+        # recover() must never find the lock file unlocked
+        os.rename(temporary, self.name + '.lock')
+
+    def record(self, id, agree, submission):
+        """ Append a vote to the current segment and hand it to the OS. """
+        if self.lock is None:
+            self.open()
+        if self.segment is None:
+            self.number += 1
+            self.segment = open('{}.{}.votes'.format(self.name, self.number), 'a')
+        self.segment.write('{} {:d} {}\n'.format(
+            id, agree, submission.strftime(TIME_FORMAT) ))
+        self.segment.flush()
+
+    def rotate(self):
+        """ Close the current segment; return the paths of all closed
+        segments, which are then owned by the caller.
+        """
+        if self.segment is not None:
+            self.segment.close()
+            self.closed.append(self.segment.name)
+            self.segment = None
+        paths, self.closed = self.closed, []
+        return paths
+
+    def restore(self, paths):
+        """ Take back segments whose votes could not be written. """
+        self.closed[:0] = paths
+
+    def discard(self, paths):
+        for path in paths:
+            os.remove(path)
+
+    def close(self):
+        """ Release the lock file, removing it if all votes were
+        written; otherwise, the next recovery picks them up.
+        """
+        if self.segment is not None:
+            self.segment.close()
+            self.closed.append(self.segment.name)
+            self.segment = None
+        if self.lock is None:
+            return
+        if not self.closed:
+            os.remove(self.name + '.lock')
+        self.lock.close()
+        self.lock = None
+
+
+def segment_id(path):
+    """ Unique name of a journal segment, as stored in VoteBatch. """
+    return op.basename(path)[:-len('.votes')]
+
+    def close(self):
+        """ Remove the lock file; call this after the last flush. """
+        if self.lock is not None and not self.closed and self.segment is None:
+            os.remove(self.name + '.lock')
+            self.lock.close()
+            self.lock = None
+
+
+class VoteBuffer(object):
+    """ Queue of (case id, agree, submission) triples.
+
+    The queue is flushed by a daemon thread every `interval` seconds,
+    or sooner once it holds `size` votes. The thread is started by the
+    first vote, so that every forked server process gets its own; the
+    same goes for the `journal`, if given.
+    """
+
+    def __init__(self, app, interval, size, journal=None):
+        self.app = app
+        self.interval = interval
+        self.size = size
+        self.journal = journal
+        self.pending = []
+        self.closures = {}
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.thread = None
+        self.stopped = False
+        self.written = []
+        self.flushes = 0
+        self.flushed = 0
+
+    def open_case(self, id, today):
+        """ Whether case `id` exists and accepts votes on `today`.
+
+        Closure dates are remembered for CLOSURE_TTL seconds, so that
+        accepting a vote does not require a query. Only existing cases
+        are remembered, since `id` comes from the client, and expired
+        entries are dropped whenever a case is looked up again.
+        """
+        now = time()
+        entry = self.closures.get(id)
+        if entry is None or entry[0] < now:
+            row = (
+                db.session.query(Case.id, Case.closure)
+                .filter(Case.id == id)
+                .first() )
+            for key, (expires, closure) in self.closures.items():
+                if expires < now:
+                    self.closures.pop(key, None)
+            if row is None:
+                return False
+            entry = self.closures[id] = now + CLOSURE_TTL, row.closure
+        expires, closure = entry
+        return closure is None or closure > today
+
+    def add(self, id, agree, submission):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.record(id, agree, submission)
+            self.pending.append((id, agree, submission))
+            full = len(self.pending) >= self.size
+            if self.thread is None:
+                self.thread = Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                with self.app.app_context():
+                    try:
+                        self.flush()
+                    finally:
+                        db.session.remove()
+            except Exception:
+                self.app.logger.exception('Vote flush failed')
+
+    def stop(self):
+        """ Let the thread finish its last flush, then flush the rest. """
+        self.stopped = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(self.interval)
+        with self.app.app_context():
+            self.flush()
+            if self.written:
+                VoteBatch.query.filter(VoteBatch.id.in_(self.written)).delete(False)
+                db.session.commit()
+        if self.journal is not None:
+            with self.lock:
+                self.journal.close()
+
+    def flush(self):
+        """ Write all pending votes; return how many were written.
+
+        On failure, the votes are put back in front of the queue. The
+        VoteBatch rows of the segments that were removed after the
+        previous flush are deleted along the way.
+        """
+        with self.lock:
+            batch, self.pending = self.pending, []
+            segments, obsolete = [], self.written
+            if batch and self.journal is not None:
+                segments = self.journal.rotate()
+                self.written = []
+        if not batch:
+            return 0
+        ids = map(segment_id, segments)
+        try:
+            write_votes(batch, ids, obsolete)
+        except:
+            with self.lock:
+                self.pending[:0] = batch
+                if segments:
+                    self.journal.restore(segments)
+                    self.written[:0] = obsolete
+            raise
+        if segments:
+            self.journal.discard(segments)
+        with self.lock:
+            self.written.extend(ids)
+            self.flushes += 1
+            self.flushed += len(batch)
+        cache = getattr(self.app, 'response_cache', None)
+        if cache is not None:
+            cache.invalidate('case', soft=True)
+        return len(batch)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'flushes': self.flushes,
+                'flushed': self.flushed,
+            }
+
+
+def write_votes(batch, segments=(), obsolete=()):
+    """ Insert (case id, agree, submission) triples and update the
+    counters in one transaction.
+
+    The ids of the journal `segments` that hold the votes are recorded
+    in the same transaction, while those in `obsolete` are deleted.
+    """
+    totals = {}
+    for id, agree, submission in batch:
+        yes, no = totals.get(id, (0, 0))
+        totals[id] = (yes + 1, no) if agree else (yes, no + 1)
+    table = Case.__table__
+    try:
+        db.session.execute(Vote.__table__.insert(), [
+            {'case_id': id, 'agree': agree, 'submission': submission}
+            for id, agree, submission in batch
+        ])
+        for id, (yes, no) in totals.iteritems():
+            db.session.execute(
+                table.update()
+                .where(table.c.id == id)
+                .values({
+                    table.c.yes_votes: db.func.coalesce(table.c.yes_votes, 0) + yes,
+                    table.c.no_votes: db.func.coalesce(table.c.no_votes, 0) + no,
+                }) )
+        if segments:
+            db.session.execute(
+                VoteBatch.__table__.insert(),
+                [{'id': id} for id in segments] )
+        if obsolete:
+            db.session.execute(
+                VoteBatch.__table__.delete()
+                .where(VoteBatch.id.in_(obsolete)) )
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+
+def read_segment(path):
+    """ Return the votes in a journal segment.
+
+    An incomplete last line, left by a crash during a write, is skipped.
+    """
+    votes = []
+    with open(path) as segment:
+        for line in segment:
+            try:
+                id, agree, day, moment = line.split()
+                votes.append((
+                    int(id),
+                    agree == '1',
+                    datetime.strptime(day + ' ' + moment, TIME_FORMAT) ))
+            except ValueError:
+                pass
+    return votes
+
+
+def recover_votes(directory):
+    """ Write the journaled votes of processes that are no longer alive.
+
+    Segments that have a VoteBatch row were committed just before the
+    crash, so they are only removed. Returns the number of votes that
+    were written.
+    """
+    recovered = 0
+    for path in glob(op.join(directory, '*.lock')):
+        try:
+            lock = open(path)
+        except IOError:
+            continue  # recovered by another process in the meanwhile
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                continue  # the owner is still alive
+            name = path[:-len('.lock')]
+            segments = sorted(
+                glob(name + '.*.votes'),
+                key=lambda segment: int(segment.split('.')[-2]) )
+            ids = map(segment_id, segments)
+            for segment, id in zip(segments, ids):
+                batch = read_segment(segment)
+                if batch and VoteBatch.query.get(id) is None:
+                    write_votes(batch, [id])
+                    recovered += len(batch)
+                os.remove(segment)
+            if ids:
+                VoteBatch.query.filter(VoteBatch.id.in_(ids)).delete(False)
+                db.session.commit()
+            os.remove(path)
+    return recovered
+
+
+def reconcile_votes():
+    """ Recompute the vote counters of all cases from the vote table.
+
+    Use this after a manual change to the vote table. The counters are
+    then exact again. Returns the number of cases.
+    """
+    table, votes = Case.__table__, Vote.__table__
+    def tally(agree):
+        return (
+            db.select([db.func.count(votes.c.id)])
+            .where(votes.c.case_id == table.c.id)
+            .where(votes.c.agree == agree)
+            .as_scalar() )
+    result = db.session.execute(table.update().values({
+        table.c.yes_votes: tally(True),
+        table.c.no_votes: tally(False),
+    }))
+    db.session.commit()
+    return result.rowcount
+
+
+def init_app(app):
+    """ Enable the buffer if VOTE_BUFFER_INTERVAL is set. """
+    interval = app.config.setdefault('VOTE_BUFFER_INTERVAL', 0)
+    size = app.config.setdefault('VOTE_BUFFER_SIZE', 100)
+    directory = app.config.setdefault('VOTE_BUFFER_JOURNAL', None)
+    app.vote_buffer = None
+    if not interval:
+        return
+    directory = directory or op.join(app.instance_path, 'votes')
+    try:
+        with app.app_context():
+            try:
+                recovered = recover_votes(directory)
+            finally:
+                db.session.remove()
+        if recovered:
+            app.logger.warning('Recovered %d journaled votes', recovered)
+    except Exception:
+        app.logger.exception('Vote recovery failed')
+    journal = VoteJournal(directory)
+    buffer = app.vote_buffer = VoteBuffer(app, interval, size, journal)
+    def flush_on_exit():
+        try:
+            buffer.stop()
+        except Exception:
+            app.logger.exception('Vote flush at exit failed')
+    atexit.register(flush_on_exit)
@@ -22,9 +22,23 @@ class FixtureConfiguration (object):
 
 
 class BaseFixture (TestCase):
+    """ App with a fresh instance folder and database for every test.
+
+    Subclasses may override `configuration` with a subclass of
+    FixtureConfiguration. With `on_disk`, the database is a file in the
+    instance folder, which other threads than the test can see.
+    """
+    configuration = FixtureConfiguration
+    on_disk = False
+
     def setUp(self):
         tmpdir = mkdtemp('daycare_ethics_instance')
-        self.app = create_app(config_obj=FixtureConfiguration, instance=tmpdir)
+        config = self.configuration
+        if self.on_disk:
+            config = type('OnDiskConfiguration', (config,), {
+                'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + join(tmpdir, 'test.sqlite'),
+            })
+        self.app = create_app(config_obj=config, instance=tmpdir)
         self.client = self.app.test_client()
 
     def tearDown(self):
@@ -7,10 +7,11 @@
 
 import unittest
 
-import test_views
+import test_views, test_thumbnails
 
 suite = unittest.TestSuite([
     unittest.TestLoader().loadTestsFromModule(test_views),
+    unittest.TestLoader().loadTestsFromModule(test_thumbnails),
 ])
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+# (c) 2014, 2015 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+import os.path as op
+from shutil import copy
+
+from PIL import Image
+
+from ..common_fixtures import BaseFixture, FixtureConfiguration
+from ...database.models import *
+from ...util import TARGET_WIDTHS, VARIANT_FORMATS, image_variants
+from ...admin.thumbnails import *
+
+
+TEST_IMAGE = op.join(
+    op.dirname(op.dirname(__file__)),
+    'data',
+    'openclipart_hector_gomez_landscape.png' )
+
+
+class MakeVariantsTestCase (BaseFixture):
+    def variants(self, source):
+        return dict(
+            (format, [
+                op.join(self.app.instance_path, name)
+                for name in image_variants(op.basename(source), format)
+            ])
+            for format in VARIANT_FORMATS
+        )
+
+    def check_variants(self, variants):
+        for format in VARIANT_FORMATS:
+            for width, name in zip(TARGET_WIDTHS, variants[format]):
+                image = Image.open(name)
+                self.assertEqual(image.format, format.upper())
+                self.assertEqual(max(image.size), width)
+        progressive = Image.open(variants['jpeg'][0]).info
+        self.assertTrue(progressive.get('progressive') or progressive.get('progression'))
+
+    def test_png(self):
+        variants = self.variants(TEST_IMAGE)
+        self.assertEqual(make_variants(1, TEST_IMAGE, variants), (1, None))
+        self.check_variants(variants)
+
+    def test_large_jpeg(self):
+        source = op.join(self.app.instance_path, 'camera.jpeg')
+        Image.open(TEST_IMAGE).resize((6000, 4592)).save(source)
+        variants = self.variants(source)
+        self.assertEqual(make_variants(2, source, variants), (2, None))
+        self.check_variants(variants)
+
+    def test_grayscale(self):
+        source = op.join(self.app.instance_path, 'gray.jpeg')
+        Image.open(TEST_IMAGE).convert('L').save(source)
+        variants = self.variants(source)
+        self.assertEqual(make_variants(4, source, variants), (4, None))
+        self.check_variants(variants)
+        self.assertEqual(Image.open(variants['jpeg'][0]).mode, 'L')
+
+    def test_failure(self):
+        source = op.join(self.app.instance_path, 'missing.png')
+        id, error = make_variants(3, source, self.variants(source))
+        self.assertEqual(id, 3)
+        self.assertIn('IOError', error)
+
+
+class PoolConfiguration (FixtureConfiguration):
+    THUMBNAIL_PROCESSES = 1
+
+
+class ThumbnailQueueTestCase (BaseFixture):
+    configuration = PoolConfiguration
+    on_disk = True
+
+    def setUp(self):
+        super(ThumbnailQueueTestCase, self).setUp()
+        copy(TEST_IMAGE, op.join(self.app.instance_path, 'landscape.png'))
+        with self.request_context():
+            for path in 'landscape.png', 'missing.png':
+                db.session.add(Picture(
+                    name=path,
+                    path=path,
+                    mime_type='image/png',
+                    status='pending' ))
+            db.session.commit()
+
+    def status(self, id):
+        with self.request_context():
+            return Picture.query.get(id).status
+
+    def test_pool(self):
+        queue = self.app.thumbnails
+        queue.submit(1, 'landscape.png')
+        queue.submit(2, 'missing.png')
+        queue.join()
+        self.assertEqual(self.status(1), 'ready')
+        self.assertEqual(self.status(2), 'failed')
+        self.assertTrue(op.exists(op.join(self.app.instance_path, 'landscape_848.jpeg')))
+
+    def test_inline(self):
+        self.app.thumbnails.processes = 0
+        self.assertEqual(self.client.get('/media/1/400').mimetype, 'image/png')
+        with self.request_context():
+            self.app.thumbnails.submit(1, 'landscape.png')
+        self.assertEqual(self.status(1), 'ready')
+        self.assertEqual(self.client.get('/media/1/400').mimetype, 'image/jpeg')
+
+    def test_inline_session(self):
+        self.app.thumbnails.processes = 0
+        with self.request_context():
+            picture = Picture.query.get(1)
+            self.app.thumbnails.submit(1, 'landscape.png')
+            self.assertEqual(picture.name, 'landscape.png')
+            self.assertIn(picture, db.session)
+
+    def test_database_error(self):
+        with self.request_context():
+            db.session.execute('DROP TABLE picture')
+            db.session.commit()
+        self.app.thumbnails.finish((1, None))
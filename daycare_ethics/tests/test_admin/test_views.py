@@ -7,6 +7,8 @@ import os
 import os.path as op
 from unittest import skip
 
+from flask import json
+
 from ..common_fixtures import BaseFixture
 from ...database.models import *
 from ...util import TARGET_WIDTHS, image_variants
@@ -32,6 +34,25 @@ class MediaViewTestCase(BaseFixture):
         self.assertTrue(all((f in directory for f in image_variants(test_image_name))))
 
 
+    def test_edit(self):
+        with self.request_context():
+            db.session.add(Picture(
+                name='old',
+                path='test.jpg',
+                mime_type='image/jpeg',
+                status='ready' ))
+            db.session.commit()
+        page = self.client.get('/admin/picture/edit/?id=1').data
+        self.assertIn('name="name"', page)
+        self.assertNotIn('name="path"', page)
+        self.client.post('/admin/picture/edit/?id=1', data={'name': 'new'})
+        with self.request_context():
+            picture = Picture.query.get(1)
+            self.assertEqual(picture.name, 'new')
+            self.assertEqual(picture.path, 'test.jpg')
+            self.assertEqual(picture.status, 'ready')
+
+
 class VotesViewTestCase(BaseFixture):
     def setUp(self):
         super(VotesViewTestCase, self).setUp()
@@ -118,3 +139,25 @@ class TipsViewTestCase(BaseFixture):
         with self.request_context():
             self.assertNotEqual(Tip.query.filter_by(id=1).one().update, self.old_age)
             self.assertEqual(Tip.query.filter_by(id=2).one().update, self.old_age)
+
+    def tip_titles(self):
+        data = json.loads(self.client.get('/tips/').data)
+        return [tip['title'] for tip in data['book']]
+
+    def test_invalidation(self):
+        self.assertEqual(self.tip_titles(), ['some book'])
+        self.client.post('/admin/tip/edit/?id=1', data={
+            'what': 'book',
+            'title': 'another book',
+        })
+        self.assertEqual(self.tip_titles(), ['another book'])
+        with self.request_context():
+            Tip.query.get(2).what = 'book'
+            db.session.commit()
+        self.client.post('/admin/tip/action/', data={
+            'action': 'Bump',
+            'rowid': '2',
+        })
+        self.assertEqual(self.tip_titles(), ['some website', 'another book'])
+        self.client.post('/admin/tip/delete/', data={'id': '2'})
+        self.assertEqual(self.tip_titles(), ['another book'])
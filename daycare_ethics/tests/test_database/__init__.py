@@ -9,10 +9,12 @@ import unittest
 
 import test_util
 import test_models
+import test_codec
 
 suite = unittest.TestSuite([
     unittest.TestLoader().loadTestsFromModule(test_util),
     unittest.TestLoader().loadTestsFromModule(test_models),
+    unittest.TestLoader().loadTestsFromModule(test_codec),
 ])
 
 if __name__ == '__main__':
@@ -0,0 +1,79 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+import cPickle as pickle
+from datetime import datetime
+from unittest import TestCase
+
+from ..common_fixtures import BaseFixture
+from ...database import db
+from ...database import models as m
+from ...database.codec import *
+
+
+class TokenTestCase (TestCase):
+    def test_roundtrip(self):
+        for token in ['abcdef', 'aaaa', '9', '', 'aZ09' * 7 + 'zz']:
+            self.assertEqual(unpack_token(pack_token(token)), token)
+
+    def test_compact(self):
+        self.assertEqual(len(pack_token('9' * 30)), 24)
+
+    def test_raw(self):
+        packed = pack_token(u'no spaces?')
+        self.assertEqual(packed[0], RAW_TOKEN)
+        self.assertEqual(unpack_token(packed), u'no spaces?')
+
+    def test_legacy(self):
+        self.assertEqual(unpack_token('abcdef'), 'abcdef')
+
+
+class PayloadTestCase (TestCase):
+    def setUp(self):
+        self.payload = {
+            'token': 'abcdef',
+            'last-request': datetime(2016, 10, 3, 12, 30, 15, 123456),
+            'captcha-answer': [u'one', u'two', u'three'],
+            'tainted': True,
+        }
+
+    def test_roundtrip(self):
+        encoded = encode_payload(self.payload)
+        self.assertEqual(encoded[0], PAYLOAD_V1)
+        decoded = decode_payload(encoded)
+        self.assertEqual(decoded, self.payload)
+        self.assertNotIsInstance(decoded, LegacyPayload)
+
+    def test_smaller_than_pickle(self):
+        pickled = pickle.dumps(self.payload, pickle.HIGHEST_PROTOCOL)
+        self.assertLess(len(encode_payload(self.payload)), len(pickled))
+
+    def test_legacy(self):
+        pickled = pickle.dumps(self.payload, pickle.HIGHEST_PROTOCOL)
+        decoded = decode_payload(pickled)
+        self.assertEqual(decoded, self.payload)
+        self.assertIsInstance(decoded, LegacyPayload)
+
+    def test_unsupported(self):
+        self.assertRaises(TypeError, encode_payload, {'bad': object()})
+
+
+class LazyMigrationTestCase (BaseFixture):
+    def test_legacy_row(self):
+        payload = {'token': 'abcdef', 'test': 1}
+        with self.request_context():
+            db.session.execute(
+                'INSERT INTO session (token, payload) VALUES (:token, :payload)',
+                {'token': 'abcdef', 'payload': buffer(pickle.dumps(payload, 2))} )
+            db.session.commit()
+        with self.client as c:
+            with c.session_transaction(method='POST', data={'t': 'abcdef'}) as s:
+                self.assertEqual(s['test'], 1)
+                self.assertNotIn('tainted', s)
+                self.assertTrue(s.modified)
+        with self.request_context():
+            rows = db.session.execute('SELECT token, payload FROM session').fetchall()
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(str(rows[0][0]), pack_token('abcdef'))
+            self.assertEqual(str(rows[0][1])[0], PAYLOAD_V1)
+            self.assertEqual(m.Session.query.get('abcdef').payload, payload)
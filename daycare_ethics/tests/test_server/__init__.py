@@ -7,12 +7,29 @@
 
 import unittest
 
-import test_views, test_security, test_session
+import test_views, test_security, test_session, test_session_cache
+import test_session_reaper, test_session_store, test_blocklist
+import test_captcha_pool, test_captcha_index, test_rate_limit
+import test_admission, test_response_cache, test_vote_buffer
+import test_moderation, test_reply_stream, test_media
 
 suite = unittest.TestSuite([
     unittest.TestLoader().loadTestsFromModule(test_views),
     unittest.TestLoader().loadTestsFromModule(test_security),
     unittest.TestLoader().loadTestsFromModule(test_session),
+    unittest.TestLoader().loadTestsFromModule(test_session_cache),
+    unittest.TestLoader().loadTestsFromModule(test_session_reaper),
+    unittest.TestLoader().loadTestsFromModule(test_session_store),
+    unittest.TestLoader().loadTestsFromModule(test_blocklist),
+    unittest.TestLoader().loadTestsFromModule(test_captcha_pool),
+    unittest.TestLoader().loadTestsFromModule(test_captcha_index),
+    unittest.TestLoader().loadTestsFromModule(test_rate_limit),
+    unittest.TestLoader().loadTestsFromModule(test_admission),
+    unittest.TestLoader().loadTestsFromModule(test_response_cache),
+    unittest.TestLoader().loadTestsFromModule(test_vote_buffer),
+    unittest.TestLoader().loadTestsFromModule(test_moderation),
+    unittest.TestLoader().loadTestsFromModule(test_reply_stream),
+    unittest.TestLoader().loadTestsFromModule(test_media),
 ])
 
 if __name__ == '__main__':
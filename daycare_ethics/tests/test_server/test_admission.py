@@ -0,0 +1,56 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from flask import session
+
+from ..common_fixtures import BaseFixture
+from ...server.admission import *
+
+
+class AdmissionTestCase (BaseFixture):
+    def setUp(self):
+        super(AdmissionTestCase, self).setUp()
+        @self.app.route('/test', methods=['POST'])
+        @admits('t', 'choice')
+        def testview():
+            return 'admitted', 200
+        @self.app.route('/free', methods=['POST'])
+        def freeview():
+            return 'free', 200
+        self.headers = {'User-Agent': 'Flask test client'}
+    
+    def post(self, url='/test', **data):
+        return self.client.post(
+            url,
+            data=data,
+            headers=self.headers,
+            environ_base={'REMOTE_ADDR': '10.0.0.1'},
+        ).status_code
+    
+    def test_admitted(self):
+        self.assertEqual(self.post(t='abcdef', choice='up'), 200)
+        self.assertEqual(self.app.admission.stats()['admitted'], 1)
+    
+    def test_user_agent(self):
+        self.headers = {}
+        self.assertEqual(self.post(t='abcdef', choice='up'), 400)
+        self.assertEqual(self.post('/free'), 200)
+        self.assertEqual(self.app.admission.stats()['user-agent'], 1)
+    
+    def test_fields(self):
+        self.assertEqual(self.post(t='abcdef'), 400)
+        self.assertEqual(self.post(t='abcdef', choice=''), 400)
+        self.assertEqual(self.app.admission.stats()['fields'], 2)
+    
+    def test_token(self):
+        self.assertEqual(self.post(t='a' * 31, choice='up'), 400)
+        self.assertEqual(self.post(t='abc-def', choice='up'), 400)
+        self.assertEqual(self.app.admission.stats()['token'], 2)
+    
+    def test_blocklist(self):
+        self.app.config['SESSION_BLOCKLIST_ORIGIN_THRESHOLD'] = 1
+        self.app.blocklist.add(('origin', '10.0.0.1'))
+        with self.client as c:
+            self.assertEqual(self.post(t='abcdef', choice='up'), 400)
+            self.assertFalse(session.loaded)
+        self.assertEqual(self.app.admission.stats()['blocklist'], 1)
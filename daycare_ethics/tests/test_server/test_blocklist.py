@@ -0,0 +1,35 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from unittest import TestCase
+
+from ...server.blocklist import *
+
+
+class BlocklistTestCase (TestCase):
+    def test_count(self):
+        blocklist = Blocklist(10, 60)
+        self.assertEqual(blocklist.count('a'), 0)
+        self.assertEqual(blocklist.add('a'), 1)
+        self.assertEqual(blocklist.add('a'), 2)
+        self.assertEqual(blocklist.count('a'), 2)
+        self.assertTrue(blocklist.blocks('a', 2))
+        self.assertFalse(blocklist.blocks('a', 3))
+        self.assertFalse(blocklist.blocks('b'))
+        self.assertEqual(blocklist.stats()['blocked'], 1)
+
+    def test_size(self):
+        blocklist = Blocklist(2, 60)
+        blocklist.add('a')
+        blocklist.add('b')
+        blocklist.count('a')
+        blocklist.add('c')
+        self.assertEqual(blocklist.stats()['size'], 2)
+        self.assertEqual(blocklist.count('a'), 0)
+        self.assertEqual(blocklist.count('c'), 1)
+
+    def test_expiry(self):
+        blocklist = Blocklist(10, -1)
+        blocklist.add('a')
+        self.assertEqual(blocklist.add('a'), 1)
+        self.assertEqual(blocklist.count('a'), 0)
@@ -0,0 +1,81 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+import os
+from os.path import join
+from random import SystemRandom
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from flask import json
+
+from ...server.captcha_index import *
+
+
+CATEGORIES = {
+    'color': u'red orange yellow green blue purple pink grey'.split(),
+    'number': u'one two three four five six seven eight nine ten eleven'.split(),
+    'City': u'Paris London Berlin \xc9vora'.split(),
+}
+
+
+class DifferenceTablesTestCase (TestCase):
+    def test_difference_tables(self):
+        categories = map(set, CATEGORIES.values())
+        tables = difference_tables(categories, 7, 3)
+        # the cities are too few to serve as normal words
+        self.assertEqual(len(tables), 4)
+        for position, oddballs in tables:
+            self.assertGreaterEqual(len(categories[position]), 7)
+            self.assertGreaterEqual(len(oddballs), 3)
+            self.assertFalse(categories[position] & oddballs)
+
+
+class CaptchaIndexTestCase (TestCase):
+    def setUp(self):
+        self.directory = mkdtemp('daycare_ethics_captcha')
+        self.source = join(self.directory, 'captcha.json')
+        self.path = join(self.directory, 'captcha.index')
+        self.write_source(CATEGORIES)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def write_source(self, categories):
+        with open(self.source, 'wb') as source:
+            json.dump(categories, source)
+
+    def test_categories(self):
+        index = load_index(self.source, self.path, 7, 3)
+        self.assertEqual(len(index), 3)
+        self.assertItemsEqual(index, map(set, CATEGORIES.values()))
+
+    def test_challenge(self):
+        index = load_index(self.source, self.path, 7, 3)
+        dice = SystemRandom()
+        categories = map(set, CATEGORIES.values())
+        for i in range(20):
+            challenge, answer = index.challenge(dice)
+            words = challenge.split()
+            self.assertEqual(len(words), 10)
+            self.assertEqual(len(answer), 3)
+            self.assertTrue(set(answer) < set(word.lower() for word in words))
+            normals = [word for word in words if word.lower() not in answer]
+            self.assertTrue(any(set(normals) <= c for c in categories))
+
+    def test_reuse_and_rebuild(self):
+        load_index(self.source, self.path, 7, 3)
+        os.utime(self.path, (0, 0))
+        load_index(self.source, self.path, 7, 3)
+        self.assertEqual(os.stat(self.path).st_mtime, 0)
+        changed = dict(CATEGORIES, animal=u'cat dog cow pig hen duck goat'.split())
+        self.write_source(changed)
+        index = load_index(self.source, self.path, 7, 3)
+        self.assertNotEqual(os.stat(self.path).st_mtime, 0)
+        self.assertEqual(len(index), 4)
+
+    def test_corrupt(self):
+        with open(self.path, 'wb') as index:
+            index.write('garbage')
+        self.assertEqual(len(load_index(self.source, self.path, 7, 3)), 3)
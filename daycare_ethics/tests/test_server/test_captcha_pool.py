@@ -0,0 +1,46 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from time import sleep
+from unittest import TestCase
+
+from ...server.captcha_pool import *
+
+
+def generate(dice):
+    return u'one two three', [u'three']
+
+
+class CaptchaPoolTestCase (TestCase):
+    def setUp(self):
+        self.pool = CaptchaPool(generate, 10)
+
+    def test_refill(self):
+        self.assertEqual(self.pool.refill(), 10)
+        self.assertEqual(self.pool.refill(), 0)
+        stats = self.pool.stats()
+        self.assertEqual(stats['depth'], 10)
+        self.assertEqual(stats['refills'], 2)
+        self.assertEqual(stats['refilled'], 10)
+
+    def test_draw(self):
+        self.pool.refill()
+        for i in range(5):
+            self.assertEqual(self.pool.draw(), generate(None))
+        self.assertEqual(self.pool.stats()['misses'], 0)
+        self.assertEqual(self.pool.stats()['depth'], 5)
+
+    def test_background_refill(self):
+        self.pool.draw()
+        self.assertEqual(self.pool.stats()['misses'], 1)
+        for i in range(100):
+            if self.pool.stats()['depth'] == 10:
+                break
+            sleep(0.01)
+        self.assertEqual(self.pool.stats()['depth'], 10)
+        self.assertEqual(self.pool.stats()['refills'], 1)
+
+    def test_disabled(self):
+        pool = CaptchaPool(generate, 0)
+        self.assertEqual(pool.draw(), generate(None))
+        self.assertIsNone(pool.thread)
@@ -0,0 +1,181 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+import os.path as op
+from tempfile import mkdtemp
+
+from ..common_fixtures import BaseFixture, FixtureConfiguration
+from ... import create_app
+from ...database.models import *
+from ...database.db import db
+from ...util import TARGET_WIDTHS, image_variants
+from ...server.media import *
+
+
+class MediaTestCase (BaseFixture):
+    def setUp(self):
+        super(MediaTestCase, self).setUp()
+        with self.request_context():
+            db.session.add(Picture(
+                name='landscape',
+                path='landscape.png',
+                mime_type='image/png' ))
+            db.session.commit()
+        for width, variant in zip(TARGET_WIDTHS, image_variants('landscape.png')):
+            with open(op.join(self.app.instance_path, variant), 'wb') as f:
+                f.write('jpeg of width {}'.format(width))
+
+    def test_lookup(self):
+        paths = self.app.media_paths
+        with self.request_context():
+            self.assertEqual(paths.lookup(1), ('landscape.png', 'image/png', 'ready', ('jpeg',)))
+            self.assertEqual(paths.lookup(1), ('landscape.png', 'image/png', 'ready', ('jpeg',)))
+            self.assertIsNone(paths.lookup(2))
+            self.assertEqual(paths.stats(), {'size': 1, 'hits': 1, 'misses': 2})
+            Picture.query.get(1).path = 'portrait.png'
+            db.session.commit()
+            self.assertEqual(paths.lookup(1)[0], 'landscape.png')
+            paths.forget(1)
+            self.assertEqual(paths.lookup(1)[0], 'portrait.png')
+
+    def test_timeout(self):
+        paths = MediaPaths(0)
+        with self.request_context():
+            paths.lookup(1)
+            paths.lookup(1)
+        self.assertEqual(paths.stats()['misses'], 2)
+
+    def test_delete(self):
+        with self.request_context():
+            self.app.media_paths.lookup(1)
+            db.session.delete(Picture.query.get(1))
+            db.session.commit()
+            self.assertIsNone(self.app.media_paths.lookup(1))
+        self.assertFalse(op.exists(op.join(self.app.instance_path, 'landscape_300.jpeg')))
+
+    def test_media(self):
+        response = self.client.get('/media/1/400')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, 'jpeg of width 300')
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertEqual(
+            response.headers['Cache-Control'],
+            'public, max-age=31536000, immutable' )
+        self.assertEqual(self.client.get('/media/1/700').data, 'jpeg of width 600')
+        self.assertEqual(self.client.get('/media/2/400').status_code, 404)
+
+    def test_webp(self):
+        with self.request_context():
+            self.assertEqual(self.app.media_paths.lookup(1)[3], ('jpeg',))
+        webp = {'Accept': 'image/webp,*/*;q=0.8'}
+        response = self.client.get('/media/1/400', headers=webp)
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertEqual(response.headers['Vary'], 'Accept')
+        with open(op.join(self.app.instance_path, 'landscape_300.webp'), 'wb') as f:
+            f.write('webp of width 300')
+        self.app.media_paths.forget(1)
+        response = self.client.get('/media/1/400', headers=webp)
+        self.assertEqual(response.mimetype, 'image/webp')
+        self.assertEqual(response.data, 'webp of width 300')
+        self.assertEqual(response.headers['Vary'], 'Accept')
+        for accept in '*/*', 'image/*', 'image/webp;q=0, */*':
+            response = self.client.get('/media/1/400', headers={'Accept': accept})
+            self.assertEqual(response.mimetype, 'image/jpeg')
+
+    def test_accel_redirect(self):
+        self.app.config['MEDIA_SENDFILE'] = 'x-accel-redirect'
+        response = self.client.get('/media/1/200')
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/media-files/landscape_300.jpeg')
+        self.assertEqual(response.data, '')
+
+    def test_sendfile(self):
+        self.app.config['MEDIA_SENDFILE'] = 'x-sendfile'
+        response = self.client.get('/media/1/200')
+        self.assertEqual(
+            response.headers['X-Sendfile'],
+            op.join(self.app.instance_path, 'landscape_300.jpeg') )
+        self.assertEqual(response.data, '')
+
+    def test_invalid_mode(self):
+        config = type('SendfileConfiguration', (FixtureConfiguration,), {
+            'MEDIA_SENDFILE': 'x-magic',
+        })
+        self.assertRaises(ValueError, create_app, config_obj=config, instance=mkdtemp())
+
+
+    def test_pending(self):
+        with self.request_context():
+            Picture.query.get(1).status = 'pending'
+            db.session.commit()
+        with open(op.join(self.app.instance_path, 'landscape.png'), 'wb') as f:
+            f.write('original')
+        response = self.client.get('/media/1/400')
+        self.assertEqual(response.data, 'original')
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(self.app.media_paths.stats()['size'], 0)
+
+class VideoTestCase (BaseFixture):
+    """ Seeking in a large video, as in a media player. """
+
+    def setUp(self):
+        super(VideoTestCase, self).setUp()
+        with self.request_context():
+            db.session.add(Picture(
+                name='clip',
+                path='clip.mp4',
+                mime_type='video/mp4' ))
+            db.session.commit()
+        pattern = str(bytearray(range(251)))  # offsets are recognizable
+        self.content = pattern * (8 * 1024 * 1024 / len(pattern))
+        with open(op.join(self.app.instance_path, 'clip.mp4'), 'wb') as f:
+            f.write(self.content)
+
+    def get(self, **headers):
+        return self.client.get('/media/1/0', headers=headers)
+
+    def test_whole(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'video/mp4')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.content_length, len(self.content))
+        self.assertEqual(response.data, self.content)
+
+    def test_seek(self):
+        response = self.get(Range='bytes=5000000-5000999')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(
+            response.headers['Content-Range'],
+            'bytes 5000000-5000999/{}'.format(len(self.content)) )
+        self.assertEqual(response.content_length, 1000)
+        self.assertEqual(response.data, self.content[5000000:5001000])
+        self.assertEqual(self.get(Range='bytes=8000000-').data, self.content[8000000:])
+        self.assertEqual(self.get(Range='bytes=-100').data, self.content[-100:])
+
+    def test_unsatisfiable(self):
+        response = self.get(Range='bytes={}-'.format(len(self.content)))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(
+            response.headers['Content-Range'],
+            'bytes */{}'.format(len(self.content)) )
+        response = self.get(Range='bytes=0-9, 20-29')
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_range(self):
+        etag = self.get().headers['ETag']
+        response = self.get(Range='bytes=100-199', **{'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.content[100:200])
+        response = self.get(Range='bytes=100-199', **{'If-Range': '"outdated"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_length, len(self.content))
+
+    def test_file_range(self):
+        with open(op.join(self.app.instance_path, 'clip.mp4'), 'rb') as f:
+            f.seek(300)
+            part = FileRange(f, 10)
+            self.assertEqual(part.read(4), self.content[300:304])
+            self.assertEqual(part.read(), self.content[304:310])
+            self.assertEqual(part.read(), '')
+
@@ -0,0 +1,88 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from datetime import datetime
+from time import sleep
+
+from ..common_fixtures import BaseFixture
+from ...database.models import *
+from ...database.db import db
+from ...server.views import reflection_replies
+from ...server.moderation import *
+
+
+class ModerationTestCase (BaseFixture):
+    def setUp(self):
+        super(ModerationTestCase, self).setUp()
+        with self.request_context():
+            topic = BrainTeaser(title='topic')
+            for name in 'first', 'second':
+                db.session.add(Response(
+                    brain_teaser=topic,
+                    submission=datetime.today(),
+                    pseudonym=name,
+                    message='reply',
+                    upvotes=2,
+                    downvotes=1 ))
+            db.session.commit()
+
+    def test_count(self):
+        with self.request_context():
+            for i in range(20):
+                self.assertTrue(count_moderation(1, i % 4 != 0))
+            self.assertFalse(count_moderation(3, True))
+            counters = ResponseCounter.query.all()
+            self.assertLessEqual(len(counters), 8)
+            self.assertEqual(sum(c.upvotes for c in counters), 15)
+            self.assertEqual(sum(c.downvotes for c in counters), 5)
+            self.assertEqual(Response.query.get(1).upvotes, 2)
+            self.assertEqual(pending_moderation([1, 2]), {1: (15, 5)})
+            self.assertEqual(map(type, pending_moderation([1])[1]), [int, int])
+            self.assertEqual(pending_moderation([]), {})
+
+    def test_replies(self):
+        with self.request_context():
+            count_moderation(1, True)
+            count_moderation(2, False)
+            replies = reflection_replies(1)
+        self.assertEqual([(r['up'], r['down']) for r in replies], [(3, 1), (2, 2)])
+
+    def test_fold(self):
+        with self.request_context():
+            for i in range(10):
+                count_moderation(1 + i % 2, i % 3 != 0)
+            before = reflection_replies(1)
+            self.assertEqual(fold_moderation(), 2)
+            self.assertEqual(fold_moderation(), 0)
+            self.assertEqual(reflection_replies(1), before)
+            reply = Response.query.get(1)
+            self.assertEqual((reply.upvotes, reply.downvotes), (before[0]['up'], before[0]['down']))
+            self.assertEqual(pending_moderation([1, 2]), {1: (0, 0), 2: (0, 0)})
+
+    def test_unsharded(self):
+        self.app.config['MODERATION_SHARDS'] = 0
+        with self.request_context():
+            self.assertTrue(count_moderation(1, True))
+            self.assertFalse(count_moderation(3, True))
+            self.assertEqual(Response.query.get(1).upvotes, 3)
+            self.assertEqual(ResponseCounter.query.count(), 0)
+
+    def test_delete(self):
+        with self.request_context():
+            count_moderation(1, True)
+            db.session.delete(Response.query.get(1))
+            db.session.commit()
+            self.assertEqual(ResponseCounter.query.count(), 0)
+
+    def test_background_fold(self):
+        folder = self.app.counter_folder
+        with self.request_context():
+            count_moderation(1, True)
+        self.assertFalse(folder.maybe_fold())
+        folder.interval = 0
+        self.assertTrue(folder.maybe_fold())
+        for attempt in range(100):
+            if not folder.running:
+                break
+            sleep(0.01)
+        self.assertEqual(folder.folded, 1)
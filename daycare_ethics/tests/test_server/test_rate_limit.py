@@ -0,0 +1,119 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from unittest import TestCase
+
+from flask import session, json
+
+from ..common_fixtures import BaseFixture, FixtureConfiguration
+from ... import create_app
+from ...server.security import session_enable
+from .test_session_store import LocalKeyValueServer
+from ...server.rate_limit import *
+
+
+class RateLimiterTestCase (TestCase):
+    def setUp(self):
+        self.buckets = MemoryBuckets()
+        self.limiter = RateLimiter(self.buckets, 60, {'address': 3, 'token': 0})
+
+    def test_take(self):
+        for i in range(3):
+            self.assertEqual(self.limiter.take('address', 'a', 100), 0)
+        self.assertAlmostEqual(self.limiter.take('address', 'a', 100), 20)
+        self.assertAlmostEqual(self.limiter.take('address', 'a', 110), 10)
+        self.assertEqual(self.limiter.take('address', 'a', 120), 0)
+        self.assertEqual(self.limiter.take('address', 'b', 120), 0)
+
+    def test_check(self):
+        for i in range(3):
+            self.assertEqual(self.limiter.check(address='a', token='x'), 0)
+        self.assertGreater(self.limiter.check(address='a', token='y'), 0)
+        self.assertEqual(self.limiter.check(address=None, token='x'), 0)
+        self.assertEqual((self.limiter.admitted, self.limiter.limited), (4, 1))
+
+    def test_prune(self):
+        buckets = MemoryBuckets(size=2)
+        buckets.set('a', (1, 0), 60)
+        buckets.set('b', (1, 0), 60)
+        buckets.set('c', (1, 1e12), 60)
+        self.assertEqual(buckets.states.keys(), ['c'])
+
+    def test_key_value_buckets(self):
+        server = LocalKeyValueServer()
+        buckets = KeyValueBuckets(server)
+        self.assertIsNone(buckets.get('a'))
+        buckets.set('a', (2.5, 1000.25), 60)
+        self.assertEqual(buckets.get('a'), (2.5, 1000.25))
+        self.assertEqual(server.ttl['ratelimit:a'], 60)
+
+
+class RateLimitedViewTestCase (BaseFixture):
+    def test_throttled(self):
+        self.app.config['RATE_LIMIT_TOKEN_REQUESTS'] = 2
+        init_app(self.app)
+        self.app.blocklist = None  # unknown tokens would be blocked first
+        interface = self.app.session_interface
+        data = {'t': 'abcdefgh' + 'x' * 22, 'id': 1, 'choice': 'yes'}
+        headers = {'User-Agent': 'Flask test client'}
+        with self.client as c:
+            for i in range(2):
+                c.post('/case/vote', data=data, headers=headers)
+            lookups = interface.stats()['lookups']
+            data['t'] = 'abcdefgh' + 'y' * 22
+            response = c.post('/case/vote', data=data, headers=headers)
+            self.assertEqual(response.status_code, 429)
+            self.assertGreater(int(response.headers['Retry-After']), 0)
+            self.assertFalse(session.loaded)
+            self.assertEqual(interface.stats()['lookups'], lookups)
+            data['t'] = 'ghijklmn' + 'x' * 22
+            response = c.post('/case/vote', data=data, headers=headers)
+            self.assertNotEqual(response.status_code, 429)
+    
+    def test_throttled_across_rotation(self):
+        self.app.config['RATE_LIMIT_TOKEN_REQUESTS'] = 2
+        init_app(self.app)
+        @self.app.route('/test', methods=['POST'])
+        @rate_limited
+        @session_enable
+        def testview():
+            return {}
+        token = json.loads(self.client.post('/test').get_data())['token']
+        for i in range(2):
+            response = self.client.post('/test', data={'t': token})
+            self.assertEqual(response.status_code, 200)
+            rotated = json.loads(response.get_data())['token']
+            self.assertNotEqual(rotated, token)
+            token = rotated
+        response = self.client.post('/test', data={'t': token})
+        self.assertEqual(response.status_code, 429)
+    
+    def test_address_default(self):
+        self.assertEqual(self.app.rate_limiter.limits['address'], 0)
+        config = type('ProxyDefaultConfiguration', (FixtureConfiguration,), {
+            'PROXY_HOPS': 1,
+        })
+        self.app = create_app(config_obj=config, instance=self.app.instance_path)
+        self.assertEqual(self.app.config['RATE_LIMIT_ADDRESS_REQUESTS'], 60)
+
+
+class ProxyConfiguration (FixtureConfiguration):
+    PROXY_HOPS = 1
+    RATE_LIMIT_ADDRESS_REQUESTS = 1
+
+
+class ProxyRateLimitTestCase (BaseFixture):
+    configuration = ProxyConfiguration
+
+    def test_proxy_hops(self):
+        @self.app.route('/test', methods=['POST'])
+        @rate_limited
+        def testview():
+            return ''
+        def post(address):
+            return self.client.post('/test', headers={
+                'X-Forwarded-For': address,
+            }).status_code
+        self.assertEqual(post('10.0.0.1'), 200)
+        self.assertEqual(post('10.0.0.1'), 429)
+        self.assertEqual(post('10.0.0.2'), 200)
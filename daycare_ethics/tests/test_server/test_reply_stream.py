@@ -0,0 +1,141 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from datetime import datetime, timedelta
+
+from flask import json
+
+from ..common_fixtures import BaseFixture, FixtureConfiguration
+from ... import create_app
+from ...database.models import *
+from ...database.db import db
+from ...server.reply_stream import *
+
+
+class StreamConfiguration (FixtureConfiguration):
+    REPLY_STREAM_INTERVAL = 2
+    REPLY_STREAM_SUBSCRIBERS = 4
+
+
+class ReplyHubTestCase (BaseFixture):
+    configuration = StreamConfiguration
+
+    def setUp(self):
+        super(ReplyHubTestCase, self).setUp()
+        self.hub = self.app.reply_hub
+        self.hub.interval = 60  # polls are triggered by the tests
+        yesterday = datetime.today() - timedelta(days=1)
+        with self.request_context():
+            db.session.add(BrainTeaser(title='first', publication=yesterday))
+            db.session.add(BrainTeaser(title='second', publication=yesterday))
+            db.session.add(BrainTeaser(title='future'))
+            self.reply(1, 'old')
+            db.session.commit()
+            self.hub.poll()
+
+    def reply(self, topic, message):
+        db.session.add(Response(
+            brain_teaser_id=topic,
+            submission=datetime.today(),
+            pseudonym='someone',
+            message=message ))
+
+    def publish(self, *replies):
+        with self.request_context():
+            for topic, message in replies:
+                self.reply(topic, message)
+            db.session.commit()
+            return self.hub.poll()
+
+    def test_fan_out(self):
+        with self.request_context():
+            first = [self.hub.subscribe(1) for i in range(3)]
+            second = self.hub.subscribe(2)
+        for stream in first + [second]:
+            self.assertTrue(next(stream).startswith('retry: '))
+        self.assertEqual(self.hub.stats()['subscribers'], 4)
+        self.assertEqual(self.publish((2, 'other'), (1, 'new')), 2)
+        for stream in first:
+            event = next(stream)
+            self.assertTrue(event.startswith('id: 3\ndata: '))
+            self.assertEqual(json.loads(event.split('data: ')[1])['message'], 'new')
+        self.assertTrue(next(second).startswith('id: 2\n'))
+        for stream in first + [second]:
+            stream.close()
+        self.assertEqual(self.hub.stats(), {
+            'subscribers': 0,
+            'polls': 2,
+            'published': 2,
+        })
+
+    def test_reconnect(self):
+        self.publish((1, 'missed'), (1, 'also missed'))
+        with self.request_context():
+            stream = self.hub.subscribe(1, last_id=2)
+        next(stream)
+        self.assertTrue(next(stream).startswith('id: 3\n'))
+        stream.close()
+
+    def test_idle(self):
+        with self.request_context():
+            self.reply(1, 'while idle')
+            db.session.commit()
+            self.hub.polled -= self.hub.interval
+            stream = self.hub.subscribe(1)
+        next(stream)
+        self.assertEqual(self.hub.last_id, 2)
+        self.publish((1, 'new'))
+        self.assertTrue(next(stream).startswith('id: 3\n'))
+        stream.close()
+
+    def test_heartbeat(self):
+        with self.request_context():
+            stream = self.hub.subscribe(1)
+        next(stream)
+        with self.request_context():
+            self.hub.poll(beat=True)
+        self.assertEqual(next(stream), ':\n\n')
+        stream.close()
+
+    def test_endpoint(self):
+        response = self.client.get('/reflection/1/stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(response.headers['Access-Control-Allow-Origin'], '*')
+        events = iter(response.response)
+        next(events)
+        self.publish((1, 'new'))
+        self.assertTrue(next(events).startswith('id: 2\n'))
+        response.close()
+        self.assertEqual(self.hub.stats()['subscribers'], 0)
+        self.assertEqual(self.client.get('/reflection/3/stream').status_code, 404)
+        self.assertEqual(self.client.get('/reflection/4/stream').status_code, 404)
+
+    def test_limit(self):
+        with self.request_context():
+            streams = [self.hub.subscribe(1) for i in range(4)]
+            for stream in streams:
+                next(stream)
+            self.assertIsNone(self.hub.subscribe(2))
+        self.assertEqual(self.client.get('/reflection/1/stream').status_code, 503)
+        streams.pop().close()
+        response = self.client.get('/reflection/1/stream')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        for stream in streams:
+            stream.close()
+
+    def test_wait_timeout(self):
+        self.hub.heartbeat = 0.05
+        with self.request_context():
+            stream = self.hub.subscribe(1)
+        next(stream)
+        self.assertEqual(next(stream), ':\n\n')
+        stream.close()
+
+    def test_disabled(self):
+        self.app = create_app(config_obj=FixtureConfiguration, instance=self.app.instance_path)
+        self.assertIsNone(self.app.reply_hub)
+        client = self.app.test_client()
+        self.assertEqual(client.get('/reflection/1/stream').status_code, 404)
@@ -0,0 +1,171 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from datetime import date, datetime, timedelta
+from time import sleep
+from unittest import TestCase
+
+from flask import json
+
+from ..common_fixtures import BaseFixture
+from ...database.models import *
+from ...database.db import db
+from ...server.response_cache import *
+
+
+class ResponseCacheTestCase (TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(60)
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get('case', 'a'))
+        self.cache.put('case', 'a', 1)
+        self.assertEqual(self.cache.get('case', 'a'), 1)
+        self.assertEqual(self.cache.stats(), {'size': 1, 'hits': 1, 'misses': 1})
+
+    def test_invalidate(self):
+        self.cache.put('case', 'a', 1)
+        self.cache.put('reflection', 'a', 2)
+        self.cache.invalidate('case', soft=True)
+        self.assertIsNone(self.cache.get('case', 'a'))
+        self.assertEqual(self.cache.get('reflection', 'a'), 2)
+
+    def test_staleness(self):
+        cache = ResponseCache(60, staleness=0.05)
+        cache.put('case', 'a', 1)
+        cache.invalidate('case', soft=True)
+        self.assertEqual(cache.get('case', 'a'), 1)
+        sleep(0.05)
+        self.assertIsNone(cache.get('case', 'a'))
+        cache.put('case', 'a', 2)
+        cache.invalidate('case')
+        self.assertIsNone(cache.get('case', 'a'))
+
+    def test_rollover(self):
+        self.cache.put('case', 'a', 1)
+        day, created, value = self.cache.entries['case', 'a']
+        self.cache.entries['case', 'a'] = day - timedelta(days=1), created, value
+        self.assertIsNone(self.cache.get('case', 'a'))
+
+    def test_timeout(self):
+        cache = ResponseCache(0.01)
+        cache.put('case', 'a', 1)
+        sleep(0.01)
+        self.assertIsNone(cache.get('case', 'a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_stale_entries_dropped(self):
+        cache = ResponseCache(0.01)
+        for key in range(10):
+            cache.put('case', key, key)
+        sleep(0.01)
+        cache.put('case', 'a', 1)
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_size(self):
+        cache = ResponseCache(60, size=2)
+        cache.put('case', 'a', 1)
+        cache.put('case', 'b', 2)
+        cache.get('case', 'a')
+        cache.put('case', 'c', 3)
+        self.assertEqual(cache.get('case', 'a'), 1)
+        self.assertIsNone(cache.get('case', 'b'))
+        self.assertEqual(cache.stats()['size'], 2)
+
+
+class CachedViewsTestCase (BaseFixture):
+    def setUp(self):
+        super(CachedViewsTestCase, self).setUp()
+        with self.request_context():
+            db.session.add(Case(
+                title='casus',
+                publication=date.today() - timedelta(days=1) ))
+            db.session.commit()
+        self.headers = {'User-Agent': 'Flask test client'}
+
+    def yes_votes(self):
+        return json.loads(self.client.get('/case/').data)['yes']
+
+    def test_cached(self):
+        self.assertEqual(self.yes_votes(), 0)
+        with self.request_context():
+            Case.query.get(1).yes_votes = 5
+            db.session.commit()
+        self.assertEqual(self.yes_votes(), 0)
+        stats = self.app.response_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(self.client.get('/case/1').status_code, 200)
+        self.assertEqual(self.client.get('/case/2').status_code, 404)
+        self.assertEqual(self.app.response_cache.stats()['size'], 2)
+
+    def test_vote_invalidates(self):
+        self.assertEqual(self.yes_votes(), 0)
+        with self.client as c:
+            with c.session_transaction() as s:
+                s['token'] = 'abcdef'
+                s['last-request'] = datetime.now() - timedelta(hours=1)
+            c.post('/case/vote', headers=self.headers, data={
+                't': 'abcdef',
+                'id': 1,
+                'choice': 'yes',
+            })
+        self.assertEqual(self.yes_votes(), 1)
+
+    def test_admin_invalidates(self):
+        self.assertEqual(json.loads(self.client.get('/case/1').data)['title'], 'casus')
+        self.client.post('/admin/case/edit/?id=1', data={
+            'title': 'edited',
+            'publication': str(date.today() - timedelta(days=1)),
+            'background': '#ffffff',
+        })
+        self.assertEqual(json.loads(self.client.get('/case/1').data)['title'], 'edited')
+
+
+class ConditionalTestCase (BaseFixture):
+    def setUp(self):
+        super(ConditionalTestCase, self).setUp()
+        with self.request_context():
+            db.session.add(Case(
+                title='casus',
+                publication=date.today() - timedelta(days=1) ))
+            db.session.commit()
+
+    def test_etag(self):
+        response = self.client.get('/case/')
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=0')
+        self.assertIn('Last-Modified', response.headers)
+        response = self.client.get('/case/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        self.assertEqual(response.headers['ETag'], etag)
+        with self.request_context():
+            Case.query.get(1).title = 'edited'
+            db.session.commit()
+            invalidate('case')
+        response = self.client.get('/case/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_last_modified(self):
+        modified = self.client.get('/case/archive').headers['Last-Modified']
+        response = self.client.get('/case/archive', headers={
+            'If-Modified-Since': modified,
+        })
+        self.assertEqual(response.status_code, 304)
+
+    def test_same_etag_without_cache(self):
+        etag = self.client.get('/case/1').headers['ETag']
+        self.app.response_cache = None
+        response = self.client.get('/case/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('Last-Modified', response.headers)
+
+    def test_uncached_views(self):
+        response = self.client.get('/tips/')
+        self.assertIn('ETag', response.headers)
+        response = self.client.get('/tips/', headers={
+            'If-None-Match': response.headers['ETag'],
+        })
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/case/2').status_code, 404)
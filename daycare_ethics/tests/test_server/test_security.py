@@ -210,6 +210,43 @@ class VerifyNaturalTestCase (BaseFixture):
                     self.assertEqual(status, 400)
 
 
+class BlocklistTestCase (BaseFixture):
+    def setUp(self):
+        super(BlocklistTestCase, self).setUp()
+        @self.app.route('/test', methods=['POST'])
+        def testview():
+            verify_natural()
+            return '', 200
+    
+    def test_tainted_token(self):
+        token = '1234567'
+        headers = {'User-Agent': 'Flask test client'}
+        with self.client as c:
+            with c.session_transaction() as s:
+                s['token'] = token
+                s['tainted'] = True
+            interface = self.app.session_interface
+            status = c.post('/test', headers=headers, data={'t': token}).status_code
+            self.assertEqual(status, 400)
+            lookups = interface.stats()['lookups']
+            status = c.post('/test', headers=headers, data={'t': token}).status_code
+            self.assertEqual(status, 400)
+            self.assertFalse(session.loaded)
+            self.assertEqual(interface.stats()['lookups'], lookups)
+            self.assertEqual(self.app.blocklist.stats()['blocked'], 1)
+    
+    def test_origin(self):
+        self.app.config['SESSION_BLOCKLIST_ORIGIN_THRESHOLD'] = 2
+        with self.client as c:
+            for i in range(2):
+                self.assertEqual(c.post('/test').status_code, 400)
+            status = c.post('/test', headers={
+                'User-Agent': 'Flask test client',
+            }).status_code
+            self.assertEqual(status, 400)
+            self.assertFalse(session.loaded)
+
+
 class TokenizeResponseTestCase (BaseFixture):
     def setUp(self):
         super(TokenizeResponseTestCase, self).setUp()
@@ -382,3 +419,66 @@ class SessionProtectTestCase (BaseFixture):
             self.assertIn('token', content)
             self.assertIn('token', session)
             self.assertEqual(content['token'], session['token'])
+
+
+class RotationPolicyTestCase (BaseFixture):
+    def setUp(self):
+        super(RotationPolicyTestCase, self).setUp()
+        @self.app.route('/test', methods=['GET', 'POST'])
+        @session_enable
+        def testview():
+            return {'status': 'success'}
+    
+    def token(self, method):
+        response = getattr(self.client, method)('/test')
+        return json.loads(response.get_data())['token'], response
+    
+    def test_rotation_always(self):
+        first, response = self.token('get')
+        second, response = self.token('get')
+        self.assertNotEqual(first, second)
+        self.assertIn('Set-Cookie', response.headers)
+    
+    def test_rotation_post(self):
+        self.app.config['SESSION_ROTATION'] = 'post'
+        first, response = self.token('get')
+        self.assertIn('Set-Cookie', response.headers)
+        second, response = self.token('get')
+        self.assertEqual(first, second)
+        self.assertNotIn('Set-Cookie', response.headers)
+        third, response = self.token('post')
+        self.assertNotEqual(second, third)
+    
+    def test_rotation_periodic_requests(self):
+        self.app.config['SESSION_ROTATION'] = 'periodic'
+        self.app.config['SESSION_ROTATION_REQUESTS'] = 3
+        first, response = self.token('get')
+        self.assertEqual(self.token('get')[0], first)
+        self.assertEqual(self.token('post')[0], first)
+        self.assertEqual(self.token('post')[0], first)
+        self.assertNotEqual(self.token('post')[0], first)
+    
+    def test_rotation_periodic_interval(self):
+        self.app.config['SESSION_ROTATION'] = 'periodic'
+        first, response = self.token('get')
+        with self.client as c:
+            with c.session_transaction() as s:
+                s['token-issued'] = datetime.today() - timedelta(hours=1)
+        second, response = self.token('get')
+        self.assertEqual(second, first)
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertNotEqual(self.token('post')[0], first)
+    
+    def test_rotation_periodic_lag(self):
+        self.app.config['SESSION_ROTATION'] = 'periodic'
+        first, response = self.token('get')
+        with self.client as c:
+            with c.session_transaction() as s:
+                issued = s['token-issued']
+            self.assertEqual(self.token('post')[0], first)
+            self.assertEqual(session['token-issued'], issued)
+            self.assertGreater(session['last-request'], issued)
+    
+    def test_rotation_invalid(self):
+        self.app.config['SESSION_ROTATION'] = 'never'
+        self.assertRaises(ValueError, init_app, self.app)
@@ -2,8 +2,13 @@
 # Author: Julian Gonggrijp, j.gonggrijp@uu.nl
 
 from unittest import TestCase
+from datetime import datetime, timedelta
 
+from flask import session, json
+
+from ..common_fixtures import BaseFixture, FixtureConfiguration
 from ...server.session import *
+from ...server.security import session_enable, session_protect
 
 
 class BasicsTestCase (TestCase):
@@ -18,3 +23,158 @@ class BasicsTestCase (TestCase):
             self.assertRegexpMatches(k, '[a-zA-Z0-9]{30}')
             self.assertEqual(len(k), KEY_LENGTH)
 
+
+class SignedKeyTestCase (TestCase):
+    def test_sign_and_verify(self):
+        key = generate_key('secret')
+        self.assertRegexpMatches(key, '[a-zA-Z0-9]{30}')
+        self.assertTrue(verify_key(key, 'secret'))
+        self.assertFalse(verify_key(key, 'other secret'))
+        self.assertFalse(verify_key(key[:-1], 'secret'))
+        forged = key[:5] + ('a' if key[5] != 'a' else 'b') + key[6:]
+        self.assertFalse(verify_key(forged, 'secret'))
+        self.assertFalse(verify_key(generate_key(), 'secret'))
+
+
+class FamilyTestCase (TestCase):
+    def test_generate_key_family(self):
+        key = generate_key(family='abcdefgh')
+        self.assertTrue(key.startswith('abcdefgh'))
+        self.assertEqual(len(key), KEY_LENGTH)
+        key = generate_key('secret', 'abcdefgh')
+        self.assertTrue(key.startswith('abcdefgh'))
+        self.assertTrue(verify_key(key, 'secret'))
+    
+    def test_token_family(self):
+        self.assertEqual(token_family('abcdefgh' + 'x' * 22), 'abcdefgh')
+        self.assertIsNone(token_family('abcdef'))
+        self.assertIsNone(token_family('abc-efgh' + 'x' * 22))
+        self.assertIsNone(token_family(None))
+    
+    def test_renew_keeps_family(self):
+        s = Session()
+        first = s['token']
+        second = s.renew_token()
+        self.assertNotEqual(first, second)
+        self.assertEqual(token_family(first), token_family(second))
+
+
+class SignedConfiguration (FixtureConfiguration):
+    SESSION_SIGNED_TOKENS = True
+
+
+class SignedSessionTestCase (BaseFixture):
+    configuration = SignedConfiguration
+
+    def setUp(self):
+        super(SignedSessionTestCase, self).setUp()
+        self.interface = self.app.session_interface
+    
+    def test_forged_token(self):
+        @self.app.route('/test')
+        def testview():
+            return str(session.get('tainted'))
+        with self.client as c:
+            c.get('/test', query_string={'t': generate_key()})
+            self.assertTrue(session['tainted'])
+            self.assertEqual(self.interface.stats()['rejected'], 1)
+            self.assertEqual(self.interface.stats()['lookups'], 0)
+            self.assertIsNone(self.interface.store.get(session['token']))
+    
+    def test_signed_token(self):
+        with self.client as c:
+            with c.session_transaction() as s:
+                token = s['token']
+            self.assertTrue(verify_key(token, SignedConfiguration.SECRET_KEY))
+            with c.session_transaction(method='POST', data={'t': token}) as s:
+                self.assertNotIn('tainted', s)
+                self.assertEqual(s['token'], token)
+            self.assertEqual(self.interface.stats()['rejected'], 0)
+
+
+class ModificationTestCase (BaseFixture):
+    def test_modification_tracking(self):
+        with self.client as c:
+            with c.session_transaction() as s:
+                self.assertFalse(s.modified)
+                s['token'] = 'abcdef'
+                self.assertTrue(s.modified)
+            with c.session_transaction(method='POST', data={'t': 'abcdef'}) as s:
+                self.assertFalse(s.modified)
+                s['test'] = 1
+                self.assertTrue(s.modified)
+
+
+class LazyLoadingTestCase (BaseFixture):
+    def test_untouched_session(self):
+        interface = self.app.session_interface
+        with self.client as c:
+            with c.session_transaction() as s:
+                s['token'] = 'abcdef'
+            before = interface.stats()
+            response = c.get('/case/archive?t=abcdef')
+            self.assertFalse(session.loaded)
+            after = interface.stats()
+            self.assertEqual(after['lookups'], before['lookups'])
+            self.assertEqual(after['avoided_lookups'], before['avoided_lookups'] + 1)
+            self.assertNotIn('Set-Cookie', response.headers)
+            self.assertTrue(session['token'])
+            self.assertTrue(session.loaded)
+            self.assertEqual(interface.stats()['lookups'], after['lookups'] + 1)
+    
+    def test_new_session_not_stored(self):
+        with self.client as c:
+            response = c.get('/case/archive')
+            self.assertNotIn('Set-Cookie', response.headers)
+            self.assertEqual(self.app.session_interface.store.get(session['token']), None)
+    
+    def test_new_session_stored_when_used(self):
+        @self.app.route('/test')
+        def testview():
+            session['test'] = 1
+            return ''
+        with self.client as c:
+            c.get('/test')
+            self.assertTrue(session.loaded)
+            self.assertTrue(self.app.session_interface.store.get(session['token']))
+
+
+class MissingSessionTestCase (BaseFixture):
+    def setUp(self):
+        super(MissingSessionTestCase, self).setUp()
+        @self.app.route('/test', methods=['GET', 'POST'])
+        @session_enable
+        def testview():
+            return {'tainted': 'tainted' in session}
+        @self.app.route('/protected', methods=['POST'])
+        @session_protect
+        def protectedview():
+            return {'status': 'success'}
+    
+    def test_returning_after_purge(self):
+        with self.client as c:
+            with c.session_transaction() as s:
+                s['token'] = 'abcdef'
+            with self.request_context():
+                self.app.session_interface.store.delete('abcdef')
+            response = c.get('/test', query_string={'t': 'abcdef'})
+            content = json.loads(response.get_data())
+            self.assertFalse(content['tainted'])
+            token = content['token']
+            self.assertNotEqual(token, 'abcdef')
+            with c.session_transaction(method='POST', data={'t': token}) as s:
+                self.assertNotIn('tainted', s)
+                s['last-request'] = datetime.today() - timedelta(hours=1)
+            response = c.post('/protected', data={'t': token}, headers={
+                'User-Agent': 'Flask test client',
+            })
+            self.assertEqual(response.status_code, 200)
+    
+    def test_rotated_token_reused(self):
+        with self.client as c:
+            with c.session_transaction() as s:
+                s['token'] = 'abcdef'
+            response = c.get('/test', query_string={'t': 'abcdef'})
+            self.assertNotEqual(json.loads(response.get_data())['token'], 'abcdef')
+            response = c.get('/test', query_string={'t': 'abcdef'})
+            self.assertTrue(json.loads(response.get_data())['tainted'])
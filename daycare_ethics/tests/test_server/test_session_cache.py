@@ -0,0 +1,123 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from datetime import datetime, timedelta
+
+from ..common_fixtures import BaseFixture, FixtureConfiguration
+from ...database import db
+from ...database import models as m
+from ...server.session_store import SQLStore
+from ...server.session_cache import *
+
+
+class CachedConfiguration (FixtureConfiguration):
+    SESSION_CACHE_SIZE = 3
+    SESSION_CACHE_FLUSH_SIZE = 2
+    SESSION_CACHE_FLUSH_INTERVAL = 3600
+
+
+class SessionCacheTestCase (BaseFixture):
+    def setUp(self):
+        super(SessionCacheTestCase, self).setUp()
+        self.cache = SessionCache(SQLStore(), 2, flush_size=2, flush_interval=3600)
+        self.later = datetime.utcnow() + timedelta(hours=1)
+
+    def test_get_miss(self):
+        self.assertIsNone(self.cache.lookup('abc'))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_fill_and_get(self):
+        self.cache.fill('abc', self.later, {'token': 'abc'})
+        self.assertEqual(self.cache.lookup('abc'), (self.later, {'token': 'abc'}))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['pending'], 0)
+
+    def test_lru_eviction(self):
+        self.cache.fill('a', None, {})
+        self.cache.fill('b', None, {})
+        self.cache.lookup('a')
+        self.cache.fill('c', None, {})
+        self.assertIsNotNone(self.cache.lookup('a'))
+        self.assertIsNone(self.cache.lookup('b'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_ttl_eviction(self):
+        earlier = datetime.utcnow() - timedelta(seconds=1)
+        self.cache.fill('a', earlier, {})
+        self.assertIsNone(self.cache.lookup('a'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_pending_survives_eviction(self):
+        self.cache.put('a', None, {'token': 'a'})
+        self.cache.fill('b', None, {})
+        self.cache.fill('c', None, {})
+        self.assertEqual(self.cache.lookup('a'), (None, {'token': 'a'}))
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+    def test_pending_deletion(self):
+        self.cache.fill('a', None, {})
+        self.cache.delete('a')
+        self.assertEqual(self.cache.lookup('a'), (None, None))
+
+    def test_copies(self):
+        payload = {'list': [1, 2]}
+        self.cache.put('a', None, payload)
+        payload['list'].append(3)
+        self.assertEqual(self.cache.lookup('a')[1], {'list': [1, 2]})
+
+    def test_read_through(self):
+        with self.request_context():
+            db.session.add(m.Session(token='abc', expires=self.later, payload={'a': 1}))
+            db.session.commit()
+            self.assertEqual(self.cache.get('abc'), (self.later, {'a': 1}))
+            self.cache.delete('abc')
+            self.assertIsNone(self.cache.get('abc'))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_flush(self):
+        with self.request_context():
+            db.session.add(m.Session(token='old', payload={'token': 'old'}))
+            db.session.commit()
+            self.cache.delete('old')
+            self.assertFalse(self.cache.needs_flush())
+            self.cache.put('new', self.later, {'token': 'new'})
+            self.assertTrue(self.cache.needs_flush())
+            self.assertEqual(self.cache.flush(), 2)
+            self.assertIsNone(m.Session.query.get('old'))
+            self.assertEqual(m.Session.query.get('new').payload, {'token': 'new'})
+        stats = self.cache.stats()
+        self.assertEqual(stats['flushes'], 1)
+        self.assertEqual(stats['flushed_rows'], 2)
+        self.assertEqual(stats['pending'], 0)
+
+
+class CachedSessionInterfaceTestCase (BaseFixture):
+    configuration = CachedConfiguration
+
+    def setUp(self):
+        super(CachedSessionInterfaceTestCase, self).setUp()
+        self.cache = self.app.session_interface.store
+
+    def tearDown(self):
+        with self.request_context():
+            self.cache.flush()
+        super(CachedSessionInterfaceTestCase, self).tearDown()
+
+    def test_write_behind(self):
+        with self.client as c:
+            with c.session_transaction() as s:
+                s['token'] = 'abcdef'
+                s['test'] = 1
+            with self.request_context():
+                self.assertIsNone(m.Session.query.get('abcdef'))
+            with c.session_transaction(method='POST', data={'t': 'abcdef'}) as s:
+                self.assertEqual(s['test'], 1)
+                s['token'] = 'ghijkl'
+                s['test'] = 2
+            with self.request_context():
+                self.assertIsNone(m.Session.query.get('abcdef'))
+                self.assertEqual(m.Session.query.get('ghijkl').payload['test'], 2)
+        stats = self.cache.stats()
+        self.assertGreater(stats['hits'], 0)
+        self.assertEqual(stats['misses'], 0)
+        self.assertEqual(stats['flushes'], 1)
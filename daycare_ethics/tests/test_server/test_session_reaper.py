@@ -0,0 +1,58 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from datetime import datetime, timedelta
+
+from ..common_fixtures import BaseFixture
+from ...database import db
+from ...database import models as m
+from ...server.session_store import SQLStore
+from ...server.session_reaper import *
+
+
+class SessionReaperTestCase (BaseFixture):
+    def setUp(self):
+        super(SessionReaperTestCase, self).setUp()
+        now = datetime.utcnow()
+        with self.request_context():
+            for count in range(7):
+                db.session.add(m.Session(
+                    token='expired' + str(count),
+                    expires=now - timedelta(minutes=count + 1) ))
+            db.session.add(m.Session(token='valid', expires=now + timedelta(days=1)))
+            db.session.add(m.Session(token='legacy'))
+            db.session.commit()
+
+    def remaining(self):
+        return set(row.token for row in m.Session.query.all())
+
+    def test_purge_expired(self):
+        with self.request_context():
+            purged, duration = SQLStore().purge(batch_size=3)
+            self.assertEqual(purged, 7)
+            self.assertGreaterEqual(duration, 0)
+            self.assertEqual(self.remaining(), set(['valid', 'legacy']))
+
+    def test_purge_expired_legacy(self):
+        with self.request_context():
+            purged, duration = SQLStore().purge(legacy=True)
+            self.assertEqual(purged, 8)
+            self.assertEqual(self.remaining(), set(['valid']))
+
+    def test_sweep(self):
+        reaper = SessionReaper(self.app, 3600)
+        self.assertFalse(reaper.maybe_sweep())
+        reaper.sweep()
+        self.assertEqual(reaper.purged, 7)
+        self.assertFalse(reaper.running)
+        with self.request_context():
+            self.assertEqual(self.remaining(), set(['valid', 'legacy']))
+
+    def test_session_expiry_stored(self):
+        with self.client as c:
+            with c.session_transaction() as s:
+                s['token'] = 'abcdef'
+        with self.request_context():
+            expires = m.Session.query.get('abcdef').expires
+        lifetime = self.app.permanent_session_lifetime
+        self.assertGreater(expires, datetime.utcnow() + lifetime - timedelta(minutes=1))
@@ -0,0 +1,236 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from datetime import datetime, timedelta
+from os.path import join
+
+from ..common_fixtures import BaseFixture
+from ...database import db
+from ...database import models as m
+from ...server.session_store import *
+
+
+class LocalKeyValueServer (object):
+    """ In-process stand-in for a Redis client. """
+    def __init__(self):
+        self.data = {}
+        self.ttl = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.ttl[key] = ex
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        self.ttl.pop(key, None)
+
+
+class StoreBehaviour (object):
+    """ Tests that every SessionStore should pass. """
+    def setUp(self):
+        super(StoreBehaviour, self).setUp()
+        self.context = self.request_context()
+        self.context.push()
+        self.store = self.make_store()
+        self.later = datetime.utcnow().replace(microsecond=0) + timedelta(hours=1)
+        self.earlier = self.later - timedelta(hours=2)
+
+    def tearDown(self):
+        self.context.pop()
+        super(StoreBehaviour, self).tearDown()
+
+    def test_get_missing(self):
+        self.assertIsNone(self.store.get('abc'))
+
+    def test_put_get(self):
+        payload = {'token': 'abc', 'last-request': datetime(2016, 1, 1)}
+        self.store.put('abc', self.later, payload)
+        self.assertEqual(self.store.get('abc'), (self.later, payload))
+        self.store.put('abc', self.later, {'token': 'abc'})
+        self.assertEqual(self.store.get('abc'), (self.later, {'token': 'abc'}))
+
+    def test_rotate(self):
+        self.store.rotate(None, 'old', self.later, {'token': 'old'})
+        self.store.rotate('old', 'new', self.later, {'token': 'new'})
+        self.assertIsNone(self.store.get('old'))
+        self.assertEqual(self.store.get('new'), (self.later, {'token': 'new'}))
+        self.store.rotate('new', 'new', self.later, {'token': 'new', 'a': 1})
+        self.assertEqual(self.store.get('new')[1], {'token': 'new', 'a': 1})
+
+    def test_delete(self):
+        self.store.put('abc', self.later, {})
+        self.store.delete('abc')
+        self.store.delete('abc')
+        self.assertIsNone(self.store.get('abc'))
+
+    def test_write_batch(self):
+        self.store.put('old', self.later, {})
+        self.store.write_batch({
+            'old': None,
+            'new': (self.later, {'token': 'new'}),
+        })
+        self.assertIsNone(self.store.get('old'))
+        self.assertEqual(self.store.get('new'), (self.later, {'token': 'new'}))
+
+    def test_purge(self):
+        self.store.put('expired', self.earlier, {})
+        self.store.put('valid', self.later, {})
+        purged, duration = self.store.purge()
+        self.assertEqual(purged, 1)
+        self.assertIsNone(self.store.get('expired'))
+        self.assertIsNotNone(self.store.get('valid'))
+
+
+class SQLStoreTestCase (StoreBehaviour, BaseFixture):
+    def make_store(self):
+        return SQLStore()
+
+    def test_single_row(self):
+        self.store.rotate(None, 'old', None, {'token': 'old'})
+        self.store.rotate('old', 'new', None, {'token': 'new'})
+        self.store.rotate('gone', 'newer', None, {'token': 'newer'})
+        self.assertEqual(m.Session.query.count(), 2)
+
+    def insert_legacy(self, token, expires):
+        """ Insert a row with a text token, as older versions did. """
+        db.session.execute(
+            'INSERT INTO session (token, expires) VALUES (:token, :expires)',
+            {'token': token, 'expires': expires} )
+        db.session.commit()
+
+    def test_purge_legacy_rows(self):
+        for count in range(5):
+            self.insert_legacy('expired' + str(count), self.earlier)
+        self.insert_legacy('valid', self.later)
+        purged, duration = self.store.purge(batch_size=2)
+        self.assertEqual(purged, 5)
+        self.assertEqual(m.Session.query.count(), 1)
+        self.assertIsNotNone(self.store.get('valid'))
+
+    def test_write_batch_legacy_rows(self):
+        self.insert_legacy('old', self.later)
+        self.store.write_batch({
+            'old': None,
+            'new': (self.later, {'token': 'new'}),
+        })
+        self.assertIsNone(self.store.get('old'))
+        self.assertEqual(m.Session.query.count(), 1)
+
+
+class MemoryStoreTestCase (StoreBehaviour, BaseFixture):
+    def make_store(self):
+        return MemoryStore()
+
+    def test_copies(self):
+        payload = {'list': [1]}
+        self.store.put('abc', None, payload)
+        payload['list'].append(2)
+        self.assertEqual(self.store.get('abc')[1], {'list': [1]})
+
+
+class FileStoreTestCase (StoreBehaviour, BaseFixture):
+    def make_store(self):
+        return FileStore(join(self.app.instance_path, 'sessions'))
+
+
+class KeyValueStoreTestCase (StoreBehaviour, BaseFixture):
+    def make_store(self):
+        self.server = LocalKeyValueServer()
+        return KeyValueStore(self.server)
+
+    def test_purge(self):
+        self.store.put('abc', self.earlier, {})
+        self.assertEqual(self.store.purge()[0], 0)
+        self.assertEqual(self.server.ttl['session:abc'], 1)
+
+    def test_ttl(self):
+        self.store.put('abc', self.later, {})
+        self.assertGreater(self.server.ttl['session:abc'], 3500)
+
+
+class ShardedStoreTestCase (StoreBehaviour, BaseFixture):
+    def make_store(self):
+        self.shards = [MemoryStore() for i in range(4)]
+        return ShardedStore(self.shards)
+
+    def test_spread(self):
+        for i in range(100):
+            self.store.put(str(i) * 8, self.later, {})
+        for shard in self.shards:
+            self.assertGreater(len(shard.sessions), 0)
+        self.assertEqual(len(self.store.tokens()), 100)
+
+    def test_rotate_across_shards(self):
+        self.store.put('a' * 8, self.later, {})
+        token = next(
+            str(i) * 8 for i in range(10)
+            if self.store.shard(str(i) * 8) is not self.store.shard('a' * 8) )
+        self.store.rotate('a' * 8, token, self.later, {'token': token})
+        self.assertIsNone(self.store.get('a' * 8))
+        self.assertEqual(self.store.get(token)[1], {'token': token})
+        self.assertEqual(sum(len(s.sessions) for s in self.shards), 1)
+
+    def test_lazy_move(self):
+        old = ShardedStore(self.shards[:2])
+        tokens = [str(i) * 8 for i in range(20)]
+        for token in tokens:
+            old.put(token, self.later, {'token': token})
+        new = ShardedStore(self.shards, self.shards[:2])
+        for token in tokens:
+            self.assertEqual(new.get(token)[1], {'token': token})
+            self.assertIn(token, new.shard(token).sessions)
+        self.assertEqual(sum(len(s.sessions) for s in self.shards), 20)
+        self.assertEqual(new.reshard()[0], 0)
+
+    def test_reshard(self):
+        old = ShardedStore(self.shards[:2])
+        tokens = [str(i) * 8 for i in range(20)]
+        for token in tokens:
+            old.put(token, self.later, {'token': token})
+        new = ShardedStore(self.shards, self.shards[:2])
+        moved, duration = new.reshard(batch_size=3)
+        self.assertGreater(moved, 0)
+        for token in tokens:
+            self.assertIn(token, new.shard(token).sessions)
+        self.assertEqual(sum(len(s.sessions) for s in self.shards), 20)
+        self.assertEqual(new.reshard()[0], 0)
+
+
+class SQLShardsTestCase (StoreBehaviour, BaseFixture):
+    def make_store(self):
+        self.app.config['SESSION_STORE'] = 'sharded'
+        self.app.config['SESSION_SHARD_URI'] = 'sqlite:///' + join(
+            self.app.instance_path, 'session_{}.sqlite' )
+        return make_store(self.app)
+
+    def test_tables(self):
+        for i in range(10):
+            self.store.put(str(i) * 8, self.later, {})
+        self.assertEqual(len(self.store.shards), 4)
+        counts = [len(shard.tokens()) for shard in self.store.shards]
+        self.assertEqual(sum(counts), 10)
+        self.assertEqual(m.Session.query.count(), 0)
+
+
+class MakeStoreTestCase (BaseFixture):
+    def test_make_store(self):
+        config = self.app.config
+        self.assertIsInstance(make_store(self.app), SQLStore)
+        config['SESSION_STORE'] = 'memory'
+        self.assertIsInstance(make_store(self.app), MemoryStore)
+        config['SESSION_STORE'] = 'file'
+        store = make_store(self.app)
+        self.assertEqual(store.directory, join(self.app.instance_path, 'sessions'))
+        config['SESSION_STORE'] = 'sharded'
+        config['SESSION_SHARDS_PREVIOUS'] = 2
+        store = make_store(self.app)
+        self.assertIsInstance(store, ShardedStore)
+        self.assertEqual(len(store.shards), 4)
+        self.assertIs(store.previous[1], store.shards[1])
+        config['SESSION_STORE'] = lambda app: KeyValueStore(LocalKeyValueServer())
+        self.assertIsInstance(make_store(self.app), KeyValueStore)
+        config['SESSION_STORE'] = 'nonsense'
+        self.assertRaises(ValueError, make_store, self.app)
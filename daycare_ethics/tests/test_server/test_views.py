@@ -3,6 +3,7 @@
 # Credits: Jeremy Allen helped to fix issues. (http://stackoverflow.com/a/32597959/1166087)
 
 from datetime import datetime, timedelta
+from threading import Thread
 
 from flask import json
 
@@ -10,6 +11,7 @@ from ..common_fixtures import BaseFixture
 from ...database.models import *
 from ...database.db import db
 from ...server.views import *
+from ...server.moderation import fold_moderation
 
 
 class AllowCrossDomainTestCase(BaseFixture):
@@ -134,8 +136,9 @@ class CasusTestCase (BaseFixture):
                 'id': 3,
                 'choice': 'yes',
             })
-            self.assertTrue(session['tainted'])
+            self.assertFalse(session.loaded)
         self.assertEqual(response1.status_code, 400)
+        self.assertEqual(self.app.admission.stats()['user-agent'], 1)
 
     def test_vote_casus_passthrough(self):
         """ Warning: this is not a full coverage test.
@@ -265,6 +268,51 @@ class ReflectionTestCase (BaseFixture):
         self.assertEqual(output1[0]['id'], 1)
         self.assertEqual(output1[1]['id'], 5)
 
+    def test_cursor(self):
+        with self.request_context():
+            reply = Response.query.get(5)
+        self.assertEqual(decode_cursor(encode_cursor(reply)), (reply.submission, 5))
+        self.assertRaises(ValueError, decode_cursor, 'garbage')
+        self.assertRaises(ValueError, decode_cursor, u'\xe9')
+
+    def test_reflection_page(self):
+        with self.request_context():
+            submission = Response.query.get(5).submission
+            for count in range(3):  # same submission time as reply 5
+                db.session.add(Response(
+                    submission=submission,
+                    pseudonym='tie',
+                    message='tie',
+                    brain_teaser_id=1 ))
+            db.session.commit()
+            everything, cursor = reflection_page(1)
+            self.assertIsNone(cursor)
+            pages, cursor = [], None
+            while True:
+                page, cursor = reflection_page(1, cursor, 2)
+                pages.append(page)
+                if cursor is None:
+                    break
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), everything)
+        self.assertEqual([reply['id'] for reply in everything], [1, 5, 9, 10, 11])
+
+    def test_retrieve_reflection_paginated(self):
+        first = json.loads(self.client.get('/reflection/1/?limit=1').data)
+        self.assertEqual([reply['id'] for reply in first['responses']], [1])
+        url = '/reflection/1/?limit=1&after=' + first['next']
+        second = json.loads(self.client.get(url).data)
+        self.assertEqual([reply['id'] for reply in second['responses']], [5])
+        self.assertIsNone(second['next'])
+        everything = json.loads(self.client.get('/reflection/1/').data)
+        self.assertEqual(len(everything['responses']), 2)
+        self.assertEqual(self.client.get('/reflection/1/?limit=0').status_code, 400)
+        self.assertEqual(self.client.get('/reflection/1/?after=xyz').status_code, 400)
+        size = self.app.response_cache.stats()['size']
+        for limit in (100, 101, 2000):
+            self.client.get('/reflection/1/?limit={}'.format(limit))
+        self.assertEqual(self.app.response_cache.stats()['size'], size + 1)
+
     def test_reflection_archive(self):
         response = self.client.get('/reflection/archive')
         self.assertEqual(response.status_code, 200)
@@ -288,8 +336,9 @@ class ReflectionTestCase (BaseFixture):
                 'p': 'test4',
                 'r': 'testmessage',
             })
-            self.assertTrue(session['tainted'])
+            self.assertFalse(session.loaded)
         self.assertEqual(response1.status_code, 400)
+        self.assertEqual(self.app.admission.stats()['user-agent'], 1)
 
     def test_reply_to_reflection_passthrough(self):
         """ Warning: this is not a full coverage test.
@@ -396,8 +445,9 @@ class ReflectionTestCase (BaseFixture):
             response1 = c.post('/reply/3/moderate/', data={
                 'choice': 'up',
             })
-            self.assertTrue(session['tainted'])
+            self.assertFalse(session.loaded)
         self.assertEqual(response1.status_code, 400)
+        self.assertEqual(self.app.admission.stats()['user-agent'], 1)
 
     def test_moderate_reply_passthrough(self):
         """ Warning: this is not a full coverage test.
@@ -429,6 +479,7 @@ class ReflectionTestCase (BaseFixture):
             self.assertEqual(response_data['status'], 'success')
             self.assertEqual(response_data['token'], session['token'])
             
+            fold_moderation()
             reply = Response.query.get(3)
             self.assertEqual(reply.upvotes, 1)
             self.assertEqual(reply.downvotes, 0)
@@ -505,6 +556,7 @@ class TipsTestCase (BaseFixture):
             
             Tip.query.get(5).update = datetime.today()
             db.session.commit()
+            invalidate('tips')
             response2 = c.get('/tips/')
             self.assertEqual(response2.status_code, 200)
             self.assertEqual(response2.headers['Access-Control-Allow-Origin'], '*')
@@ -517,3 +569,58 @@ class TipsTestCase (BaseFixture):
             self.assertEqual(response2_data['site'][0]['id'], 5)
             self.assertEqual(response2_data['site'][1]['id'], 6)
 
+
+
+class CounterConcurrencyTestCase (BaseFixture):
+    """ Many threads increment the same counters in an on-disk database. """
+    
+    threads = 10
+    rounds = 20
+    on_disk = True
+    
+    def setUp(self):
+        super(CounterConcurrencyTestCase, self).setUp()
+        with self.request_context():
+            topic = BrainTeaser(title='topic')
+            db.session.add(Case(title='casus'))
+            db.session.add(Response(
+                brain_teaser=topic,
+                submission=datetime.today(),
+                pseudonym='someone',
+                message='hot take' ))
+            db.session.commit()
+    
+    def hammer(self, count):
+        errors = []
+        def work(worker):
+            try:
+                with self.request_context():
+                    for i in range(self.rounds):
+                        count(worker, i)
+                    db.session.remove()
+            except Exception as error:
+                errors.append(error)
+        workers = [Thread(target=work, args=(n,)) for n in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+    
+    def test_votes(self):
+        now = datetime.today()
+        self.hammer(lambda worker, i: count_vote(1, (worker + i) % 2 == 0, now))
+        total = self.threads * self.rounds
+        with self.request_context():
+            casus = Case.query.get(1)
+            self.assertEqual(casus.yes_votes + casus.no_votes, total)
+            self.assertEqual(casus.yes_votes, Vote.query.filter_by(agree=True).count())
+            self.assertEqual(Vote.query.count(), total)
+    
+    def test_moderation(self):
+        self.hammer(lambda worker, i: count_moderation(1, i % 4 != 0))
+        with self.request_context():
+            fold_moderation()
+            reply = Response.query.get(1)
+            self.assertEqual(reply.upvotes + reply.downvotes, self.threads * self.rounds)
+            self.assertEqual(reply.downvotes, self.threads * self.rounds / 4)
@@ -0,0 +1,200 @@
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+from datetime import date, datetime, timedelta
+from os import listdir
+from os.path import exists
+from time import sleep
+
+from ..common_fixtures import BaseFixture, FixtureConfiguration
+from ... import create_app
+from ...database.models import *
+from ...database.db import db
+from ...server.vote_buffer import *
+
+
+class BufferedConfiguration (FixtureConfiguration):
+    VOTE_BUFFER_INTERVAL = 60
+    VOTE_BUFFER_SIZE = 3
+
+
+class VoteBufferTestCase (BaseFixture):
+    configuration = BufferedConfiguration
+    on_disk = True
+
+    def setUp(self):
+        super(VoteBufferTestCase, self).setUp()
+        self.buffer = self.app.vote_buffer
+        with self.request_context():
+            db.session.add(Case(title='open'))
+            db.session.add(Case(title='closed', closure=date.today()))
+            db.session.commit()
+
+    def tearDown(self):
+        del self.buffer.pending[:]
+        super(VoteBufferTestCase, self).tearDown()
+
+    def counts(self, id):
+        with self.request_context():
+            case = Case.query.get(id)
+            return case.yes_votes, case.no_votes, len(case.votes)
+
+    def test_disabled(self):
+        app = create_app(config_obj=FixtureConfiguration, instance=self.app.instance_path)
+        self.assertIsNone(app.vote_buffer)
+        db.drop_all(app=app)
+
+    def test_open_case(self):
+        today = date.today()
+        with self.request_context():
+            self.assertTrue(self.buffer.open_case(1, today))
+            self.assertFalse(self.buffer.open_case(2, today))
+            self.assertFalse(self.buffer.open_case(3, today))
+            self.assertTrue(self.buffer.open_case(2, today - timedelta(days=1)))
+        self.assertEqual(sorted(self.buffer.closures), [1, 2])
+
+    def test_closures_expire(self):
+        today = date.today()
+        with self.request_context():
+            self.buffer.open_case(1, today)
+            self.buffer.closures[1] = (0, None)
+            self.buffer.open_case(2, today)
+            self.assertEqual(list(self.buffer.closures), [2])
+            for id in range(3, 10):
+                self.buffer.open_case(id, today)
+        self.assertEqual(list(self.buffer.closures), [2])
+
+    def test_flush(self):
+        now = datetime.now()
+        self.buffer.pending.extend([(1, True, now), (1, False, now), (1, True, now)])
+        self.assertEqual(self.counts(1), (0, 0, 0))
+        with self.request_context():
+            self.assertEqual(self.buffer.flush(), 3)
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.counts(1), (2, 1, 3))
+        self.assertEqual(self.buffer.stats(), {
+            'pending': 0,
+            'flushes': 1,
+            'flushed': 3,
+        })
+
+    def test_flush_failure(self):
+        now = datetime.now()
+        self.buffer.pending.append((1, True, now))
+        with self.request_context():
+            db.session.execute('DROP TABLE vote')
+            self.assertRaises(Exception, self.buffer.flush)
+        self.assertEqual(self.buffer.pending, [(1, True, now)])
+
+    def test_size_trigger(self):
+        now = datetime.now()
+        for i in range(3):
+            self.buffer.add(1, True, now)
+        for attempt in range(100):
+            if not self.buffer.stats()['pending']:
+                break
+            sleep(0.01)
+        sleep(0.05)
+        self.assertEqual(self.counts(1), (3, 0, 3))
+
+    def test_journal(self):
+        now = datetime.now()
+        self.buffer.add(1, True, now)
+        self.buffer.add(1, False, now)
+        journal = self.buffer.journal
+        segment = journal.segment.name
+        self.assertEqual(read_segment(segment), [(1, True, now), (1, False, now)])
+        with self.request_context():
+            self.buffer.flush()
+        self.assertFalse(exists(segment))
+        self.assertTrue(exists(journal.name + '.lock'))
+
+    def crash(self):
+        """ Drop the pending votes and release the journal, like a
+        process that dies.
+        """
+        del self.buffer.pending[:]
+        self.buffer.journal.lock.close()
+
+    def test_recover(self):
+        now = datetime.now()
+        self.buffer.add(1, True, now)
+        self.buffer.add(1, True, now)
+        journal = self.buffer.journal
+        with self.request_context():
+            self.assertEqual(recover_votes(journal.directory), 0)
+            self.crash()
+            self.assertEqual(recover_votes(journal.directory), 2)
+        self.assertEqual(self.counts(1), (2, 0, 2))
+        self.assertEqual(listdir(journal.directory), [])
+
+    def test_recover_committed(self):
+        now = datetime.now()
+        self.buffer.add(1, False, now)
+        journal = self.buffer.journal
+        id = segment_id(journal.segment.name)
+        with self.request_context():
+            write_votes(list(self.buffer.pending), [id])
+            self.crash()
+            self.assertEqual(recover_votes(journal.directory), 0)
+            self.assertIsNone(VoteBatch.query.get(id))
+        self.assertEqual(self.counts(1), (0, 1, 1))
+        self.assertEqual(listdir(journal.directory), [])
+
+    def test_recover_duplicate(self):
+        # An identical vote that was flushed before must not be mistaken
+        # for the pending one.
+        now = datetime.now()
+        self.buffer.add(1, False, now)
+        with self.request_context():
+            self.buffer.flush()
+            self.buffer.add(1, False, now)
+            self.crash()
+            self.assertEqual(recover_votes(self.buffer.journal.directory), 1)
+        self.assertEqual(self.counts(1), (0, 2, 2))
+
+    def test_batch_cleanup(self):
+        now = datetime.now()
+        with self.request_context():
+            self.buffer.add(1, True, now)
+            self.buffer.flush()
+            self.assertEqual(VoteBatch.query.count(), 1)
+            self.buffer.add(1, True, now)
+            self.buffer.flush()
+            self.assertEqual(VoteBatch.query.count(), 1)
+            self.buffer.stop()
+            self.assertEqual(VoteBatch.query.count(), 0)
+        self.assertEqual(listdir(self.buffer.journal.directory), [])
+
+    def vote(self, id):
+        with self.client as c:
+            with c.session_transaction() as s:
+                s['token'] = 'abcdef'
+                s['last-request'] = datetime.now() - timedelta(hours=1)
+            return c.post('/case/vote', headers=self.headers, data={
+                't': 'abcdef',
+                'id': id,
+                'choice': 'no',
+            })
+
+    def test_view(self):
+        self.headers = {'User-Agent': 'Flask test client'}
+        self.assertEqual(self.vote(2).status_code, 400)
+        self.assertEqual(self.vote(1).status_code, 200)
+        self.assertEqual(self.buffer.stats()['pending'], 1)
+        self.assertEqual(self.counts(1), (0, 0, 0))
+        with self.request_context():
+            self.buffer.flush()
+        self.assertEqual(self.counts(1), (0, 1, 1))
+
+    def test_reconcile(self):
+        now = datetime.now()
+        with self.request_context():
+            db.session.add(Vote(case_id=1, agree=True, submission=now))
+            db.session.add(Vote(case_id=1, agree=False, submission=now))
+            db.session.add(Vote(case_id=1, agree=True, submission=now))
+            Case.query.get(2).yes_votes = 7
+            db.session.commit()
+            self.assertEqual(reconcile_votes(), 2)
+        self.assertEqual(self.counts(1), (2, 1, 3))
+        self.assertEqual(self.counts(2), (0, 0, 0))
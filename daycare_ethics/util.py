@@ -5,9 +5,16 @@ import os.path as op
 
 
 TARGET_WIDTHS = 300, 424, 600, 848
+VARIANT_FORMATS = 'jpeg', 'webp'
+# Encoder quality per format and target width. Wider variants are
+# shown on denser screens, where compression artifacts are less visible.
+VARIANT_QUALITY = {
+    'jpeg': (85, 82, 80, 78),
+    'webp': (80, 78, 76, 74),
+}
 
 
-def image_variants(fname):
+def image_variants(fname, format='jpeg'):
     name = op.splitext(fname)[0]
-    pattern = name + '_{}.jpeg'
+    pattern = name + '_{}.' + format
     return [pattern.format(w) for w in TARGET_WIDTHS]
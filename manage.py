@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# (c) 2016 Digital Humanities Lab, Utrecht University
+# Author: Julian Gonggrijp, j.gonggrijp@uu.nl
+
+"""
+    Maintenance commands for a deployed serverside application.
+
+    Usage: python manage.py path/to/config.py <command> [options]
+    Run with --help for the list of commands.
+"""
+
+from argparse import ArgumentParser
+
+from daycare_ethics import create_app
+from daycare_ethics.server.session_store import PURGE_BATCH_SIZE, ShardedStore
+from daycare_ethics.server.vote_buffer import reconcile_votes
+
+
+def purge_sessions(app, args):
+    store = app.session_interface.store
+    with app.app_context():
+        purged, duration = store.purge(args.batch_size, args.legacy)
+    print 'Purged {} expired sessions in {:.3f} seconds.'.format(purged, duration)
+
+
+def reshard_sessions(app, args):
+    store = app.session_interface.store
+    if not isinstance(store, ShardedStore) or not store.previous:
+        raise SystemExit('Set SESSION_STORE to \'sharded\' and SESSION_SHARDS_PREVIOUS first.')
+    with app.app_context():
+        moved, duration = store.reshard(args.batch_size)
+    print 'Moved {} sessions in {:.3f} seconds.'.format(moved, duration)
+
+
+def reconcile(app, args):
+    with app.app_context():
+        count = reconcile_votes()
+    print 'Recounted the votes of {} cases.'.format(count)
+
+
+def make_parser():
+    parser = ArgumentParser(description='Maintain a daycare_ethics server.')
+    parser.add_argument('config', help='path to the configuration file')
+    commands = parser.add_subparsers(title='commands')
+
+    purge = commands.add_parser('purge-sessions', help='delete expired sessions')
+    purge.add_argument(
+        '--batch-size',
+        type=int,
+        default=PURGE_BATCH_SIZE,
+        help='rows to delete per transaction (default %(default)s)' )
+    purge.add_argument(
+        '--legacy',
+        action='store_true',
+        help='also delete sessions without an expiry time' )
+    purge.set_defaults(command=purge_sessions)
+
+    reshard = commands.add_parser(
+        'reshard-sessions',
+        help='move sessions to their shard after changing SESSION_SHARDS' )
+    reshard.add_argument(
+        '--batch-size',
+        type=int,
+        default=PURGE_BATCH_SIZE,
+        help='sessions to move per transaction (default %(default)s)' )
+    reshard.set_defaults(command=reshard_sessions)
+
+    recount = commands.add_parser(
+        'reconcile-votes',
+        help='recompute the vote counts of all cases from the individual votes' )
+    recount.set_defaults(command=reconcile)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = make_parser().parse_args()
+    app = create_app(config_file=args.config)
+    args.command(app, args)